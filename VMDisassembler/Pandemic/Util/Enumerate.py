@@ -3,15 +3,25 @@
 class EnumElt(object):
 	"""This is the base class for all enumeration elements.  In actuality, each
 	enumeration shall correspond to a class derived from this one, and each 
-	enumeration element shall be an object of that type."""
-	def __init__(self,value):
-		if value > self._l:
-			print "%s: value %d too large (%d)" % (self.__class__.__name__, value, self._l)
-		self._locked = False
-		self._value = value
-		self._locked = True
+	enumeration element shall be an object of that type.
+	
+	Elements are interned:  constructing an element whose value is in range
+	returns the existing element, so there is exactly one object for each
+	element of an enumeration."""
+	__slots__ = ('_value',)
+	_elements = ()
+
+	def __new__(cls,value):
+		if 0 <= value < len(cls._elements):
+			return cls._elements[value]
+		if value > cls._l:
+			print "%s: value %d too large (%d)" % (cls.__name__, value, cls._l)
+		self = object.__new__(cls)
+		object.__setattr__(self,'_value',value)
+		return self
+
 	def __call__(self,value): 
-		"""This method returns a new enumeration element of the same type, 
+		"""This method returns the enumeration element of the same type 
 		corresponding to the integer *value*.
 		
 		:param integer value: integer for which to create an :class:`EnumElt`
@@ -27,24 +37,19 @@ class EnumElt(object):
 		"""
 		return self._value
 
-	# This is pretty stupid -- we try to prevent the user from modifying the 
-	# integer value associated with an enumeration element.  Except, in so doing,
-	# we lose the ability to modify any data within the object.  So we keep 
-	# another variable called _locked that determines whether variables can be
-	# written.  It's dumb; don't think too hard about it.
+	# Elements are shared, so prevent the user from modifying them.
 	def __setattr__(self,name,value):
-		if self._locked:
-			print "Trying to assign %r.%s = %s" % (self,name,value)
-			raise RuntimeError
-		super(EnumElt, self).__setattr__(name, value)
+		print "Trying to assign %r.%s = %s" % (self,name,value)
+		raise RuntimeError
 
 	# Boring class methods follow
 	def __eq__(self,other):
-		return type(self) == type(other) and self._value == other._value
+		return self is other or (type(self) == type(other) and self._value == other._value)
 	def __ne__(self,other):   return not(self == other)
 	def __str__(self):        return self._strdict[self._value]
 	def __repr__(self):       return self._reprdict[self._value]
 	def __hash__(self):       return hash(self._value)
+	def __reduce__(self):     return (type(self),(self._value,))
 
 def enum(name,names,reprs,sequential):
 	"""Create a new type derived from :class:`EnumElt`, whose type name is the
@@ -66,8 +71,9 @@ def enum(name,names,reprs,sequential):
 	l = len(sequential)
 	ToString = { k:v for (k,v) in zip(range(l),names) }
 	Reprs    = { k:v for (k,v) in zip(range(l),reprs) }
-	elttype  = type(name+"Elt",(EnumElt,),{'_locked':False,'_strdict':ToString,'_reprdict':Reprs,'_l':l})
+	elttype  = type(name+"Elt",(EnumElt,),{'__slots__':(),'_strdict':ToString,'_reprdict':Reprs,'_l':l})
 	elements = map(elttype,range(l))
+	elttype._elements = tuple(elements)
 	return (elttype,elements)
 
 def enum_strfn(name, strfn, reprs):
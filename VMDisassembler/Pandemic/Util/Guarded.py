@@ -27,8 +27,8 @@ class GuardedInteger(object):
 	def value(self,val):
 		self._value = None if val == None else val & self.mask
 	
-	def __hash__(self,value):
-		return hash(self.value)
+	def __hash__(self):
+		return 0 if self.value is None else hash(self.value)
 	
 	def __repr__(self):
 		return "%r" % self.value
@@ -2,24 +2,56 @@
 implementing the ``__hash__`` method, this module provides binary and unary 
 hash functions whose behavior is modified through a parameter, which is 
 basically a salt.  For a given concrete class, this parameter is known as its
-"hash code"."""
+"hash code".
 
-import random
+All of the hashes computed here are deterministic:  they do not depend upon 
+the process that computes them, so they may be stored on disk or compared 
+between processes."""
 
 def rol(bits,value,amt):
 	"""Implementation of standard rotate left."""
-	bitmask = bits-1
-	amt = amt & bitmask
-	return (bitmask & (value << amt)) | (bitmask & (value >> (bits-amt)))
+	bitmask = (1 << bits)-1
+	amt = amt % bits
+	value &= bitmask
+	return bitmask & ((value << amt) | (value >> (bits-amt)))
 
 def ror(bits,value,amt):
 	"""Implementation of standard rotate right."""
-	bitmask = bits-1
-	amt = amt & bitmask
-	return (bitmask & (value >> amt)) | (bitmask & (value << (bits-amt)))
+	bitmask = (1 << bits)-1
+	amt = amt % bits
+	value &= bitmask
+	return bitmask & ((value >> amt) | (value << (bits-amt)))
 
-# An array of random numbers.
-random_numbers = map(lambda e: random.randint(0,0xFFFFFFFF),xrange(0,64))
+def xorshift32(x):
+	"""One step of Marsaglia's 32-bit xorshift generator."""
+	x ^= (x << 13) & 0xFFFFFFFF
+	x ^= x >> 17
+	x ^= (x << 5) & 0xFFFFFFFF
+	return x
+
+def make_salts(seed,n):
+	"""Generate *n* pseudo-random 32-bit integers from the non-zero *seed*.
+	
+	:rtype: integer list
+	"""
+	salts = []
+	for i in xrange(n):
+		seed = xorshift32(seed)
+		salts.append(seed)
+	return salts
+
+# An array of random-looking numbers.  They are fixed, rather than drawn from
+# :mod:`random` at import time, so that hashes are the same in every process.
+random_numbers = make_salts(0x9E3779B9,64)
+
+def stable_hash(x):
+	"""Hash *x*, which is ``None`` or has a deterministic ``__hash__``.  The 
+	built-in ``hash(None)`` is derived from the address of ``None``, which 
+	varies from one process to the next.
+	
+	:rtype: integer
+	"""
+	return 0 if x is None else hash(x)
 
 def unary_hash(x,n):
 	"""Unary hash of a value *x*, implemented by XORing against a list of random
@@ -30,9 +62,7 @@ def unary_hash(x,n):
 	:param integer n: salt / hash code.
 	:rtype: integer
 	"""
-	if n > len(random_numbers):
-		n %= len(random_numbers)
-	return x ^ random_numbers[n]
+	return x ^ random_numbers[n % len(random_numbers)]
 
 # Eight different ways of combining two hashes.
 BinaryHashFunctions = [
@@ -56,8 +86,5 @@ def binary_hash(x,y,n):
 	:param integer n: salt / hash code.
 	:rtype: integer
 	"""
-	idx = n
-	if n < 0 or n > len(random_numbers):
-		idx = abs(n) % len(random_numbers)
 	hashres = BinaryHashFunctions[n & 7](x,y) # Truncate n to 0..7
-	return hashres ^ random_numbers[idx]
+	return (hashres & 0xFFFFFFFF) ^ random_numbers[abs(n) % len(random_numbers)]
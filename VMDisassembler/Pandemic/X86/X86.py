@@ -2,8 +2,7 @@
 clients will need to import both this module and :mod:`.X86MetaData`."""
 
 from X86MetaData import *
-from Pandemic.Util.HashFunctions import binary_hash
-from Pandemic.Util.Guarded import *
+from Pandemic.Util.HashFunctions import binary_hash, stable_hash
 from X86Internal import *
 from Pandemic.Util.ASMFlow import *
 
@@ -27,90 +26,100 @@ HASH_JccTarget = 17
 
 class Gd(GeneralReg):
 	"""Class representing 32-bit general registers."""
-	def __init__(self,value,adjust_value=False):
-		self.init(value,HASH_Gd,R32Elt,adjust_value)
+	__slots__ = ()
+	_hashcode,regtype = HASH_Gd,R32Elt
 
 class Gw(GeneralReg):
 	"""Class representing 16-bit general registers."""
-	def __init__(self,value,adjust_value=False):
-		self.init(value,HASH_Gw,R16Elt,adjust_value)
+	__slots__ = ()
+	_hashcode,regtype = HASH_Gw,R16Elt
 
 class Gb(GeneralReg):
 	"""Class representing 8-bit general registers."""
-	def __init__(self,value,adjust_value=False):
-		self.init(value,HASH_Gb,R8Elt,adjust_value)	
+	__slots__ = ()
+	_hashcode,regtype = HASH_Gb,R8Elt
 
 class ControlReg(Register):
 	"""Class representing control registers."""
-	def __init__(self,value,adjust_value=False):
-		self.init(value,HASH_ControlReg,CntElt,adjust_value)
+	__slots__ = ()
+	_hashcode,regtype = HASH_ControlReg,CntElt
 
 class DebugReg(Register):
 	"""Class representing debug registers."""
-	def __init__(self,value,adjust_value=False):
-		self.init(value,HASH_DebugReg,DbgElt,adjust_value)
+	__slots__ = ()
+	_hashcode,regtype = HASH_DebugReg,DbgElt
 
 class MMXReg(Register):
 	"""Class representing MMX registers."""
-	def __init__(self,value,adjust_value=False):
-		self.init(value,HASH_MMXReg,MMXElt,adjust_value)
+	__slots__ = ()
+	_hashcode,regtype = HASH_MMXReg,MMXElt
 
 class XMMReg(Register):
 	"""Class representing XMM registers."""
-	def __init__(self,value,adjust_value=False):
-		self.init(value,HASH_XMMReg,XMMElt,adjust_value)
+	__slots__ = ()
+	_hashcode,regtype = HASH_XMMReg,XMMElt
 
 class FPUReg(Register):
 	"""Class representing FPU registers."""
-	def __init__(self,value,adjust_value=False):
-		self.init(value,HASH_FPUReg,FPUElt,adjust_value)
+	__slots__ = ()
+	_hashcode,regtype = HASH_FPUReg,FPUElt
 
 class SegReg(Register):
 	"""Class representing segment registers."""
-	def __init__(self,value,adjust_value=False):
-		self.init(value,HASH_SegReg,SegElt,adjust_value)
+	__slots__ = ()
+	_hashcode,regtype = HASH_SegReg,SegElt
 
 class Id(Immediate):
 	"""Class representing 32-bit immediate constants."""
-	def __init__(self,value):
-		self.init(HASH_Id,value,0xFFFFFFFF)
+	__slots__ = ()
+	_hashcode,mask = HASH_Id,0xFFFFFFFF
 
 class Iw(Immediate):
 	"""Class representing 16-bit immediate constants."""
-	def __init__(self,value):
-		self.init(HASH_Iw,value,0xFFFF)
+	__slots__ = ()
+	_hashcode,mask = HASH_Iw,0xFFFF
 
 class Ib(Immediate):
 	"""Class representing 8-bit immediate constants."""
-	def __init__(self,value):
-		self.init(HASH_Ib,value,0xFF)
+	__slots__ = ()
+	_hashcode,mask = HASH_Ib,0xFF
 
 class AP16(FarTarget):
 	"""Class representing 16-bit segment:offset memory locations."""
-	def __init__(self,seg,off):
-		self.init(HASH_AP16,seg,off,0xFFFF)
+	__slots__ = ()
+	_hashcode,mask = HASH_AP16,0xFFFF
 
 class AP32(FarTarget):
 	"""Class representing 32-bit segment:offset memory locations."""
-	def __init__(self,seg,off):
-		self.init(HASH_AP32,seg,off,0xFFFFFFFF)
+	__slots__ = ()
+	_hashcode,mask = HASH_AP32,0xFFFFFFFF
 
 class JccTarget(Operand):
-	"""Class representing jump targets."""
+	"""Class representing jump targets.
+	
+	:ivar integer Taken: the address to which the jump transfers control
+	:ivar integer NotTaken: the address of the next instruction
+	"""
+	__slots__ = ('Taken','NotTaken')
+	_hashcode = HASH_JccTarget
+
 	def __init__(self,taken,nottaken):
-		self._taken    = GuardedInteger(taken,0xFFFFFFFF)
-		self._nottaken = GuardedInteger(nottaken,0xFFFFFFFF)
-		self._hashcode = HASH_JccTarget
+		object.__setattr__(self,'Taken',taken & 0xFFFFFFFF)
+		object.__setattr__(self,'NotTaken',nottaken & 0xFFFFFFFF)
+		self.SetHash()
 	
 	def __repr__(self):
-		return "JccTarget(%r,%r)" % (self._taken,self._nottaken)
+		return "JccTarget(%r,%r)" % (self.Taken,self.NotTaken)
 
 	def __str__(self):
-		return "%s" % X86Hexify(self._taken.value)
+		return "%s" % X86Hexify(self.Taken)
 
 	def __eq__(self,other):
-		return type(self)==type(other) and self._taken.value == other._taken.value and \
-		self._nottaken.value == other._nottaken.value
+		return type(self)==type(other) and self.Taken == other.Taken and \
+		self.NotTaken == other.NotTaken
+
+	def ComputeHash(self):
+		return binary_hash(self.Taken,self.NotTaken,self._hashcode)
 
 class Mem16(MemExpr):
 	"""Class representing 16-bit memory expressions.
@@ -118,8 +127,12 @@ class Mem16(MemExpr):
 	:ivar `.R16Elt` BaseReg: The base register, or ``None``.
 	:ivar `.R16Elt` IndexReg: The index register, or ``None``.
 	"""
+	__slots__ = ()
+	_hashcode,regtype,mask = HASH_Mem16,R16Elt,0xFFFF
+
 	def __init__(self,seg,size,basereg=None,indexreg=None,disp=None,adjust_values=False):
-		self.init(HASH_Mem16,seg,size,R16Elt,basereg,indexreg,disp,0xFFFF,adjust_values)
+		self.init(seg,size,basereg,indexreg,disp,adjust_values)
+		self.SetHash()
 	
 	def __eq__(self,other):
 		return type(self)==type(other) and self.BaseReg == other.BaseReg and \
@@ -153,23 +166,20 @@ class Mem32(MemExpr):
 	
 	:ivar `.R32Elt` BaseReg: The base register, or ``None``.
 	:ivar `.R32Elt` IndexReg: The index register, or ``None``.
+	:ivar integer ScaleFac: 32-bit memory expressions may scale the index 
+		register by this value, which is in the range of 0-3.  It should be set
+		to ``0`` if there is no scale factor.  Otherwise, it corresponds to 
+		multiplying by ``1 << ScaleFac``.  That is, a value of ``1`` corresponds
+		to multiplying by ``2``; ``2`` corresponds to multiplication by ``4``; 
+		and ``3`` denotes multiplication by ``8``.
 	"""
-	def __init__(self,seg,size,basereg=None,indexreg=None,scalefac=0,disp=None,adjust_values=False):
-		self.init(HASH_Mem32,seg,size,R32Elt,basereg,indexreg,disp,0xFFFFFFFF,adjust_values)
-		self.scalefac = GuardedInteger(scalefac,3)
+	__slots__ = ('ScaleFac',)
+	_hashcode,regtype,mask = HASH_Mem32,R32Elt,0xFFFFFFFF
 
-	@property
-	def ScaleFac(self): 
-		"""32-bit memory expressions may scale the index register by this value,
-		which is in the range of 0-3.  It should be set to ``0`` if there is no 
-		scale factor.  Otherwise, it corresponds to multiplying by 
-		``1 << ScaleFac``.  That is, a value of ``1``	corresponds to multiplying
-		by ``2``; ``2`` corresponds to multiplication by ``4``; and ``3`` denotes
-		multiplication by ``8``.
-		"""
-		return self.scalefac.value
-	@ScaleFac.setter
-	def ScaleFac(self,value): self.scalefac.value = value
+	def __init__(self,seg,size,basereg=None,indexreg=None,scalefac=0,disp=None,adjust_values=False):
+		self.init(seg,size,basereg,indexreg,disp,adjust_values)
+		object.__setattr__(self,'ScaleFac',None if scalefac is None else scalefac & 3)
+		self.SetHash()
 	
 	def __eq__(self,other):
 		return type(self)==type(other) and self.BaseReg == other.BaseReg and \
@@ -204,7 +214,7 @@ class Mem32(MemExpr):
 		return SS if self.BaseReg == Ebp or self.BaseReg == Esp else DS
 	
 	def HashIndex(self):
-		return binary_hash(hash(self.IndexReg),hash(self.ScaleFac),self._hashcode+2)
+		return binary_hash(stable_hash(self.IndexReg),stable_hash(self.ScaleFac),self._hashcode+2)
 
 class Instruction(object):
 	"""Class representing X86 instructions.
@@ -270,7 +280,7 @@ class Instruction(object):
 		return "%s%s %s" % (pfx,self.mnem,opstr)
 		
 	def __eq__(self,other):
-		return type(self) == type(other) and self.NumOps() == other.NumOps() and \
+		return isinstance(other,Instruction) and self.NumOps() == other.NumOps() and \
 		set(self.prefixes) == set(other.prefixes) and (self.mnem,self.op1,self.op2,self.op3)\
 		== (other.mnem,other.op1,other.op2,other.op3)
 							
@@ -278,9 +288,59 @@ class Instruction(object):
 		return not(self.__eq__(other))
 	
 	def __hash__(self):
-		pfxhash = reduce(lambda a,b: a^hash(b),self.prefixes,0)
-		ophash  = reduce(lambda a,b: a^hash(b),map(self.GetOp,xrange(0,3)),0)
-		return pfxhash^ophash^hash(self.mnem)
+		# Prefixes compare as a set, so hash them as one; operands are combined
+		# in order.
+		h = hash(self.mnem)
+		if self.prefixes:
+			h ^= hash(frozenset(self.prefixes))
+		h = binary_hash(h,stable_hash(self.op1),1)
+		h = binary_hash(h,stable_hash(self.op2),2)
+		return binary_hash(h,stable_hash(self.op3),3)
+	
+	def Freeze(self):
+		"""Return an immutable :class:`FrozenInstruction` equal to this one.
+		
+		:rtype: :class:`FrozenInstruction`
+		"""
+		return FrozenInstruction(self)
+
+class FrozenInstruction(Instruction):
+	"""Immutable copy of an :class:`Instruction`, which may therefore be shared,
+	e.g. by :class:`~.X86DecodeCache`.  The prefixes are held in a tuple, and 
+	assigning to any attribute raises :exc:`AttributeError`.  The operands are
+	shared with the original, and must not be modified either.  To obtain an
+	instruction that may be modified, use :meth:`Thaw`.
+	
+	The hash is computed once, upon construction, making frozen instructions 
+	cheap dictionary keys.  Like all instruction hashes, it is the same in 
+	every process.
+	"""
+	def __init__(self,instr):
+		object.__setattr__(self,"prefixes",tuple(instr.prefixes))
+		object.__setattr__(self,"mnem",instr.mnem)
+		object.__setattr__(self,"op1",instr.op1)
+		object.__setattr__(self,"op2",instr.op2)
+		object.__setattr__(self,"op3",instr.op3)
+		object.__setattr__(self,"_hash",Instruction.__hash__(self))
+
+	def __hash__(self):
+		return self._hash
+
+	def __setattr__(self,name,value):
+		raise AttributeError("FrozenInstruction is immutable; use Thaw()")
+
+	def __delattr__(self,name):
+		raise AttributeError("FrozenInstruction is immutable; use Thaw()")
+
+	def Thaw(self):
+		"""Return a mutable :class:`Instruction` equal to this one.
+		
+		:rtype: :class:`Instruction`
+		"""
+		return Instruction(list(self.prefixes),self.mnem,self.op1,self.op2,self.op3)
+
+	def Freeze(self):
+		return self
 
 class InvalidInstruction(Exception):
 	"""This exception may be thrown during decoding, if an attempt to decode an
@@ -290,6 +350,19 @@ class InvalidInstruction(Exception):
 	possibilities could be illegal."""
 	def __str__(s): return s.__class__.__name__
 
+class BranchOutOfRange(InvalidInstruction):
+	"""This exception is thrown during encoding, if the destination of a 
+	relative branch that only has an 8-bit displacement (such as ``loop`` or 
+	``jecxz``) lies out of that displacement's range."""
+	pass
+
+# The mnemonics that receive special treatment in X86DecodedInstruction's
+# CreateFlow() method, as sets of their IntValue()s.
+JccMnemonics = frozenset(m.IntValue() for m in [Jo,Jno,Jb,Jae,Jz,Jnz,Jbe,Ja,Js,Jns,Jp,Jnp,Jl,Jge,Jle,Jg,Loopnz,Loopz,Loop,Jcxz,Jecxz])
+CallMnemonics = frozenset(m.IntValue() for m in [Call,CallF])
+JmpMnemonics = frozenset(m.IntValue() for m in [Jmp,JmpF])
+RetMnemonics = frozenset(m.IntValue() for m in [Ret,Retf,Iretd,Iretw])
+
 class X86DecodedInstruction(object):
 	"""A class for packaging the results of instruction decoding.  In particular,
 	the :class:`Instruction` class does not indicate the address of an 
@@ -299,7 +372,8 @@ class X86DecodedInstruction(object):
 	:ivar integer ea: the instruction's address
 	:ivar `Instruction` instr: the instruction itself
 	:ivar integer length: the length of the instruction
-	:ivar `.FlowType` flow: the instruction's successor addresses
+	:ivar `.FlowType` flow: the instruction's successor addresses, computed by
+		:meth:`CreateFlow` the first time it is accessed
 	"""
 	def CreateFlow(self):
 		"""Inspect the instruction and its length, and determine which type of
@@ -307,28 +381,41 @@ class X86DecodedInstruction(object):
 		conditional jump, etc).  For a complete listing of flow types, see the 
 		:mod:`ASMFlow` module."""
 		mnem = self.instr.mnem
+		m = mnem.IntValue()
 		op0 = self.instr.GetOp(0)
 		next_addr = self.ea + self.length
 		if op0 != None and isinstance(op0,JccTarget):
 			if mnem == Call:
-				return FlowCallDirect(op0._taken.value,next_addr)
+				return FlowCallDirect(op0.Taken,next_addr)
 			if mnem == Jmp:
-				return FlowJmpUnconditional(op0._taken.value,next_addr)
-			if mnem in [Jo,Jno,Jb,Jae,Jz,Jnz,Jbe,Ja,Js,Jns,Jp,Jnp,Jl,Jge,Jle,Jg,Loopnz,Loopz,Loop,Jcxz,Jecxz]:
-				return FlowJmpConditional(op0._taken.value,op0._nottaken.value)
+				return FlowJmpUnconditional(op0.Taken,next_addr)
+			if m in JccMnemonics:
+				return FlowJmpConditional(op0.Taken,op0.NotTaken)
 			else:
-				print "CreateFlow:  JccTarget with invalid mnenonic %s" % MnemToString[mnem]
+				print "CreateFlow:  JccTarget with invalid mnenonic %s" % mnem
 				raise ValueError
-		elif mnem in [Call,CallF]: return FlowCallIndirect(next_addr)
-		elif mnem in [Jmp,JmpF]:   return FlowJmpIndirect()
-		elif mnem in [Ret,Retf,Iretd,Iretw]: return FlowReturn()
+		elif m in CallMnemonics: return FlowCallIndirect(next_addr)
+		elif m in JmpMnemonics:  return FlowJmpIndirect()
+		elif m in RetMnemonics:  return FlowReturn()
 		else: return FlowOrdinary(next_addr)
 
 	def __init__(self,ea,instr,length,flow=None):
 		self.ea = ea
 		self.instr = instr
 		self.length = length
-		self.flow = flow if flow != None else self.CreateFlow()
+		self._flow = flow
+
+	@property
+	def flow(self):
+		"""The instruction's control flow.  Most clients of the decoder only want
+		the instruction, so this is not computed until somebody asks for it."""
+		if self._flow is None:
+			self._flow = self.CreateFlow()
+		return self._flow
+
+	@flow.setter
+	def flow(self,flow):
+		self._flow = flow
 
 #if __name__=="__main__":
 #	i = Instruction([],Add,Gb(Al),Gb(Cl))
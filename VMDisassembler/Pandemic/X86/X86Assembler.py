@@ -0,0 +1,214 @@
+"""This module provides :class:`X86Assembler`, which assembles a listing of
+X86 instructions into one block of machine code, using a single parser and a
+single :class:`~.X86Encoder` for the entire listing.
+
+Each line of a listing holds at most one instruction, in the syntax accepted by
+:data:`~.X86Parser.parser`.  Additionally:
+
+* Anything following a semicolon is a comment.
+* A line may begin with an address, such as ``401000h:``, at which its
+  instruction is encoded.  Subsequent instructions follow it.
+* A line may begin with a label, such as ``loop_top:``, which names the
+  address of the line.  Wherever a label's name appears in an instruction, it
+  is replaced by that address, so labels can be used as the destinations of
+  relative branches (:class:`~.JccTarget` operands) as well as ordinary
+  immediates.
+
+The length of an instruction may depend upon the labels that it references
+(for example, as a memory displacement), so assembly takes as many passes as it
+needs:  each pass assigns addresses to the lines and the labels, using the
+addresses that the previous pass assigned to labels defined further down, and
+the passes stop once no label moves.
+
+Relative branches are always assembled in their long forms (``0F 8x`` for 
+conditional jumps, ``E9`` and ``E8`` for ``jmp`` and ``call``), whatever the
+distance to their destinations.  ``loop``, ``loopz``, ``loopnz``, ``jcxz``, and
+``jecxz`` only have short forms, with 8-bit displacements;  a destination 
+beyond their reach is an error.
+"""
+
+import re
+from X86 import *
+from X86Lex import reserved
+from X86Parser import parser
+from X86Encoder import X86Encoder
+
+class X86AssemblerError(Exception):
+	"""Raised when a line of a listing cannot be assembled.
+
+	:ivar integer lineno: the (1-based) number of the offending line
+	"""
+	def __init__(self,lineno,msg):
+		Exception.__init__(self,"line %d: %s" % (lineno,msg))
+		self.lineno = lineno
+
+# An address or a label at the beginning of a line.  Addresses use the same
+# syntax as numbers within instructions.
+line_prefix_re = re.compile(r'\s*(?:([0-9][0-9a-fA-F]*h|[0-9]+)|([A-Za-z_][A-Za-z0-9_]*))\s*:')
+
+# A name that might refer to a label.
+name_re = re.compile(r'(?<![0-9A-Za-z_])[A-Za-z_][A-Za-z0-9_]*')
+
+# The most passes that :meth:`X86Assembler.Assemble` takes before giving up on
+# the label addresses settling down.
+MAX_PASSES = 16
+
+def parse_number(text):
+	if text.endswith("h"):
+		return int(text[:-1],16)
+	return int(text)
+
+class X86Assembler(object):
+	"""Listing assembler.
+
+	:ivar `.X86Encoder` Encoder: the encoder used for every instruction
+	"""
+	def __init__(self,encoder=None):
+		"""Encode with *encoder* (by default, a new :class:`~.X86Encoder`)."""
+		self.Encoder = encoder if encoder is not None else X86Encoder()
+
+	def SplitLine(self,text):
+		"""Split one line of a listing into its parts.
+
+		:param string text: the line
+		:rtype: tuple (integer or ``None``, string or ``None``, string)
+		:returns: The address at the beginning of the line, if any; the label
+			at the beginning of the line, if any; and the remaining text, with
+			comments and surrounding whitespace removed.
+		"""
+		text = text.split(";",1)[0]
+		addr,label = None,None
+		m = line_prefix_re.match(text)
+		if m is not None:
+			if m.group(1) is not None:
+				addr = parse_number(m.group(1))
+			else:
+				label = m.group(2)
+			text = text[m.end():]
+		return addr,label,text.strip()
+
+	def ParseLine(self,lineno,text,labels):
+		"""Parse the instruction *text*, replacing the names of labels by their
+		addresses.  Fill in the fall-through address of relative branches later;
+		see :meth:`Assemble`.
+
+		:param integer lineno: the line number, for error messages
+		:param string text: the instruction
+		:param labels: the address of every label
+		:type labels: dictionary from string to integer
+		:rtype: tuple (:class:`~.Instruction`, bool)
+		:returns: The instruction, and whether it referenced any labels.
+		"""
+		used = []
+		def replace(m):
+			name = m.group(0)
+			if name not in labels:
+				return name
+			used.append(name)
+			return "0%Xh" % labels[name]
+		text = name_re.sub(replace,text)
+		try:
+			return parser.Parse(text),len(used) > 0
+		except (SyntaxError,ValueError,RuntimeError), e:
+			raise X86AssemblerError(lineno,"%s: %s" % (text,e))
+
+	def EncodeLine(self,lineno,instr,addr):
+		"""Encode *instr* at *addr*.  If it is a relative branch, its fall-through
+		address is set to the address of the following instruction.  A short
+		branch whose destination is out of range raises 
+		:exc:`~.BranchOutOfRange`, which is left to the caller.
+
+		:rtype: tuple (:class:`~.Instruction`, integer list)
+		"""
+		try:
+			bytes = self.Encoder.EncodeInstruction(instr,addr)
+			ops = [instr.GetOp(i) for i in xrange(3)]
+			if any(isinstance(op,JccTarget) for op in ops):
+				next_addr = addr + len(bytes)
+				ops = [JccTarget(op.Taken,next_addr) if isinstance(op,JccTarget) else op for op in ops]
+				instr = Instruction(instr.prefixes,instr.mnem,*ops)
+		except BranchOutOfRange:
+			raise
+		except InvalidInstruction:
+			raise X86AssemblerError(lineno,"%s: can't encode" % instr)
+		return instr,bytes
+
+	def Assemble(self,lines,addr=0):
+		"""Assemble a listing.  The instructions are encoded beginning at *addr*,
+		or at the addresses given within the listing.
+
+		:param lines: the listing, either as one string or as a sequence of lines
+			(for example, a file object)
+		:param integer addr: the address of the first instruction
+		:rtype: tuple (integer list, list of tuples (integer, integer, integer,
+			:class:`~.Instruction`, integer))
+		:returns: The bytes of all instructions in a single list, and the offset
+			map:  for every line that holds an instruction, its line number, its
+			address, the offset of its bytes within the list, the instruction,
+			and the number of bytes.
+		"""
+		if isinstance(lines,basestring):
+			lines = lines.splitlines()
+		split = [self.SplitLine(text) for text in lines]
+
+		# Every label must be known before the first pass, so that the names of
+		# labels defined below their uses are recognized as such.  Until the
+		# first pass reaches them, they stand for the address of the listing.
+		labels = dict()
+		for lineno,(a,label,text) in enumerate(split,1):
+			if label is None:
+				continue
+			if label in reserved:
+				raise X86AssemblerError(lineno,"%s is a reserved word" % label)
+			if label in labels:
+				raise X86AssemblerError(lineno,"label %s defined twice" % label)
+			labels[label] = addr
+
+		# Assign addresses to the lines and the labels, and encode the lines,
+		# until every line has been encoded with the final label addresses.
+		# Labels defined below the current line take their addresses from the
+		# previous pass.  A short branch to a label whose address is not final
+		# may be out of range for the time being; it is encoded as a branch to
+		# itself, and only reported if it is still out of range once the labels
+		# settle.
+		pending = None
+		for npass in xrange(MAX_PASSES):
+			previous,lastpending = dict(labels),pending
+			pending,curraddr,outofrange = [],addr,None
+			for lineno,(a,label,text) in enumerate(split,1):
+				if a is not None:
+					curraddr = a
+				if label is not None:
+					labels[label] = curraddr
+				if text == "":
+					continue
+				instr,uses_labels = self.ParseLine(lineno,text,labels)
+				try:
+					instr,bytes = self.EncodeLine(lineno,instr,curraddr)
+				except BranchOutOfRange:
+					e = X86AssemblerError(lineno,"%s: branch target out of range" % text)
+					if not uses_labels:
+						raise e
+					try:
+						instr,bytes = self.EncodeLine(lineno,Instruction(instr.prefixes,instr.mnem,JccTarget(curraddr,0)),curraddr)
+					except BranchOutOfRange:
+						raise e
+					outofrange = outofrange or e
+				pending.append((lineno,curraddr,instr,bytes))
+				curraddr += len(bytes)
+			if labels == previous:
+				if outofrange is not None:
+					raise outofrange
+				break
+		else:
+			# Report the first line whose length changed in the last pass.
+			for (lineno,a,instr,bytes),(_,_,_,lastbytes) in zip(pending,lastpending):
+				if len(bytes) != len(lastbytes):
+					raise X86AssemblerError(lineno,"%s: length depends upon its labels" % split[lineno-1][2])
+
+		# Concatenate the results.
+		res,linemap = [],[]
+		for lineno,a,instr,bytes in pending:
+			linemap.append((lineno,a,len(res),instr,len(bytes)))
+			res.extend(bytes)
+		return res,linemap
@@ -1,8 +1,10 @@
 """Byte stream interface.  To support any form of input, derive a class from 
-:class:`StreamObj` and override :meth:`GetByteInternal`.
+:class:`StreamObj` and override :meth:`GetByteInternal`.  For input that is
+already a contiguous buffer in memory, use :class:`BufferStreamObj`.
 """
 
 from X86 import InvalidInstruction
+import struct
 
 class StreamObj(object):
 	"""Class for acquiring bytes from a source."""	
@@ -76,4 +78,160 @@ class StreamObj(object):
 		:param integer ea:
 		"""
 		self.pos,self.origpos = ea,ea
+
+	def Peek(self,ea,n):
+		"""Return up to *n* bytes beginning at *ea*, fewer if the stream ends
+		first, without disturbing the current position.
+		
+		:param integer ea:
+		:param integer n:
+		:rtype: string
+		"""
+		saved = self.pos,self.origpos
+		self.pos = ea
+		bytes = []
+		try:
+			while len(bytes) < n:
+				bytes.append(chr(self.GetByteInternal()))
+				self.pos = self.pos + 1
+		except IndexError:
+			pass
+		self.pos,self.origpos = saved
+		return "".join(bytes)
+
+# Little-endian readers for :class:`BufferStreamObj`.
+_BYTE  = struct.Struct("<B")
+_WORD  = struct.Struct("<H")
+_DWORD = struct.Struct("<L")
+
+class BufferStreamObj(StreamObj):
+	"""Stream that reads in place from a contiguous buffer: a ``str``, 
+	:class:`bytearray`, :class:`mmap.mmap`, :class:`buffer`, or 
+	:class:`memoryview`.  Nothing is copied.  Words and dwords are read with
+	a single :func:`struct.unpack_from` rather than byte-by-byte, and the
+	end of the 16-byte window for the current instruction is computed once, 
+	in :meth:`SetPos`, so that each read costs a single comparison.
+	
+	Positions are addresses: the first byte of the buffer lies at *base*.
+	"""
+	def __init__(self,bytes,base=0):
+		self.base = base
+		# bytearray indexing already yields integers; the other buffer types
+		# yield characters, so go through struct for those.
+		if isinstance(bytes,bytearray):
+			self.ByteAt = bytes.__getitem__
+		else:
+			self.ByteAt = lambda pos: _BYTE.unpack_from(bytes,pos)[0]
+		StreamObj.__init__(self,bytes)
+
+	def Init(self):
+		"""Initializes position variables."""
+		StreamObj.Init(self)
+		self.limit = 16
+
+	def Overrun(self):
+		"""Raise the exception for a read that crosses the end of the window:
+		as in :class:`StreamObj`, running out of input takes precedence.
+		
+		:raises: :exc:`IndexError` if the buffer ends within the window, 
+			:exc:`.InvalidInstruction` otherwise.
+		"""
+		if len(self.bytes) < self.limit:
+			raise IndexError(len(self.bytes))
+		raise InvalidInstruction()
+
+	def GetByteInternal(self):
+		"""Consume a byte from the buffer and return it.
+		
+		:rtype: 8-bit integer
+		"""
+		return self.ByteAt(self.pos)
+
+	def Byte(self):
+		"""Consume a byte from the stream and return it.
+		
+		:rtype: 8-bit integer
+		:raises: :exc:`.InvalidInstruction` if more than 16 bytes have been 
+			consumed since the last call to :meth:`SetPos`.
+		:raises: :exc:`IndexError` if the buffer is exhausted.
+		"""
+		pos = self.pos
+		if pos >= self.limit:
+			self.Overrun()
+		try:
+			b = self.ByteAt(pos)
+		except struct.error:
+			raise IndexError(pos)
+		self.pos = pos + 1
+		return b
+
+	def Word(self):
+		"""Consume a word from the stream and return it.
+		
+		:rtype: 16-bit integer
+		:raises: :exc:`.InvalidInstruction` if more than 16 bytes have been 
+			consumed since the last call to :meth:`SetPos`.
+		:raises: :exc:`IndexError` if the buffer is exhausted.
+		"""
+		pos = self.pos
+		if pos + 2 > self.limit:
+			self.Overrun()
+		try:
+			w, = _WORD.unpack_from(self.bytes,pos)
+		except struct.error:
+			raise IndexError(pos)
+		self.pos = pos + 2
+		return w
+
+	def Dword(self):
+		"""Consume a dword from the stream and return it.
+		
+		:rtype: 32-bit integer
+		:raises: :exc:`.InvalidInstruction` if more than 16 bytes have been 
+			consumed since the last call to :meth:`SetPos`.
+		:raises: :exc:`IndexError` if the buffer is exhausted.
+		"""
+		pos = self.pos
+		if pos + 4 > self.limit:
+			self.Overrun()
+		try:
+			d, = _DWORD.unpack_from(self.bytes,pos)
+		except struct.error:
+			raise IndexError(pos)
+		self.pos = pos + 4
+		return d
+
+	def Pos(self):
+		"""Return the current position of the stream.
+		
+		:rtype: integer
+		"""
+		return self.pos+self.base
+
+	def SetPos(self,ea):
+		"""Set the current position of the stream to *ea*, and the end of the
+		window for the instruction beginning there.
 		
+		:param integer ea:
+		:raises: :exc:`IndexError` if *ea* lies before the buffer.
+		"""
+		pos = ea-self.base
+		if pos < 0:
+			raise IndexError(ea)
+		self.pos,self.origpos,self.limit = pos,pos,pos+16
+
+	def Peek(self,ea,n):
+		"""Return up to *n* bytes beginning at *ea*, fewer if the buffer ends
+		first, without disturbing the current position.
+		
+		:param integer ea:
+		:param integer n:
+		:rtype: string
+		"""
+		pos = ea-self.base
+		if pos < 0:
+			raise IndexError(ea)
+		bytes = self.bytes[pos:pos+n]
+		if isinstance(bytes,memoryview):
+			return bytes.tobytes()
+		return str(bytes)
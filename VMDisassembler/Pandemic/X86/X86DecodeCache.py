@@ -0,0 +1,157 @@
+"""This module provides :class:`X86DecodeCache`, a bounded LRU cache that sits
+in front of an :class:`~.X86Decoder` and remembers the instructions decoded
+from particular byte sequences.  Machine code that repeats the same
+instructions many times over (e.g. the raw x86 payloads in a VM program) then
+only pays for decoding each distinct instruction once.
+
+Decoding is deterministic and consumes bytes strictly in order, so if the
+bytes *b* decode to an instruction of length ``len(b)``, then any input that
+begins with *b* decodes to the same instruction.  Entries are therefore keyed
+on the exact bytes of the instruction, and a lookup tries each prefix of the
+input whose length matches that of some cached instruction.  Instructions with
+relative operands (:class:`~.JccTarget`) also depend upon their address, and
+their entries are keyed on both.
+
+The cache hands out shared :class:`~.FrozenInstruction` objects; use
+:meth:`~.FrozenInstruction.Thaw` to obtain one that can be modified.
+"""
+
+from X86 import *
+from X86ByteStream import BufferStreamObj
+from X86Decoder import X86Decoder, linear_sweep
+from collections import OrderedDict
+
+DEFAULT_DECODE_CACHE_SIZE = 4096
+
+class X86DecodeCache(object):
+	"""Decoding cache.
+
+	:ivar `.X86Decoder` Decoder: the decoder used on cache misses
+	:ivar integer maxsize: the maximum number of entries
+	:ivar integer hits: the number of lookups satisfied from the cache
+	:ivar integer misses: the number of lookups that invoked the decoder
+	"""
+	def __init__(self,decoder=None,maxsize=DEFAULT_DECODE_CACHE_SIZE):
+		"""Wrap *decoder* (by default, an :class:`~.X86Decoder` with no stream;
+		see :meth:`SetStream`), keeping at most *maxsize* entries."""
+		self.Decoder = decoder if decoder is not None else X86Decoder(None)
+		self.maxsize = maxsize
+		self.Clear()
+
+	def Clear(self):
+		"""Discard all entries and reset the counters."""
+		self.entries = OrderedDict()
+		# Number of entries of each instruction length.
+		self.lengths = dict()
+		self.hits = 0
+		self.misses = 0
+
+	def SetStream(self,stream):
+		"""Decode from *stream* henceforth.  The entries remain valid, as they
+		depend only upon the bytes.
+
+		:param `.StreamObj` stream:
+		"""
+		self.Decoder.Stream = stream
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __str__(self):
+		return "X86DecodeCache: %d hits, %d misses, %d entries" % (self.hits,self.misses,len(self.entries))
+
+	def Lookup(self,ea,window):
+		"""Find the cached instruction that *window*, the bytes at *ea*, begins
+		with.  Mark the entry as recently used.
+
+		:rtype: tuple (:class:`~.FrozenInstruction`, integer length), or
+			``None`` if there is no such entry
+		"""
+		entries = self.entries
+		for length in sorted(self.lengths):
+			if length > len(window):
+				break
+			key = window[:length]
+			if key not in entries:
+				key = (key,ea)
+				if key not in entries:
+					continue
+			instr = entries.pop(key)
+			entries[key] = instr
+			return instr,length
+		return None
+
+	def Insert(self,ea,window,instr,length):
+		"""Add the instruction *instr* of length *length*, decoded from the
+		bytes *window* at *ea*, evicting the least recently used entry if the
+		cache is full."""
+		if self.maxsize <= 0:
+			return
+		key = window[:length]
+		if any(isinstance(op,JccTarget) for op in (instr.op1,instr.op2,instr.op3)):
+			key = (key,ea)
+		if len(self.entries) >= self.maxsize:
+			oldkey,oldinstr = self.entries.popitem(last=False)
+			oldlength = len(oldkey[0] if isinstance(oldkey,tuple) else oldkey)
+			self.lengths[oldlength] -= 1
+			if self.lengths[oldlength] == 0:
+				del self.lengths[oldlength]
+		self.entries[key] = instr
+		self.lengths[length] = self.lengths.get(length,0)+1
+
+	def DecodeInstruction(self,ea):
+		"""As :meth:`.X86Decoder.DecodeInstruction`, but consulting the cache
+		first.  Failures to decode are not cached.
+
+		:param integer ea: The address from which to decode
+		:rtype: tuple (:class:`~.FrozenInstruction`, integer length)
+		"""
+		# X86/32 instructions are at most 15 bytes in length; the decoder
+		# consumes at most 16 before giving up.
+		window = self.Decoder.Stream.Peek(ea,16)
+		found = self.Lookup(ea,window)
+		if found is not None:
+			self.hits += 1
+			return found
+		self.misses += 1
+		instr,length = self.Decoder.DecodeInstruction(ea)
+		instr = FrozenInstruction(instr)
+		self.Insert(ea,window,instr,length)
+		return instr,length
+
+	def Decode(self,ea):
+		"""As :meth:`.X86Decoder.Decode`, but consulting the cache first.
+
+		:param integer ea: The address from which to decode
+		:rtype: :class:`~.X86DecodedInstruction`
+		"""
+		instr,length = self.DecodeInstruction(ea)
+		return X86DecodedInstruction(ea,instr,length)
+
+	def IterDecode(self,start,end):
+		"""As :meth:`.X86Decoder.IterDecode`, but consulting the cache first.
+
+		:rtype: generator of tuples (integer ea, integer length,
+			:class:`~.FrozenInstruction` or ``None``)
+		"""
+		return linear_sweep(self.DecodeInstruction,start,end)
+
+	def IterDecodeRange(self,buf,start=None,end=None,base=0):
+		"""As :meth:`.X86Decoder.IterDecodeRange`, but consulting the cache
+		first.  Afterwards, the cache continues to decode from *buf*.
+
+		:rtype: generator of tuples (integer ea, integer length,
+			:class:`~.FrozenInstruction` or ``None``)
+		"""
+		if start is None: start = base
+		if end   is None: end   = base+len(buf)
+		self.SetStream(BufferStreamObj(buf,base))
+		return self.IterDecode(start,end)
+
+	def DecodeRange(self,buf,start=None,end=None,base=0):
+		"""As :meth:`IterDecodeRange`, but return a list.
+
+		:rtype: list of tuples (integer ea, integer length,
+			:class:`~.FrozenInstruction` or ``None``)
+		"""
+		return list(self.IterDecodeRange(buf,start,end,base))
@@ -144,7 +144,7 @@ class SSE(X86DECDL):
 						# If yes, decode the REPNE entry.
 						return self.repne.decode(decoder)
 
-			except e,Exception:
+			except Exception:
 				pass
 		# If there were no Group 1 prefixes, or they didn't correspond to a
 		# valid decoder entry, try the OPSIZE prefix.
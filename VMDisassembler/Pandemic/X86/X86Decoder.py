@@ -5,16 +5,34 @@ the bytes from any source, as long as we can implement the :class:`.StreamObj`
 interface around that byte source.  For example, we could use IDA's 
 ``get_byte()``, map a PE file into a flat memory view and index into that, use
 a debugger's capabilities to read from memory, etc.
+
+:class:`X86CompiledDecoder` produces the same output faster, by compiling the 
+decoding of each stem (under each combination of prefixes) into a function the
+first time that it is encountered.
 """
 
 from X86 import *
-from X86ByteStream import StreamObj
+from X86ByteStream import StreamObj, BufferStreamObj
 import X86DecodeTable
 from X86ModRM import ModRM16, ModRM32, sign_extend_8_16, sign_extend_8_32, modrm_16
 from X86InternalOperandDescriptions import *
 from Pandemic.Util.Visitor import Visitor
 from Pandemic.Util.ExerciseError import ExerciseError
+from operator import methodcaller
 	
+def linear_sweep(decode,start,end):
+	"""Generator for :meth:`X86Decoder.IterDecode`, given the function *decode*
+	that maps an address to an (instruction, length) tuple.
+	"""
+	ea = start
+	while ea < end:
+		try:
+			instr,length = decode(ea)
+		except (InvalidInstruction,IndexError):
+			instr,length = None,1
+		yield (ea,length,instr)
+		ea += length
+
 class X86Decoder(Visitor):
 	def Reset(self):
 		"""Reset the variables held in the decoder."""
@@ -111,6 +129,18 @@ class X86Decoder(Visitor):
 		:param integer ea: The address from which to decode
 		:rtype: :class:`X86DecodedInstruction`
 		"""		
+		instr,length = self.DecodeInstruction(ea)
+		
+		# Return the instruction with its address and length.
+		return X86DecodedInstruction(ea,instr,length)
+
+	def DecodeInstruction(self,ea):
+		"""Decode the instruction at *ea*, without building the 
+		:class:`X86DecodedInstruction` around it.
+		
+		:param integer ea: The address from which to decode
+		:rtype: tuple (:class:`~.Instruction`, integer length)
+		"""
 		# Reset the state of the class.
 		self.Reset()
 		
@@ -133,10 +163,45 @@ class X86Decoder(Visitor):
 		instr = Instruction(self.group1pfx,mnem,*ops)
 		
 		# Look at the stream position to calculate length.
-		final_ea = self.Stream.Pos()
+		return instr,self.Stream.Pos()-ea
+
+	def IterDecode(self,start,end):
+		"""Linear sweep: decode consecutive instructions from *start* until 
+		reaching or passing *end*, reusing this decoder and its stream.  An
+		instruction that begins before *end* is decoded in full, even if it
+		extends past *end*.  Where no valid instruction can be decoded (or 
+		the input ends in the middle of one), yield ``None`` for a single
+		byte and resume at the next one.
+		
+		:param integer start: The address from which to begin decoding
+		:param integer end: The address at which to stop
+		:rtype: generator of tuples (integer ea, integer length, 
+			:class:`~.Instruction` or ``None``)
+		"""
+		return linear_sweep(self.DecodeInstruction,start,end)
+
+	@classmethod
+	def IterDecodeRange(cls,buf,start=None,end=None,base=0):
+		"""Linear sweep over a buffer (anything accepted by 
+		:class:`~.BufferStreamObj`) whose first byte lies at address *base*,
+		from *start* (default: *base*) to *end* (default: the end of the 
+		buffer).  See :meth:`IterDecode`.
+		
+		:rtype: generator of tuples (integer ea, integer length, 
+			:class:`~.Instruction` or ``None``)
+		"""
+		if start is None: start = base
+		if end   is None: end   = base+len(buf)
+		return cls(BufferStreamObj(buf,base)).IterDecode(start,end)
+
+	@classmethod
+	def DecodeRange(cls,buf,start=None,end=None,base=0):
+		"""As :meth:`IterDecodeRange`, but return a list.
 		
-		# Return the instruction with its address and length.
-		return X86DecodedInstruction(ea,instr,final_ea-ea)
+		:rtype: list of tuples (integer ea, integer length, 
+			:class:`~.Instruction` or ``None``)
+		"""
+		return list(cls.IterDecodeRange(buf,start,end,base))
 	
 	def MakeMethodName(self,enc):
 		"""We override this method from the :class:`~.Visitor.Visitor` class to
@@ -385,3 +450,394 @@ class X86Decoder(Visitor):
 		:rtype: :class:`.JccTarget`
 		"""
 		return self.oJCommon(sign_extend_8_32(self.Stream.Byte()))
+
+class NotCompiled(Exception):
+	"""Raised by an entry of :class:`X86CompiledDecoder` that could not be 
+	compiled, so that the instruction is decoded by :class:`X86Decoder` 
+	instead."""
+	pass
+
+class NeedModRM(BaseException):
+	"""Raised while compiling an entry of :class:`X86CompiledDecoder` when the
+	entry touches the ModRM, but the ModRM is not yet known.  This does not 
+	derive from :exc:`Exception`, so that :class:`~.X86DecodeTable.SSE` 
+	entries, which catch every :exc:`Exception`, let it through."""
+	pass
+
+class ModRMProbeStream(StreamObj):
+	"""A stream that raises :exc:`NeedModRM` upon any attempt to consume a 
+	byte."""
+	def GetByteInternal(self):
+		raise NeedModRM()
+
+# Read a byte, word, or dword from a stream.
+READ_BYTE  = methodcaller("Byte")
+READ_WORD  = methodcaller("Word")
+READ_DWORD = methodcaller("Dword")
+
+def RaiseNotCompiled(stream):
+	"""The compiled entry for anything that could not be compiled."""
+	raise NotCompiled()
+
+class DecodeNode(list):
+	"""A node in the tables walked by :class:`X86CompiledDecoder`.  It holds 
+	256 slots, one for each value of the next byte in the stream.  Each slot 
+	holds either the node for the byte after that, or a compiled entry, or 
+	``None`` if the byte has not been seen yet.
+	
+	:ivar key: the prefix state, a tuple of the group #1 prefixes (a tuple), 
+		the operand-size and address-size prefix flags, and the segment prefix
+	"""
+	def __init__(self,key):
+		list.__init__(self,[None]*256)
+		self.key = key
+
+	def Compile(self,decoder,b):
+		"""Compute the contents of slot *b*, using *decoder*'s compiler, store
+		them, and return them.
+		
+		:param `X86CompiledDecoder` decoder:
+		:param integer b:
+		:rtype: :class:`DecodeNode` or function
+		"""
+		print "Derived class must define"
+		raise NotImplementedError
+
+class PrefixNode(DecodeNode):
+	"""The node for the first byte of an instruction, or the byte after a 
+	prefix.  Prefixes lead to other :class:`PrefixNode` objects, and ``0x0F``
+	to an :class:`EscapeNode`; any other byte is a stem."""
+	def Compile(self,decoder,b):
+		# Have X86Decoder consume the byte as a prefix, if it is one.
+		probe = decoder.Probe(self.key,[b,0x90])
+		if probe.DecodePrefixes() != b:
+			child = PrefixNode(decoder.ProbeKey(probe))
+		elif b == 0x0F:
+			child = EscapeNode(self.key,0x100)
+		else:
+			child = decoder.CompileEntry(b,self.key,None)
+		self[b] = child
+		return child
+
+class EscapeNode(DecodeNode):
+	"""The node for the byte after an escape sequence (``0x0F``, ``0x0F 0x38``,
+	or ``0x0F 0x3A``), as in :meth:`X86Decoder.DecodeStem`.
+	
+	:ivar integer stem: the stem number of the escape sequence
+	"""
+	def __init__(self,key,stem):
+		DecodeNode.__init__(self,key)
+		self.stem = stem
+
+	def Compile(self,decoder,b):
+		if   self.stem == 0x100 and b == 0x38: child = EscapeNode(self.key,0x200)
+		elif self.stem == 0x100 and b == 0x3A: child = EscapeNode(self.key,0x300)
+		else: child = decoder.CompileEntry(self.stem|b,self.key,None)
+		self[b] = child
+		return child
+
+class ModRMNode(DecodeNode):
+	"""The node for the ModRM of a stem whose entry needs one.  For 32-bit
+	memory expressions with a SIB, the ModRM byte leads to a :class:`SIBNode`.
+	
+	:ivar integer stem: the stem number
+	"""
+	def __init__(self,key,stem):
+		DecodeNode.__init__(self,key)
+		self.stem = stem
+
+	def Compile(self,decoder,b):
+		if not self.key[2] and b >> 6 != 3 and b & 7 == 4:
+			child = SIBNode(self.key,self.stem,b)
+		else:
+			child = decoder.CompileEntry(self.stem,self.key,[b])
+		self[b] = child
+		return child
+
+class SIBNode(DecodeNode):
+	"""The node for the SIB that follows the ModRM byte *modrm*.
+	
+	:ivar integer stem: the stem number
+	:ivar integer modrm: the ModRM byte
+	"""
+	def __init__(self,key,stem,modrm):
+		DecodeNode.__init__(self,key)
+		self.stem,self.modrm = stem,modrm
+
+	def Compile(self,decoder,b):
+		child = decoder.CompileEntry(self.stem,self.key,[self.modrm,b])
+		self[b] = child
+		return child
+
+class X86CompiledDecoder(X86Decoder):
+	"""A decoder that produces the same output as :class:`X86Decoder`, but 
+	without walking :data:`.X86DecodeTable.decoding_table` or calling 
+	:meth:`~.Visitor.Visitor.visit` for each operand.  The first time that a 
+	stem is decoded under a given combination of prefixes (and with a given 
+	ModRM and SIB, if the entry needs them), its entry is compiled into a 
+	function.  Everything that depends only upon those bytes is worked out at
+	that time: the mnemonic and operand types that the entry selects, the 
+	registers, the segment, the base and index registers of memory expressions,
+	and the size of the displacement.  Register operands are built once, and 
+	shared among all of the instructions that use them (operands are 
+	immutable).  The compiled function only reads the displacement and 
+	immediates from the stream, and calls one operand decoder per operand.
+	
+	The compiled functions are found by walking a table of :class:`DecodeNode`
+	objects, indexed by the bytes of the prefixes, stem, ModRM, and SIB in 
+	turn.  The table is shared among all instances, and filled in as bytes are
+	encountered.
+	
+	Compiling runs the decoding table and visitor methods of 
+	:class:`X86Decoder` upon a probe decoder with the same prefixes, so the two
+	cannot disagree about what an entry means.  Anything that fails to decode
+	when compiled (invalid encodings and the like) is left to 
+	:class:`X86Decoder` at run time, which raises the same exception it always
+	did.
+	"""
+	root = PrefixNode(((),False,False,None))
+
+	#: The number of different operands that each operand decoder remembers
+	MEMO_SIZE = 64
+
+	def DecodeInstruction(self,ea):
+		"""As :meth:`X86Decoder.DecodeInstruction`.
+		
+		:param integer ea: The address from which to decode
+		:rtype: tuple (:class:`~.Instruction`, integer length)
+		"""
+		stream = self.Stream
+		stream.SetPos(ea)
+		
+		# Walk the table to the compiled entry, compiling as we go.
+		node = self.root
+		while True:
+			b = stream.Byte()
+			entry = node[b]
+			if entry is None:
+				entry = node.Compile(self,b)
+			if not isinstance(entry,DecodeNode):
+				break
+			node = entry
+
+		try:
+			instr = entry(stream)
+		except NotCompiled:
+			return X86Decoder.DecodeInstruction(self,ea)
+		return instr,stream.Pos()-ea
+
+	def Probe(self,key,bytes):
+		"""Make an :class:`X86Decoder` with the prefix state *key*, whose stream
+		holds *bytes* followed by four zero bytes.  If *bytes* is ``None``, 
+		consuming a byte raises :exc:`NeedModRM` instead.
+		
+		:rtype: :class:`X86Decoder`
+		"""
+		group1pfx,sizepfx,addrpfx,segpfx = key
+		if bytes is None:
+			probe = X86Decoder(ModRMProbeStream([]))
+		else:
+			probe = X86Decoder(BufferStreamObj(bytearray(bytes)+bytearray(4)))
+			probe.Stream.SetPos(0)
+		probe.group1pfx = list(group1pfx)
+		probe.sizepfx,probe.addrpfx,probe.segpfx = sizepfx,addrpfx,segpfx
+		return probe
+
+	def ProbeKey(self,probe):
+		"""Return the prefix state of *probe*, as in :class:`DecodeNode`.
+		
+		:rtype: tuple
+		"""
+		return (tuple(probe.group1pfx),probe.sizepfx,probe.addrpfx,probe.segpfx)
+
+	def CompileEntry(self,stem,key,modrm):
+		"""Compile the entry for *stem* under the prefix state *key*, given the
+		ModRM (and SIB) bytes in the list *modrm*, or ``None`` if they haven't
+		been read.
+		
+		:rtype: :class:`ModRMNode` if the ModRM is needed, otherwise a function
+			taking the stream and returning an :class:`~.Instruction`
+		"""
+		entry = X86DecodeTable.decoding_table[stem]
+		if entry is X86DecodeTable.Fatal:
+			return RaiseNotCompiled
+		probe = self.Probe(key,modrm)
+		encs,ops = [],[]
+		try:
+			# Select the mnemonic and abstract operand types, and compile the 
+			# operands.
+			mnem,oplist = entry.decode(probe)
+			encs = [ self.Resolve(AOTtoAOTDL[o.IntValue()],probe) for o in oplist ]
+			for enc in encs:
+				ops.append(self.CompileOperand(enc,probe))
+
+			# Consume the ModRM, if there is one, to find the size of the 
+			# displacement.
+			dispsize = 0
+			if modrm is not None:
+				probe.ModRM
+				dispsize = probe.Stream.Pos()-len(modrm)
+		
+		except NeedModRM:
+			# The ModRM will be read before any immediates, which is only right
+			# if no immediate comes before the operands that touched it.
+			if any(isinstance(enc,(ImmEnc,SignedImm)) for enc in encs[:len(ops)]):
+				return RaiseNotCompiled
+			return ModRMNode(key,stem)
+		
+		except Exception:
+			return RaiseNotCompiled
+		
+		return self.MakeEntry(probe.group1pfx,mnem,dispsize,probe.addrpfx,ops)
+
+	def MakeEntry(self,prefixes,mnem,dispsize,addrpfx,ops):
+		"""Build the function that reads a displacement of *dispsize* bytes, then
+		decodes the operands with the operand decoders *ops*, and returns the 
+		instruction.
+		
+		:rtype: function taking the stream and returning an 
+			:class:`~.Instruction`
+		"""
+		prefixes = tuple(prefixes)
+		if dispsize == 0:
+			def Entry(stream):
+				return Instruction(list(prefixes),mnem,*[ op(stream,None) for op in ops ])
+			return Entry
+		if dispsize == 1:
+			extend = sign_extend_8_16 if addrpfx else sign_extend_8_32
+			def Entry(stream):
+				disp = extend(stream.Byte())
+				return Instruction(list(prefixes),mnem,*[ op(stream,disp) for op in ops ])
+			return Entry
+		def Entry(stream):
+			disp = stream.Word() if dispsize == 2 else stream.Dword()
+			return Instruction(list(prefixes),mnem,*[ op(stream,disp) for op in ops ])
+		return Entry
+
+	def Resolve(self,enc,probe):
+		"""Resolve :class:`.SizePrefix` and :class:`.AddrPrefix` encodings under
+		*probe*'s prefixes.
+		
+		:param `.X86AOTDL` enc:
+		:rtype: `.X86AOTDL`
+		"""
+		while isinstance(enc,(SizePrefix,AddrPrefix)):
+			flag = probe.sizepfx if isinstance(enc,SizePrefix) else probe.addrpfx
+			enc = enc.yes if flag else enc.no
+		return enc
+
+	def CompileOperand(self,enc,probe):
+		"""Compile the encoding *enc* into an operand decoder, using the 
+		``compile_`` method corresponding to *probe*'s ``visit_`` method.
+		
+		:param `.X86AOTDL` enc:
+		:rtype: function taking the stream and the displacement, and returning 
+			an :class:`~.Operand`
+		"""
+		return getattr(self,"compile_"+probe.MakeMethodName(enc)[len("visit_"):])(enc,probe)
+
+	def Constant(self,op):
+		"""An operand decoder that returns *op*.
+		
+		:param `.Operand` op:
+		:rtype: function
+		"""
+		return lambda stream,disp: op
+
+	def Memoized(self,make,read=None):
+		"""An operand decoder that returns the operand that *make* makes from 
+		the displacement or, if *read* is given, from the value that 
+		``read(stream)`` reads.  Operands are immutable, so like registers, they
+		can be shared:  the operands are remembered for up to :attr:`MEMO_SIZE` 
+		different values.
+		
+		:param function make: maps a value to an :class:`~.Operand`
+		:param function read: reads a value from the stream
+		:rtype: function
+		"""
+		memo,size = dict(),self.MEMO_SIZE
+		def Decode(stream,disp):
+			value = disp if read is None else read(stream)
+			op = memo.get(value)
+			if op is None:
+				op = make(value)
+				if len(memo) < size:
+					memo[value] = op
+			return op
+		return Decode
+
+	def compile_Exact(self,i,probe):
+		return self.Constant(probe.visit_Exact(i))
+	
+	def compile_ExactSeg(self,i,probe):
+		return self.Constant(probe.visit_ExactSeg(i))
+
+	def compile_GPart(self,g,probe):
+		return self.Constant(probe.visit_GPart(g))
+
+	def compile_GPart_SegReg(self,g,probe):
+		return self.Constant(probe.visit_GPart_SegReg(g))
+
+	def compile_RegOrMem_Register(self,m,probe):
+		return self.Constant(probe.visit_RegOrMem_Register(m))
+
+	def compile_RegOrMem_MemExpr(self,m,probe):
+		# The displacement is read by the entry; everything else is known.
+		mem = probe.visit_RegOrMem_MemExpr(m)
+		seg,size,br,sr = mem.Seg,mem.size,mem.BaseReg,mem.IndexReg
+		if probe.addrpfx:
+			return self.Memoized(lambda disp: Mem16(seg,size,br,sr,disp))
+		sf = mem.ScaleFac
+		return self.Memoized(lambda disp: Mem32(seg,size,br,sr,sf,disp))
+
+	def compile_Immediate_Ib(self,i,probe):
+		return self.Memoized(Ib,READ_BYTE)
+
+	def compile_Immediate_Iw(self,i,probe):
+		return self.Memoized(Iw,READ_WORD)
+
+	def compile_Immediate_Id(self,i,probe):
+		return self.Memoized(Id,READ_DWORD)
+
+	def compile_Immediate_MemExpr(self,i,probe):
+		seg,size = probe.GetSegment(),i.archetype.size
+		if probe.addrpfx: 
+			return self.Memoized(lambda off: Mem16(seg,size,None,None,off),READ_WORD)
+		return self.Memoized(lambda off: Mem32(seg,size,None,None,0,off),READ_DWORD)
+
+	def compile_Immediate_FarTarget(self,i,probe):
+		if probe.addrpfx:
+			def FarTarget16(stream,disp):
+				off = stream.Word()
+				return AP16(stream.Word(),off)
+			return FarTarget16
+		def FarTarget32(stream,disp):
+			off = stream.Dword()
+			return AP32(stream.Word(),off)
+		return FarTarget32
+
+	def compile_SignExtImm_Iw(self,i,probe):
+		return self.Memoized(lambda b: Iw(sign_extend_8_16(b)),READ_BYTE)
+
+	def compile_SignExtImm_Id(self,i,probe):
+		return self.Memoized(lambda b: Id(sign_extend_8_32(b)),READ_BYTE)
+
+	def CompileJcc(self,probe,read):
+		"""As :meth:`X86Decoder.oJCommon`, given the function *read* that reads
+		the displacement from the stream.
+		
+		:rtype: function
+		"""
+		mask = 0xFFFF if probe.addrpfx else 0xFFFFFFFF
+		def Jcc(stream,disp):
+			x = read(stream)
+			ea = stream.Pos()
+			return JccTarget((x+ea) & mask,ea)
+		return Jcc
+
+	def compile_Immediate_JccTarget(self,j,probe):
+		if probe.addrpfx: return self.CompileJcc(probe,lambda stream: stream.Word())
+		else:             return self.CompileJcc(probe,lambda stream: stream.Dword())
+
+	def compile_SignExtImm_JccTarget(self,i,probe):
+		return self.CompileJcc(probe,lambda stream: sign_extend_8_32(stream.Byte()))
@@ -5,6 +5,7 @@ treatment while converting the instructions into bytes:
 
 * :class:`Ordinary` requires no special treatment.
 * :class:`Native16` encodings require size prefixes.
+* :class:`Addr16` encodings require address size prefixes.
 * :class:`ModRMGroup` encodings set the Ordinary's :attr:`.GGG` member.
 """
 
@@ -55,6 +56,17 @@ class Native16(X86Enc):
 		#raise ExerciseError("X86EncodeTable::Native16")
 		encoder.sizepfx = True
 
+class Addr16(X86Enc):
+	"""The encoding method class for X86 instructions that require an addrsize
+	prefix in order to be encoded."""
+	def Encode(self,encoder): 
+		"""Addr16 instruction encodings must set the *addrpfx* member of 
+		*encoder*.
+
+		:param `.X86Encoder.X86Encoder` encoder: Encoder object
+		"""
+		encoder.addrpfx = True
+
 class ModRMGroup(X86Enc): 
 	"""The encoding method class for X86 instructions that are part of a ModRM
 	group, and thus require that the encoder's ModRM member :attr:`.GGG` be set
@@ -653,6 +665,11 @@ mnem_to_encodings[v(Aad)]    = [
   ]
 mnem_to_encodings[v(Salc)]   = [Ordinary([0xD6],eNone)]
 mnem_to_encodings[v(Xlat)]   = [Ordinary([0xD7],eMbEbx)]
+mnem_to_encodings[v(Loopnz)] = [Ordinary([0xE0],[OJb])]
+mnem_to_encodings[v(Loopz)]  = [Ordinary([0xE1],[OJb])]
+mnem_to_encodings[v(Loop)]   = [Ordinary([0xE2],[OJb])]
+mnem_to_encodings[v(Jcxz)]   = [Addr16([0xE3],[OJb])]
+mnem_to_encodings[v(Jecxz)]  = [Ordinary([0xE3],[OJb])]
 mnem_to_encodings[v(In)]     = [
   Ordinary([0xE4],eALIb),
   Ordinary([0xE5],eeAXIb),
@@ -695,6 +712,7 @@ mnem_to_encodings[v(Idiv)]   = [
   ModRMGroup(7,[0xF7],eEv),
   ]
 mnem_to_encodings[v(Call)]   = [
+  Ordinary([0xE8],[OJz]),
   ModRMGroup(2,[0xFF],eEv),
   ]
 mnem_to_encodings[v(CallF)]  = [
@@ -1210,7 +1228,22 @@ mnem_to_encodings[v(Haddpd)]  = [Ordinary([0x66,0x0F,0x7C],eVpdWpd)]
 mnem_to_encodings[v(Haddps)]  = [Ordinary([0xF2,0x0F,0x7C],eVpsWps)]
 mnem_to_encodings[v(Hsubpd)]  = [Ordinary([0x66,0x0F,0x7D],eVpdWpd)]
 mnem_to_encodings[v(Hsubps)]  = [Ordinary([0xF2,0x0F,0x7D],eVpsWps)]
-#* TODO: JCC FROM 0x180-0x190 *)
+mnem_to_encodings[v(Jo)]       = [Ordinary([0x0F,0x80],[OJz])]
+mnem_to_encodings[v(Jno)]      = [Ordinary([0x0F,0x81],[OJz])]
+mnem_to_encodings[v(Jb)]       = [Ordinary([0x0F,0x82],[OJz])]
+mnem_to_encodings[v(Jae)]      = [Ordinary([0x0F,0x83],[OJz])]
+mnem_to_encodings[v(Jz)]       = [Ordinary([0x0F,0x84],[OJz])]
+mnem_to_encodings[v(Jnz)]      = [Ordinary([0x0F,0x85],[OJz])]
+mnem_to_encodings[v(Jbe)]      = [Ordinary([0x0F,0x86],[OJz])]
+mnem_to_encodings[v(Ja)]       = [Ordinary([0x0F,0x87],[OJz])]
+mnem_to_encodings[v(Js)]       = [Ordinary([0x0F,0x88],[OJz])]
+mnem_to_encodings[v(Jns)]      = [Ordinary([0x0F,0x89],[OJz])]
+mnem_to_encodings[v(Jp)]       = [Ordinary([0x0F,0x8A],[OJz])]
+mnem_to_encodings[v(Jnp)]      = [Ordinary([0x0F,0x8B],[OJz])]
+mnem_to_encodings[v(Jl)]       = [Ordinary([0x0F,0x8C],[OJz])]
+mnem_to_encodings[v(Jge)]      = [Ordinary([0x0F,0x8D],[OJz])]
+mnem_to_encodings[v(Jle)]      = [Ordinary([0x0F,0x8E],[OJz])]
+mnem_to_encodings[v(Jg)]       = [Ordinary([0x0F,0x8F],[OJz])]
 mnem_to_encodings[v(Seto)]     = [ModRMGroup(0,[0x0F,0x90],eEb)]
 mnem_to_encodings[v(Setno)]    = [ModRMGroup(0,[0x0F,0x91],eEb)]
 mnem_to_encodings[v(Setb)]     = [ModRMGroup(0,[0x0F,0x92],eEb)]
@@ -9,6 +9,7 @@ from X86TypeChecker import X86TypeChecker
 from X86ModRM import ModRM16, ModRM32, little_endian_bytes
 from Pandemic.Util.Visitor import Visitor2
 from Pandemic.Util.ExerciseError import ExerciseError
+from collections import OrderedDict
 
 #: Mapping from segments to their appropriate prefix bytes.
 PrefixOfSeg=dict()
@@ -19,6 +20,55 @@ PrefixOfSeg[ES] = 0x26
 PrefixOfSeg[FS] = 0x64
 PrefixOfSeg[GS] = 0x65
 
+#: Default number of encoded instructions remembered by an :class:`X86Encoder`.
+DEFAULT_ENCODE_CACHE_SIZE = 4096
+
+def operand_key(op):
+	"""Return a tuple of plain values that identifies the operand *op* 
+	completely, or ``None`` if *op* is ``None``.  Unlike the operand objects
+	themselves, these keys are immutable and cheap to hash and compare.
+	
+	:param `.Operand` op:
+	:rtype: tuple
+	"""
+	if op is None: return None
+	if isinstance(op,Register):  return (type(op),op.IntValue())
+	if isinstance(op,Immediate): return (type(op),op.value)
+	if isinstance(op,MemExpr):
+		basereg  = None if op.BaseReg  is None else op.BaseReg.IntValue()
+		indexreg = None if op.IndexReg is None else op.IndexReg.IntValue()
+		scalefac = op.ScaleFac if isinstance(op,Mem32) else 0
+		return (type(op),op.Seg.IntValue(),op.size.IntValue(),basereg,indexreg,scalefac,op.Disp)
+	if isinstance(op,FarTarget): return (type(op),op.Seg,op.Off)
+	if isinstance(op,JccTarget): return (type(op),op.Taken,op.NotTaken)
+	raise TypeError("operand_key: unknown operand %r" % op)
+
+def operand_signature(op):
+	"""Return a tuple describing those properties of the operand *op* that the
+	type-checker looks at when deciding whether *op* matches an abstract 
+	operand type:  its class, and
+	
+	* for registers, which register it is;
+	* for immediates, whether the value is ``1`` (:data:`~.O1`), and whether 
+	  it can be sign-extended from 8 bits (:class:`~.SignedImm`);
+	* for memory expressions, everything but the displacement's value 
+	  (:class:`~.ExactSeg` compares the whole expression).
+	
+	Operands with equal signatures match exactly the same encodings, with the
+	same prefixes.
+	
+	:param `.Operand` op:
+	:rtype: tuple
+	"""
+	if op is None: return None
+	if isinstance(op,Register):  return (type(op),op.IntValue())
+	if isinstance(op,Immediate):
+		value = op.value
+		return (type(op),value == 1,value < 0x80 or value >= op.mask-0x7F)
+	if isinstance(op,MemExpr):
+		return operand_key(op)[:-1] + (op.Disp is None,)
+	return (type(op),)
+
 class X86Encoder(Visitor2):
 	"""This :class:`~.Visitor2` class is responsible for turning X86 
 	:class:`~.Instruction` objects into their encoded binary representation, 
@@ -36,13 +86,27 @@ class X86Encoder(Visitor2):
 	:ivar immediates: Any operands that are encoded as bytes after the prefixes,
 		stem, and optional ModRM
 	:type immediates: integer list
+	:ivar integer cache_size: The maximum number of encoded instructions to
+		remember, or ``0`` to disable the cache
+	:ivar integer hits: The number of encodings taken from the cache
+	:ivar integer misses: The number of encodings not found in the cache
 	"""
+	#: Maps a mnemonic and operand signatures (see :func:`operand_signature`)
+	#: to the encoding that the search in :meth:`FindEncoding` chose for them,
+	#: along with the prefixes that the type-checker required, or ``None`` if
+	#: no encoding matched.  Shared among all instances.
+	encoding_index = dict()
+
 	# We will need to type-check the instructions before we encode them, as well 
 	# as consult some other type-checker functionality.
-	def __init__(self):
+	def __init__(self,cache_size=DEFAULT_ENCODE_CACHE_SIZE):
 		self.tc = X86TypeChecker()
 		self.Reset()
 		self.addr = 0
+		self.cache_size = cache_size
+		self.cache = OrderedDict()
+		self.hits = 0
+		self.misses = 0
 	
 	def Reset(self):
 		"""Clear all held state within the encoder object."""
@@ -72,58 +136,105 @@ class X86Encoder(Visitor2):
 		:param integer addr: The address at which to encode
 		:rtype: integer list
 		"""
+		# If this instruction was encoded recently, return a copy of the bytes.
+		# The encoding of a relative jump target depends upon the address.
+		if self.cache_size > 0:
+			ops = (instr.op1,instr.op2,instr.op3)
+			key = (instr.mnem.IntValue(),tuple(p.IntValue() for p in instr.prefixes)) + tuple(map(operand_key,ops))
+			if any(isinstance(op,JccTarget) for op in ops):
+				key = key + (addr,)
+			bytes = self.cache.pop(key,None)
+			if bytes is not None:
+				self.hits += 1
+				self.cache[key] = bytes
+				return list(bytes)
+			self.misses += 1
+
 		self.Reset()
 		self.addr = addr
 
+		# Find an encoding whose operands type-check.
+		found = self.FindEncoding(instr)
+
+		# If the instruction did not match any valid encoding, throw an 
+		# InvalidInstruction() exception.
+		if found is None:
+			print "Couldn't encode %s" % instr
+			raise InvalidInstruction()
+
+		# Store the information about size, address size, and segment prefixes
+		# into the context.
+		enc,val = found
+		self.sizepfx = val[0]
+		self.addrpfx = val[1]
+		self.segpfx  = val[2]
+		
+		# Copy the stem bytes.
+		self.stem = enc.bytes
+		
+		# Attend to anything special that the encoding method requires.
+		enc.Encode(self)
+		
+		# Encode the operands by invoking self.visit on the operand and its
+		# X86AOTDL object.
+		for i in xrange(len(enc.ops)):
+			self.visit(instr.GetOp(i),AOTtoAOTDL[enc.ops[i].IntValue()])
+		
+		# Start with an empty byte list.
+		enc = []
+
+		# Collect any necessary prefixes.
+		if self.segpfx != None:    enc.append(PrefixOfSeg[self.segpfx])
+		if self.addrpfx:           enc.append(0x67)
+		if self.sizepfx:           enc.append(0x66)
+		if self.group1pfx != None: enc.append(self.group1pfx)
+		
+		# Append the stem.
+		enc += self.stem
+		
+		# Collect the ModRM, if present.
+		if self._modrm != None:    enc += self.ModRM.Encode()
+		
+		# Collect the immediates, if present.
+		if self.immediates != []:  enc += self.immediates
+
+		# Remember the bytes, evicting the least recently used entry if the 
+		# cache is full.
+		if self.cache_size > 0:
+			if len(self.cache) >= self.cache_size:
+				self.cache.popitem(last=False)
+			self.cache[key] = tuple(enc)
+		
+		# That's the entire instruction.  Return it.
+		return enc
+
+	def FindEncoding(self,instr):
+		"""Find the first encoding in :data:`mnem_to_encodings` for *instr*'s
+		mnemonic whose operands type-check, consulting and updating 
+		:attr:`encoding_index`.
+		
+		:param `.Instruction` instr: The x86 instruction to encode
+		:rtype: tuple (encoding, ( `bool` , `bool`, `.SegElt` ) tuple), or 
+			``None`` if no encoding matched
+		"""
+		sig = (instr.mnem.IntValue(),operand_signature(instr.op1),operand_signature(instr.op2),operand_signature(instr.op3))
+		try:
+			return self.encoding_index[sig]
+		except KeyError:
+			pass
+
+		found = None
+		
 		# For every encoding for the instruction's mnemonic:
 		for enc in X86EncodeTable.mnem_to_encodings[instr.mnem.IntValue()]:
 			# See if the encoding matches, i.e. if the operands type-check.
 			val = self.tc.TypeCheckInstruction_opt(instr,enc.ops)
-			if val == None: 
-				continue
-			
-			# If it matched, store the information about size, address size, and 
-			# segment prefixes into the context.
-			self.sizepfx = val[0]
-			self.addrpfx = val[1]
-			self.segpfx  = val[2]
-			
-			# Copy the stem bytes.
-			self.stem = enc.bytes
-			
-			# Attend to anything special that the encoding method requires.
-			enc.Encode(self)
-			
-			# Encode the operands by invoking self.visit on the operand and its
-			# X86AOTDL object.
-			for i in xrange(len(enc.ops)):
-				self.visit(instr.GetOp(i),AOTtoAOTDL[enc.ops[i].IntValue()])
-			
-			# Start with an empty byte list.
-			enc = []
-
-			# Collect any necessary prefixes.
-			if self.segpfx != None:    enc.append(PrefixOfSeg[self.segpfx])
-			if self.addrpfx:           enc.append(0x67)
-			if self.sizepfx:           enc.append(0x66)
-			if self.group1pfx != None: enc.append(self.group1pfx)
-			
-			# Append the stem.
-			enc += self.stem
-			
-			# Collect the ModRM, if present.
-			if self._modrm != None:    enc += self.ModRM.Encode()
-			
-			# Collect the immediates, if present.
-			if self.immediates != []:  enc += self.immediates
-			
-			# That's the entire instruction.  Return it.
-			return enc
-
-		# Otherwise, the instruction did not match any valid encoding.  Throw an
-		# InvalidInstruction() exception.
-		print "Couldn't encode %s" % instr
-		raise InvalidInstruction()
+			if val != None: 
+				found = (enc,val)
+				break
+		
+		self.encoding_index[sig] = found
+		return found
 	
 	# Encode more than one instruction, updating the address as we go.
 	def EncodeInstructions(self,instrs,addr=0):
@@ -173,7 +284,7 @@ class X86Encoder(Visitor2):
 		# JccTarget operand to specialized methods.
 		if isinstance(enc,SignedImm):
 			op = enc.archetype
-			if isinstance(op,JccTarget): return "visit_Immediate_JccTarget"
+			if isinstance(op,JccTarget): return "visit_SignExtImm_JccTarget"
 			return "visit_Immediate_Ib"
 
 		# Otherwise, use a generic name based on the X86TypeLang class name.
@@ -317,7 +428,7 @@ class X86Encoder(Visitor2):
 		:param `.ImmEnc` i:		
 		"""		
 		# Get the address of the destination.
-		dest = op._taken.value
+		dest = op.Taken
 
 		# If there was an address-size prefix and the destination was not 16-bit,
 		# we can't encode this instruction, so throw an error.
@@ -331,6 +442,29 @@ class X86Encoder(Visitor2):
 		displacement = (dest - (self.addr + instrlen)) & 0xFFFFFFFF
 		self.AppendImmediate(displacement,2 if self.addrpfx else 4)
 
+	def visit_SignExtImm_JccTarget(self,op,i):
+		"""For JccTargets of instructions that only have a short form (``loop``, 
+		``jecxz``, and the like), the displacement is a single signed byte.  If
+		the destination is out of its range, throw :exc:`~.BranchOutOfRange`.
+
+		:param `.JccTarget` op:
+		:param `.SignedImm` i:		
+		"""		
+		# Get the address of the destination.  With an address-size prefix, it
+		# must be 16-bit, as in the decoder.
+		dest = op.Taken
+		if self.addrpfx and dest > 0xFFFF:
+			raise BranchOutOfRange()
+
+		# Compute the length of the instruction, and the displacement.
+		instrlen =  (self.segpfx  != None) + (self.sizepfx == True)
+		instrlen += (self.addrpfx == True) + (self.group1pfx != None)
+		instrlen += len(self.stem) + 1
+		displacement = dest - (self.addr + instrlen)
+		if not -0x80 <= displacement < 0x80:
+			raise BranchOutOfRange()
+		self.AppendImmediate(displacement & 0xFF,1)
+
 	def visit_SizePrefix(self,op,z): 
 		"""Visit the appropriate child depending upon whether a size prefix is 
 		present.
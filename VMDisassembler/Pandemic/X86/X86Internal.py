@@ -1,6 +1,5 @@
 from X86MetaData import *
-from Pandemic.Util.Guarded import *
-from Pandemic.Util.HashFunctions import unary_hash, binary_hash
+from Pandemic.Util.HashFunctions import unary_hash, binary_hash, stable_hash
 
 def X86Hexify(value):
 	"""Function to make an X86-style hexadecimal string.  I.e., it should end in
@@ -17,21 +16,49 @@ def X86Hexify(value):
 	return "%sh" % str.upper(hstr)
 
 class Operand(object):
-	"""Base class for X86 operands, containing some of the Python glue."""
+	"""Base class for X86 operands, containing some of the Python glue.  
+	
+	Operands are immutable, so that they may be shared freely:  the constructors
+	set their fields via ``object.__setattr__``, and assigning to a field 
+	afterwards raises :exc:`AttributeError`.  To obtain a modified operand, 
+	construct a new one.  The fields are held in ``__slots__``.
+
+	Since the fields never change, the hash is computed once, by 
+	:meth:`ComputeHash` at the end of construction, and held in the ``_hash``
+	slot.
+	"""
+	__slots__ = ('_hash',)
+
+	def __setattr__(self,name,value):
+		raise AttributeError("%s is immutable" % self.__class__.__name__)
+
+	def __delattr__(self,name):
+		raise AttributeError("%s is immutable" % self.__class__.__name__)
+
 	def __eq__(self,other):
-		return type(self) == type(other) and self.value == other.value
+		return self is other or (type(self) == type(other) and self.value == other.value)
 	
 	def __ne__(self,other):
 		return not(self.__eq__(other))
 
 	def __hash__(self):
+		return self._hash
+
+	def SetHash(self):
+		"""Compute the hash of the (fully-constructed) operand, and store it."""
+		object.__setattr__(self,'_hash',self.ComputeHash())
+
+	def ComputeHash(self):
 		return unary_hash(hash(self.value),self._hashcode)
 
-# Registers are held in GuardedEnumeration elements.  This allows us to ensure
-# that they are valid at all times, as well as simplfying the process of 
-# printing and setting them, as well as creating them from 0-indexed values.
-# The Register class also supports retrieving the register as a 0-indexed 
-# value (its IntValue() method).
+# The interned registers, keyed by (class, register number).
+interned_registers = dict()
+
+# Registers are held in enumeration elements.  This allows us to ensure that 
+# they are valid at all times, as well as simplfying the process of printing 
+# them, as well as creating them from 0-indexed values.  The Register class 
+# also supports retrieving the register as a 0-indexed value (its IntValue() 
+# method).
 class Register(Operand):
 	"""The base class for all registers in X86 assembly language.  The 
 	constructor takes two parameters: *value* and *adjust_value*.  If
@@ -41,19 +68,30 @@ class Register(Operand):
 	``True``, then *value* is interpreted as an integer, and it is used to
 	construct an :class:`~.EnumElt` of type *regtype*.
 	
+	Registers are interned:  constructing a register returns the existing 
+	object for that register, if there is one.
+	
 	:ivar `~.EnumElt` value: an enumeration element corresponding to the 
 		particular register being represented
-	:ivar `~.EnumElt` regtype: a derivative of :class:`~.EnumElt` corresponding
+	:cvar `~.EnumElt` regtype: a derivative of :class:`~.EnumElt` corresponding
 		to the type of register a derived class represents
 	"""
-	def init(self,value,hashcode,regtype,adjust_value=False):
-		self.value = regtype(value) if adjust_value else value
+	__slots__ = ('value',)
+
+	def __new__(cls,value,adjust_value=False):
 		if not adjust_value:
-			if not isinstance(value,regtype):
-				print "Register:  value %s requires type %s" % (value,regtype)
+			if not isinstance(value,cls.regtype):
+				print "Register:  value %s requires type %s" % (value,cls.regtype)
 				raise TypeError
-		self._hashcode = hashcode
-	
+			value = value.IntValue()
+		key = (cls,value)
+		reg = interned_registers.get(key)
+		if reg is None:
+			reg = object.__new__(cls)
+			object.__setattr__(reg,'value',cls.regtype(value))
+			reg.SetHash()
+			interned_registers[key] = reg
+		return reg
 	
 	def IntValue(self):
 		"""Retrieve the integer value ``0-7`` from the held *value*.
@@ -63,14 +101,13 @@ class Register(Operand):
 		return self.value.IntValue()
 	
 	def __call__(self,value):
-		"""Create a new :class:`.Register` object, of the same type as *self*,
-		using the integer value *value*.
+		"""Obtain the :class:`.Register` object, of the same type as *self*, for
+		the integer value *value*.
 		
 		:ivar integer value: the register number for the new :class:`.Register` 
 			object
 		:rtype: Register
-		:returns: The new :class:`Register` object corresponding to integer 
-			*value*.
+		:returns: The :class:`Register` object corresponding to integer *value*.
 		"""
 		return type(self)(value,True)
 
@@ -83,23 +120,21 @@ class Register(Operand):
 class GeneralReg(Register):
 	"""GeneralReg gets its own class in the hierarchy, so we can distinguish them
 	from other types of registers."""
-	pass
+	__slots__ = ()
 
 class Immediate(Operand):
-	"""Immediates are held in guarded integers, so that they never exceed their
-	bounds (i.e., 8-bit values are always 0 <= value <= 0xFF)."""
-	def init(self,hashcode,value,mask):
-		self._hashcode = hashcode
-		self.held = GuardedInteger(value,mask)	
-
-	# This property allows us to access the GuardedInteger's value transparently.
-	@property
-	def value(self):
-		"""The integer value of an immediate constant."""
-		return self.held.value
-	@value.setter
-	def value(self,val):
-		self.held.value = val
+	"""Immediates are truncated to their size upon construction, so that they 
+	never exceed their bounds (i.e., 8-bit values are always 
+	0 <= value <= 0xFF).
+	
+	:ivar integer value: the integer value of the immediate constant
+	:cvar integer mask: the legal bits of *value*
+	"""
+	__slots__ = ('value',)
+
+	def __init__(self,value):
+		object.__setattr__(self,'value',None if value is None else value & self.mask)
+		self.SetHash()
 
 	def __call__(self,value):
 		"""Create a new :class:`.Immediate` object, of the same type as *self*,
@@ -112,42 +147,44 @@ class Immediate(Operand):
 		return type(self)(value)
 
 	def __repr__(self):
-		return "%s(%#x)" % (self.__class__.__name__,self.held.value)
+		return "%s(%#x)" % (self.__class__.__name__,self.value)
 	def __str__(self):
-		return X86Hexify(self.held.value)
+		return X86Hexify(self.value)
 	
 class MemExpr(Operand):
 	"""Base class for memory operands.
 	
 	:ivar `.SegElt` Seg: the segment in which the access takes place
+	:ivar `.MemSizeElt` size: the size of the access
+	:ivar integer Disp: the displacement, or ``None``.  16-bit for 
+		:class:`Mem16`, 32-bit for :class:`Mem32`.
+	:cvar `~.EnumElt` regtype: the type of the base and index registers
+	:cvar integer mask: the legal bits of *Disp*
 	"""
+	__slots__ = ('Seg','size','BaseReg','IndexReg','Disp')
+
 	def __init__(self,seg,size):
-		self.Seg = seg
-		self.size = size
-	
-	def init(self,hashcode,seg,size,regtype,basereg,indexreg,disp,mask,adjust_values):
-		self._hashcode = hashcode
-		self.Seg = seg
-		self.size = size
-		self.BaseReg  = regtype( basereg) if adjust_values else  basereg
-		self.IndexReg = regtype(indexreg) if adjust_values else indexreg
-		if not adjust_values:
+		object.__setattr__(self,'Seg',seg)
+		object.__setattr__(self,'size',size)
+
+	def init(self,seg,size,basereg,indexreg,disp,adjust_values):
+		regtype = self.regtype
+		if adjust_values:
+			basereg  = None if basereg  is None else regtype(basereg)
+			indexreg = None if indexreg is None else regtype(indexreg)
+		else:
 			if basereg is not None and not isinstance(basereg,regtype):
 				print "MemExpr:  basereg %s requires type %s"  % (basereg,regtype)
 				raise TypeError
 			if indexreg is not None and not isinstance(indexreg,regtype):
 				print "MemExpr:  indexreg %s requires type %s" % (indexreg,regtype)
 				raise TypeError
-		self._disp = GuardedInteger(None if disp == None or disp == 0 else disp,mask)
-	
-	@property
-	def Disp(self): 
-		"""Integer displacement; may be ``None``.  16-bit for :class:`Mem16`, 
-		32-bit for :class:`Mem32`."""
-		return self._disp.value
-	@Disp.setter
-	def Disp(self,value): 
-		self._disp.value = value
+		setfield = object.__setattr__
+		setfield(self,'Seg',seg)
+		setfield(self,'size',size)
+		setfield(self,'BaseReg',basereg)
+		setfield(self,'IndexReg',indexreg)
+		setfield(self,'Disp',None if disp == None or disp == 0 else disp & self.mask)
 
 	def __str__(self):
 		segstr = "" if self.Seg == self.DefaultSeg() else "%s:" % self.Seg
@@ -166,49 +203,37 @@ class MemExpr(Operand):
 	def HashIndex(self):
 		"""Used internally for hashing the index component.  Differs in 
 		:class:`.Mem16` and :class:`.Mem32` objects."""
-		return hash(self.IndexReg)
+		return stable_hash(self.IndexReg)
 	
-	def __hash__(self):
-		h1 = binary_hash(hash(self.BaseReg),self.HashIndex(),self._hashcode+1)
+	def ComputeHash(self):
+		h1 = binary_hash(stable_hash(self.BaseReg),self.HashIndex(),self._hashcode+1)
 		h2 = binary_hash(hash(self.size),h1,self._hashcode+3)
-		return binary_hash(h2,hash(self.Disp),self._hashcode)
+		return binary_hash(h2,stable_hash(self.Disp),self._hashcode)
 	
 class FarTarget(Operand):
-	"""Base class for memory operands specified as segment:offset pairs."""
-	def init(self,hashcode,seg,off,mask):
-		self._hashcode = hashcode
-		self._seg = GuardedInteger(seg,0xFFFF)
-		self._off = GuardedInteger(off,mask)
-	
-	# Properties that allow us to access the integer values from the 
-	# GuardedInteger representations that we store internally.
-	@property
-	def Seg(self):
-		"""16-bit integer value for the segment."""
-		return self._seg.value
-	@Seg.setter
-	def Seg(self,value):
-		self._seg.value = value
-	
-	@property
-	def Off(self):
-		"""Integer value for the offset.  16-bits in :class:`.AP16`, 32-bits in 
-		:class:`.AP32`."""
-		return self._off.value
-	@Off.setter
-	def Off(self,value):
-		self._off.value = value
+	"""Base class for memory operands specified as segment:offset pairs.
+	
+	:ivar integer Seg: 16-bit integer value for the segment
+	:ivar integer Off: integer value for the offset.  16-bits in 
+		:class:`.AP16`, 32-bits in :class:`.AP32`.
+	:cvar integer mask: the legal bits of *Off*
+	"""
+	__slots__ = ('Seg','Off')
+
+	def __init__(self,seg,off):
+		object.__setattr__(self,'Seg',seg & 0xFFFF)
+		object.__setattr__(self,'Off',off & self.mask)
+		self.SetHash()
 
 	# Boilerplate
 	def __repr__(self):
-		return "%s(%r,%r)" % (self.__class__.__name__,self._seg,self._off)
+		return "%s(%r,%r)" % (self.__class__.__name__,self.Seg,self.Off)
 
 	def __str__(self):
-		return "%s:%s" % (X86Hexify(self._seg.value),X86Hexify(self._off.value))
+		return "%s:%s" % (X86Hexify(self.Seg),X86Hexify(self.Off))
 
 	def __eq__(self,other):
 		return type(self)==type(other) and self.Seg == other.Seg and self.Off == other.Off
 	
-	def __hash__(self):
-		return binary_hash(hash(self._seg),hash(self._off),self._hashcode)
-
+	def ComputeHash(self):
+		return binary_hash(self.Seg,self.Off,self._hashcode)
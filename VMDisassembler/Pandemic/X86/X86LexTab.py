@@ -0,0 +1,9 @@
+# X86LexTab.py. This file automatically created by PLY (version 3.4). Don't edit!
+_tabversion   = '3.4'
+_lextokens    = {'Gw': 1, 'FPU': 1, 'CNT': 1, 'Gd': 1, 'MMX': 1, 'XMM': 1, 'NUM': 1, 'LSQBR': 1, 'DBG': 1, 'TIMES': 1, 'Seg': 1, 'Mnem': 1, 'COLON': 1, 'PLUS': 1, 'Gb': 1, 'PFX': 1, 'COMMA': 1, 'SIZE': 1, 'PTR': 1, 'RSQBR': 1}
+_lexreflags   = 0
+_lexliterals  = ''
+_lexstateinfo = {'INITIAL': 'inclusive'}
+_lexstatere   = {'INITIAL': [('(?P<t_NEWLINE>\\n+)|(?P<t_ID>[a-zA-Z][a-zA-Z0-9]*)|(?P<t_HEXNUM>[0-9]+[0-9a-fA-F]*h)|(?P<t_NUM>[0-9]+)|(?P<t_RSQBR>\\])|(?P<t_PLUS>\\+)|(?P<t_LSQBR>\\[)|(?P<t_TIMES>\\*)|(?P<t_COLON>:)|(?P<t_COMMA>,)|(?P<t_ignore_SEMI>;)', [None, ('t_NEWLINE', 'NEWLINE'), ('t_ID', 'ID'), ('t_HEXNUM', 'HEXNUM'), ('t_NUM', 'NUM'), (None, 'RSQBR'), (None, 'PLUS'), (None, 'LSQBR'), (None, 'TIMES'), (None, 'COLON'), (None, 'COMMA'), (None, None)])]}
+_lexstateignore = {'INITIAL': ' \t'}
+_lexstateerrorf = {'INITIAL': 't_error'}
@@ -24,58 +24,21 @@ def little_endian_bytes(imm,n):
 modrm_16 = [(Bx,Si),(Bx,Di),(Bp,Si),(Bp,Di),(Si,None),(Di,None),(Bp,None),(Bx,None)]
 
 class ModRM16(object):
-	"""Describes a ModRM/16 object."""
-
-	def init(self,mask,mod=None,ggg=None,rm=None,disp=None,dispsize=0):
-		self._mod      = GuardedInteger(mod,3)
-		self._ggg      = GuardedInteger(ggg,7)
-		self._rm       = GuardedInteger(rm ,7)
-		self._disp     = GuardedInteger(disp,mask)
-		self._dispsize = dispsize
-	
-	def __init__(self,mod=None,ggg=None,rm=None,disp=None,dispsize=0):
-		self.init(0xFFFF,mod,ggg,rm,disp,dispsize)
-	
-	@property
-	def MOD(self): 
-		"""The ModRM's top 2 bits."""
-		return self._mod.value
-	@MOD.setter
-	def MOD(self,val):
-		self._mod.value = val
+	"""Describes a ModRM/16 object.
 	
-	@property
-	def GGG(self): 
-		"""The ModRM's middle 3 bits."""
-		return self._ggg.value
-	@GGG.setter
-	def GGG(self,val):
-		self._ggg.value = val
-
-	@property
-	def RM(self): 
-		"""The ModRM's low 3 bits."""
-		return self._rm.value
-	@RM.setter
-	def RM(self,val):
-		self._rm.value = val
+	:ivar integer MOD: The ModRM's top 2 bits.
+	:ivar integer GGG: The ModRM's middle 3 bits.
+	:ivar integer RM: The ModRM's low 3 bits.
+	:ivar integer Disp: The ModRM memory expression's displacement, or ``None``.
+	:ivar integer DispSize: The ModRM memory expression's displacement size in 
+		bytes (0, 1, or 2 for :class:`ModRM16`; 0, 1, or 4 for 
+		:class:`ModRM32`).
+	"""
+	__slots__ = ('MOD','GGG','RM','Disp','DispSize')
 
-	@property
-	def Disp(self): 
-		"""The ModRM memory expression's displacement, an integer."""
-		return self._disp.value
-	@Disp.setter
-	def Disp(self,val):
-		self._disp.value = val
-	
-	@property
-	def DispSize(self):
-		"""The ModRM memory expression's displacement size in bytes (0, 1, or 2 
-		for :class:`ModRM16`; 0, 1, or 4 for :class:`ModRM32`)."""
-		return self._dispsize
-	@DispSize.setter
-	def DispSize(self,val):
-		self._dispsize = val
+	def __init__(self,mod=None,ggg=None,rm=None,disp=None,dispsize=0):
+		self.MOD,self.GGG,self.RM = mod,ggg,rm
+		self.Disp,self.DispSize = disp,dispsize
 	
 	def Decode(self,stream):
 		"""Pull the fields of the ModR/M-16 apart, and consume a displacement if 
@@ -225,42 +188,20 @@ class ModRM16(object):
 	
 class SIBBase(object):
 	"""This class is only meaningful for 32-bit memory expressions encoded via 
-	ModRM, and only if a SIB (Scale-Index-Base) byte is required."""
-	def init(self,ss=None,idx=None,base=None,disp=None):
-		self._ss   = GuardedInteger(ss  ,3)
-		self._idx  = GuardedInteger(idx ,7)
-		self._base = GuardedInteger(base,7)
+	ModRM, and only if a SIB (Scale-Index-Base) byte is required.
 	
-	def __init__(self,ss_=None,idx_=None,base_=None):
-		self.init(ss_,idx_,base_)
-
-	@property
-	def SCALE(self): 
-		"""The top two bits of a SIB are the scale factor.
+	:ivar integer SCALE: The top two bits of a SIB are the scale factor.
 		* 0: 1
 		* 1: 2
 		* 2: 4
-		* 3: 8"""
-		return self._ss.value
-	@SCALE.setter
-	def SCALE(self,val):
-		self._ss.value = val
-	
-	@property
-	def INDEX(self): 
-		"""The middle three bits of a SIB are the index register."""
-		return self._idx.value
-	@INDEX.setter
-	def INDEX(self,val):
-		self._idx.value = val
+		* 3: 8
+	:ivar integer INDEX: The middle three bits of a SIB are the index register.
+	:ivar integer BASE: The low three bits of a SIB are the base register.
+	"""
+	__slots__ = ('SCALE','INDEX','BASE')
 
-	@property
-	def BASE(self): 
-		"""The middle three bits of a SIB are the base register."""
-		return self._base.value
-	@BASE.setter
-	def BASE(self,val):
-		self._base.value = val
+	def __init__(self,ss_=None,idx_=None,base_=None):
+		self.SCALE,self.INDEX,self.BASE = ss_,idx_,base_
 
 	def Encode(self):
 		"""Concatenate the fields :attr:`SCALE`, :attr:`INDEX`, and :attr:`BASE` 
@@ -272,8 +213,10 @@ class SIBBase(object):
 		return [self.SCALE << 6 | self.INDEX << 3 | self.BASE]
 
 class ModRM32(ModRM16):
+	__slots__ = ('_sib',)
+
 	def __init__(self,mod=None,ggg=None,rm=None,sf=None,idx=None,base=None,disp=None,dispsize=0):
-		self.init(0xFFFFFFFF,mod,ggg,rm,disp,dispsize)
+		ModRM16.__init__(self,mod,ggg,rm,disp,dispsize)
 		
 		if (sf is not None or idx is not None or base is not None):
 			self._sib = SIBBase(sf,idx,base)
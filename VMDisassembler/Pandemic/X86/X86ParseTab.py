@@ -1,5 +1,5 @@
 
-# Pandemic/X86\xpy.py
+# X86ParseTab.py
 # This file is automatically generated. Do not edit.
 _tabversion = '3.2'
 
@@ -26,44 +26,44 @@ for _k, _v in _lr_goto_items.items():
 del _lr_goto_items
 _lr_productions = [
   ("S' -> instr","S'",1,None,None,None),
-  ('op -> Gb','op',1,'p_op_gb','Pandemic\\X86\\X86Yacc.py',60),
-  ('op -> Gw','op',1,'p_op_gw','Pandemic\\X86\\X86Yacc.py',64),
-  ('op -> Gd','op',1,'p_op_gd','Pandemic\\X86\\X86Yacc.py',68),
-  ('op -> Seg','op',1,'p_op_seg','Pandemic\\X86\\X86Yacc.py',72),
-  ('op -> CNT','op',1,'p_op_cnt','Pandemic\\X86\\X86Yacc.py',76),
-  ('op -> DBG','op',1,'p_op_dbg','Pandemic\\X86\\X86Yacc.py',80),
-  ('op -> FPU','op',1,'p_op_fpu','Pandemic\\X86\\X86Yacc.py',84),
-  ('op -> MMX','op',1,'p_op_mmx','Pandemic\\X86\\X86Yacc.py',88),
-  ('op -> XMM','op',1,'p_op_xmm','Pandemic\\X86\\X86Yacc.py',92),
-  ('meminner -> Gd PLUS Gd TIMES NUM PLUS NUM','meminner',7,'p_meminner_Gd_plus_Gd_times_num_plus_num','Pandemic\\X86\\X86Yacc.py',96),
-  ('meminner -> Gd PLUS Gd PLUS NUM','meminner',5,'p_meminner_Gd_plus_Gd_plus_num','Pandemic\\X86\\X86Yacc.py',100),
-  ('meminner -> Gd PLUS Gd TIMES NUM','meminner',5,'p_meminner_Gd_plus_Gd_times_num','Pandemic\\X86\\X86Yacc.py',104),
-  ('meminner -> Gd TIMES NUM PLUS NUM','meminner',5,'p_meminner_Gd_times_num_plus_num','Pandemic\\X86\\X86Yacc.py',108),
-  ('meminner -> Gd TIMES NUM','meminner',3,'p_meminner_Gd_times_num','Pandemic\\X86\\X86Yacc.py',112),
-  ('meminner -> Gd PLUS Gd','meminner',3,'p_meminner_Gd_plus_Gd','Pandemic\\X86\\X86Yacc.py',116),
-  ('meminner -> Gd PLUS NUM','meminner',3,'p_meminner_Gd_plus_num','Pandemic\\X86\\X86Yacc.py',120),
-  ('meminner -> Gd','meminner',1,'p_meminner_Gd','Pandemic\\X86\\X86Yacc.py',124),
-  ('meminner -> NUM','meminner',1,'p_meminner_num','Pandemic\\X86\\X86Yacc.py',128),
-  ('meminner -> Gw PLUS Gw PLUS NUM','meminner',5,'p_meminner_Gw_plus_Gw_plus_num','Pandemic\\X86\\X86Yacc.py',132),
-  ('meminner -> Gw PLUS Gw','meminner',3,'p_meminner_Gw_plus_Gw','Pandemic\\X86\\X86Yacc.py',136),
-  ('meminner -> Gw PLUS NUM','meminner',3,'p_meminner_Gw_plus_num','Pandemic\\X86\\X86Yacc.py',140),
-  ('meminner -> Gw','meminner',1,'p_meminner_Gw','Pandemic\\X86\\X86Yacc.py',144),
-  ('memexpr -> SIZE PTR LSQBR meminner RSQBR','memexpr',5,'p_memexpr_size_meminner','Pandemic\\X86\\X86Yacc.py',148),
-  ('memexpr -> SIZE PTR Seg COLON LSQBR meminner RSQBR','memexpr',7,'p_memexpr_size_seg_meminner','Pandemic\\X86\\X86Yacc.py',154),
-  ('memexpr -> Seg COLON LSQBR meminner RSQBR','memexpr',5,'p_memexpr_seg_meminner','Pandemic\\X86\\X86Yacc.py',161),
-  ('memexpr -> LSQBR meminner RSQBR','memexpr',3,'p_memexpr_meminner','Pandemic\\X86\\X86Yacc.py',167),
-  ('op -> memexpr','op',1,'p_op_memexpr','Pandemic\\X86\\X86Yacc.py',172),
-  ('op -> NUM COLON NUM','op',3,'p_op_ap32','Pandemic\\X86\\X86Yacc.py',176),
-  ('op -> NUM','op',1,'p_op_imm','Pandemic\\X86\\X86Yacc.py',180),
-  ('pfxlist -> PFX','pfxlist',1,'p_pfxlist_pfx','Pandemic\\X86\\X86Yacc.py',184),
-  ('pfxlist -> pfxlist PFX','pfxlist',2,'p_pfxlist_pfxlist_pfx','Pandemic\\X86\\X86Yacc.py',188),
-  ('pseudo -> pfxlist Mnem op COMMA op COMMA op','pseudo',7,'p_pfxlist_pseudo3','Pandemic\\X86\\X86Yacc.py',193),
-  ('pseudo -> pfxlist Mnem op COMMA op','pseudo',5,'p_pfxlist_pseudo2','Pandemic\\X86\\X86Yacc.py',197),
-  ('pseudo -> pfxlist Mnem op','pseudo',3,'p_pfxlist_pseudo1','Pandemic\\X86\\X86Yacc.py',201),
-  ('pseudo -> pfxlist Mnem','pseudo',2,'p_pfxlist_pseudo','Pandemic\\X86\\X86Yacc.py',205),
-  ('pseudo -> Mnem op COMMA op COMMA op','pseudo',6,'p_pseudo3','Pandemic\\X86\\X86Yacc.py',209),
-  ('pseudo -> Mnem op COMMA op','pseudo',4,'p_pseudo2','Pandemic\\X86\\X86Yacc.py',213),
-  ('pseudo -> Mnem op','pseudo',2,'p_pseudo1','Pandemic\\X86\\X86Yacc.py',217),
-  ('pseudo -> Mnem','pseudo',1,'p_pseudo','Pandemic\\X86\\X86Yacc.py',221),
-  ('instr -> pseudo','instr',1,'p_instr_pseudo','Pandemic\\X86\\X86Yacc.py',225),
+  ('op -> Gb','op',1,'p_op_gb','X86Yacc.py',56),
+  ('op -> Gw','op',1,'p_op_gw','X86Yacc.py',60),
+  ('op -> Gd','op',1,'p_op_gd','X86Yacc.py',64),
+  ('op -> Seg','op',1,'p_op_seg','X86Yacc.py',68),
+  ('op -> CNT','op',1,'p_op_cnt','X86Yacc.py',72),
+  ('op -> DBG','op',1,'p_op_dbg','X86Yacc.py',76),
+  ('op -> FPU','op',1,'p_op_fpu','X86Yacc.py',80),
+  ('op -> MMX','op',1,'p_op_mmx','X86Yacc.py',84),
+  ('op -> XMM','op',1,'p_op_xmm','X86Yacc.py',88),
+  ('meminner -> Gd PLUS Gd TIMES NUM PLUS NUM','meminner',7,'p_meminner_Gd_plus_Gd_times_num_plus_num','X86Yacc.py',92),
+  ('meminner -> Gd PLUS Gd PLUS NUM','meminner',5,'p_meminner_Gd_plus_Gd_plus_num','X86Yacc.py',96),
+  ('meminner -> Gd PLUS Gd TIMES NUM','meminner',5,'p_meminner_Gd_plus_Gd_times_num','X86Yacc.py',100),
+  ('meminner -> Gd TIMES NUM PLUS NUM','meminner',5,'p_meminner_Gd_times_num_plus_num','X86Yacc.py',104),
+  ('meminner -> Gd TIMES NUM','meminner',3,'p_meminner_Gd_times_num','X86Yacc.py',108),
+  ('meminner -> Gd PLUS Gd','meminner',3,'p_meminner_Gd_plus_Gd','X86Yacc.py',112),
+  ('meminner -> Gd PLUS NUM','meminner',3,'p_meminner_Gd_plus_num','X86Yacc.py',116),
+  ('meminner -> Gd','meminner',1,'p_meminner_Gd','X86Yacc.py',120),
+  ('meminner -> NUM','meminner',1,'p_meminner_num','X86Yacc.py',124),
+  ('meminner -> Gw PLUS Gw PLUS NUM','meminner',5,'p_meminner_Gw_plus_Gw_plus_num','X86Yacc.py',128),
+  ('meminner -> Gw PLUS Gw','meminner',3,'p_meminner_Gw_plus_Gw','X86Yacc.py',132),
+  ('meminner -> Gw PLUS NUM','meminner',3,'p_meminner_Gw_plus_num','X86Yacc.py',136),
+  ('meminner -> Gw','meminner',1,'p_meminner_Gw','X86Yacc.py',140),
+  ('memexpr -> SIZE PTR LSQBR meminner RSQBR','memexpr',5,'p_memexpr_size_meminner','X86Yacc.py',144),
+  ('memexpr -> SIZE PTR Seg COLON LSQBR meminner RSQBR','memexpr',7,'p_memexpr_size_seg_meminner','X86Yacc.py',148),
+  ('memexpr -> Seg COLON LSQBR meminner RSQBR','memexpr',5,'p_memexpr_seg_meminner','X86Yacc.py',152),
+  ('memexpr -> LSQBR meminner RSQBR','memexpr',3,'p_memexpr_meminner','X86Yacc.py',156),
+  ('op -> memexpr','op',1,'p_op_memexpr','X86Yacc.py',160),
+  ('op -> NUM COLON NUM','op',3,'p_op_ap32','X86Yacc.py',164),
+  ('op -> NUM','op',1,'p_op_imm','X86Yacc.py',168),
+  ('pfxlist -> PFX','pfxlist',1,'p_pfxlist_pfx','X86Yacc.py',172),
+  ('pfxlist -> pfxlist PFX','pfxlist',2,'p_pfxlist_pfxlist_pfx','X86Yacc.py',176),
+  ('pseudo -> pfxlist Mnem op COMMA op COMMA op','pseudo',7,'p_pfxlist_pseudo3','X86Yacc.py',181),
+  ('pseudo -> pfxlist Mnem op COMMA op','pseudo',5,'p_pfxlist_pseudo2','X86Yacc.py',185),
+  ('pseudo -> pfxlist Mnem op','pseudo',3,'p_pfxlist_pseudo1','X86Yacc.py',189),
+  ('pseudo -> pfxlist Mnem','pseudo',2,'p_pfxlist_pseudo','X86Yacc.py',193),
+  ('pseudo -> Mnem op COMMA op COMMA op','pseudo',6,'p_pseudo3','X86Yacc.py',197),
+  ('pseudo -> Mnem op COMMA op','pseudo',4,'p_pseudo2','X86Yacc.py',201),
+  ('pseudo -> Mnem op','pseudo',2,'p_pseudo1','X86Yacc.py',205),
+  ('pseudo -> Mnem','pseudo',1,'p_pseudo','X86Yacc.py',209),
+  ('instr -> pseudo','instr',1,'p_instr_pseudo','X86Yacc.py',213),
 ]
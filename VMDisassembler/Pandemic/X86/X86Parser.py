@@ -1,3 +1,81 @@
-import X86Yacc
+"""The X86 assembly-language parser.  Use it as ``parser.Parse(text)``, which
+returns an :class:`~.X86.Instruction`.
 
-parser = X86Yacc.X86Yacc(tabmodule="xpy",outputdir="Pandemic/X86")
\ No newline at end of file
+Importing this module is cheap:  :data:`parser` builds the underlying
+:class:`~.X86Yacc.X86Yacc` object, and imports the modules that it requires,
+the first time it is used.  Building it does not run PLY's grammar
+construction or validation either; the LALR tables and the lexer tables are
+precomputed in the generated modules :mod:`X86ParseTab` and :mod:`X86LexTab`.
+After changing the grammar in :mod:`X86Yacc` or the tokens in :mod:`X86Lex`,
+regenerate them by running ``bin/X86Programs/X86BuildParserTables.py``.
+"""
+
+import os
+
+#: The directory holding the generated table modules.
+tabdir = os.path.dirname(os.path.abspath(__file__))
+
+def LoadParser():
+	"""Build an :class:`~.X86Yacc.X86Yacc` object from the precomputed tables.
+	If the LALR tables do not match the grammar, or have not been generated,
+	PLY rebuilds them in memory instead (slowly).
+
+	:rtype: :class:`~.X86Yacc.X86Yacc`
+	"""
+	import X86Yacc
+	try:
+		import X86ParseTab, X86LexTab
+	except ImportError:
+		return X86Yacc.X86Yacc(write_tables=0,debug=0)
+	return X86Yacc.X86Yacc(lexkw=dict(optimize=1,lextab=X86LexTab),tabmodule=X86ParseTab,write_tables=0,debug=0)
+
+def BuildTables(outputdir=tabdir):
+	"""Regenerate the table modules :mod:`X86ParseTab` and :mod:`X86LexTab` in
+	*outputdir*.
+
+	:param string outputdir: the directory in which to write the modules
+	"""
+	import X86Yacc
+	for name in ("X86ParseTab","X86LexTab"):
+		for ext in (".py",".pyc"):
+			path = os.path.join(outputdir,name+ext)
+			if os.path.exists(path):
+				os.remove(path)
+	p = X86Yacc.X86Yacc(lexkw=dict(optimize=1,lextab="X86LexTab",outputdir=outputdir),tabmodule="X86ParseTab",outputdir=outputdir,debug=0)
+
+	# PLY records where it wrote the LALR tables, and where each rule was
+	# defined.  Keep those paths relative, so that the output does not depend
+	# upon the machine that generated it.
+	path = os.path.join(outputdir,"X86ParseTab.py")
+	with open(path) as f:
+		text = f.read()
+	text = text.replace("# %s\n" % path,"# X86ParseTab.py\n",1)
+	srcfile = X86Yacc.X86Yacc.p_error.im_func.func_code.co_filename
+	text = text.replace(repr(srcfile),repr(os.path.basename(srcfile)))
+	with open(path,"w") as f:
+		f.write(text)
+
+class X86LazyParser(object):
+	"""Stands in for an :class:`~.X86Yacc.X86Yacc` object, building it upon
+	first use."""
+	def __init__(self):
+		self.parser = None
+
+	def Get(self):
+		"""Return the :class:`~.X86Yacc.X86Yacc` object, building it if need be.
+
+		:rtype: :class:`~.X86Yacc.X86Yacc`
+		"""
+		if self.parser is None:
+			self.parser = LoadParser()
+		return self.parser
+
+	def Parse(self,text):
+		"""Parse one instruction.
+
+		:param string text: the instruction, e.g. ``"mov eax, [ebx+4]"``
+		:rtype: :class:`~.X86.Instruction`
+		"""
+		return self.Get().Parse(text)
+
+parser = X86LazyParser()
@@ -6,7 +6,7 @@ should be encoded).  It supports three interfaces:
 	
 * :meth:`.check`, to check a single :class:`~.Operand` against a single :class:`~.AOTElt`;
 * :meth:`.TypeCheckInstruction_exn`, to check an instruction against a list of :class:`~.AOTElt` types and raise a :class:`X86TypeCheckError` on failure;
-* :meth:`.TypeCheckInstruction_opt`, to check an instruction against a list of :class:`~.AOTElt` types and return ``None`` on failure.
+* :meth:`.TypeCheckInstruction_opt`, to check an instruction against a list of :class:`~.AOTElt` types and return ``None`` on failure, without raising exceptions.
 """
 
 from X86 import *
@@ -76,6 +76,63 @@ def MATCHES():
 	"""Return an empty :class:`.TypeCheckInfo` object."""
 	return TypeCheckInfo()
 
+def reduce_typeinfo(t1,t2):
+	"""Given two :class:`.TypeCheckInfo` objects, ensure that their override
+	requirements do not conflict.  "Accumulate" the override information in 
+	*t1*.  I.e., if the first operand specified an address size override, and
+	the second operand specified an operand size override, we need to have both
+	of those facts available when checking the third operand.
+	
+	:param `.TypeCheckInfo` t1: accumulated information, updated in place
+	:param `.TypeCheckInfo` t2: information for the next operand
+	:rtype: ( `.TypeCheckInfo`, string ) tuple
+	:returns: *t1* and ``None``, or ``None`` and a description of the conflict.
+	"""
+	def opcheck(bo1,bo2):
+		if bo1 is None: return bo2,True
+		if bo2 is None: return bo1,True
+		return bo1,bo1 == bo2
+
+	# If both sizes can be overriden, they must either both be overridden, 
+	# or both not be overridden.  Same for address sizes.
+	t1.sizeo,ok = opcheck(t1.sizeo,t2.sizeo)
+	if not ok: return None,"Size mismatch!"
+	t1.addro,ok = opcheck(t1.addro,t2.addro)
+	if not ok: return None,"Address size mismatch!"
+
+	# For segments, if multiple segment overrides are present, ensure the
+	# overrides match.
+	t1.sego,ok  = opcheck(t1.sego,t2.sego)
+	if not ok: return None,"Segments clash!"
+	return t1,None
+
+def operand_classes(aotdl):
+	"""Return a tuple of :class:`.Operand` classes, such that an operand that is
+	not an instance of one of them certainly does not match *aotdl*.  Used to
+	reject encodings cheaply, before visiting the operands.
+	
+	:param `.X86AOTDL` aotdl:
+	:rtype: tuple of classes
+	"""
+	if isinstance(aotdl,(Exact,ExactSeg)): return (type(aotdl.value),)
+	if isinstance(aotdl,GPart):            return (type(aotdl.archetype),)
+	if isinstance(aotdl,RegOrMem):
+		regs = (type(aotdl.reg),) if aotdl.reg is not None else ()
+		mems = (MemExpr,)         if aotdl.mem is not None else ()
+		return regs + mems
+	if isinstance(aotdl,(ImmEnc,SignedImm)):
+		a = aotdl.archetype
+		if isinstance(a,MemExpr):   return (MemExpr,)
+		if isinstance(a,JccTarget): return (JccTarget,)
+		return (type(a),)
+	if isinstance(aotdl,(SizePrefix,AddrPrefix)):
+		return operand_classes(aotdl.yes) + operand_classes(aotdl.no)
+	return (object,)
+
+#: For each abstract operand type (by integer value), the result of
+#: :func:`operand_classes` for its AOTDL.
+AOTtoOperandClasses = [ (object,) if d is None else operand_classes(d) for d in AOTtoAOTDL ]
+
 class X86TypeChecker(Visitor2):
 	"""This :class:`~.Visitor.Visitor2` class implements type-checking for X86
 	instructions.
@@ -103,8 +160,8 @@ class X86TypeChecker(Visitor2):
 		"""Checks the instruction's operands against a list of abstract
 		operand types.  This particular variant of the function will throw an 
 		exception with information as to why the instruction was not accepted.
-		Another method, :meth:`TypeCheckInstruction_opt`, catches exceptions and 
-		returns ``None`` if one was raised.
+		Another method, :meth:`TypeCheckInstruction_opt`, performs the same checks
+		and returns ``None`` on failure.
 		
 		:param `.X86.Instruction` instr: instruction to type-check
 		:param aops: list of abstract operand types to check against
@@ -122,31 +179,6 @@ class X86TypeChecker(Visitor2):
 		if len(aops) == 0:
 			return (False,False,None)
 
-		# Given two TypeCheckInfo objects, ensure that their override requirements
-		# do not conflict.  Return whether the prefix is required, or None.
-		def reduce_typeinfo(t1,t2):
-			def opcheck(bo1,bo2,errorstr):
-				if bo1 is None: return bo2
-				if bo2 is None: return bo1
-				if bo1 == bo2:  return bo1
-				raise X86TypeCheckError(errorstr)
-			
-			# "Accumulate" the override information in t1.  I.e., if the first 
-			# operand specified an address size override, and the second operand
-			# specified an operand size override, we need to have both of those
-			# facts available when checking the third operand.  Update the t1 
-			# structure and return it.
-
-			# If both sizes can be overriden, they must either both be overridden, 
-			# or both not be overridden.  Same for address sizes.
-			t1.sizeo = opcheck(t1.sizeo,t2.sizeo,"Size mismatch!")
-			t1.addro = opcheck(t1.addro,t2.addro,"Address size mismatch!")
-		
-			# For segments, if multiple segment overrides are present, ensure the
-			# overrides match.
-			t1.sego  = opcheck(t1.sego,t2.sego,"Segments clash!")
-			return t1
-
 		# Begin with a non-existent TypeCheckInfo last_ti.
 		last_ti = None
 		
@@ -156,24 +188,57 @@ class X86TypeChecker(Visitor2):
 			# Visit the operand and turn it into a TypeCheckInfo object.
 			ti = self.check(aops[i],instr.GetOp(i))
 			if ti is None: raise X86TypeCheckError("Operand does not match!")
-			last_ti = ti if last_ti is None else reduce_typeinfo(last_ti,ti)
+			if last_ti is None:
+				last_ti = ti
+			else:
+				last_ti,error = reduce_typeinfo(last_ti,ti)
+				if last_ti is None: raise X86TypeCheckError(error)
 
 		# Return a triple describing required overrides.
 		return (last_ti.sizeo == True,last_ti.addro == True,last_ti.sego)
 		
 	def TypeCheckInstruction_opt(self,instr,aops):
-		"""Calls :meth:`TypeCheckInstruction_exn`.  If it throws an exception,
-		return `None`.
+		"""Performs the same checks as :meth:`TypeCheckInstruction_exn`, but 
+		returns ``None`` on failure rather than raising an exception.  Since the
+		encoder rejects most of the encodings that it tries, this variant also 
+		rejects operands of the wrong classes (see :func:`operand_classes`) 
+		before visiting any of them.
 		
 		:param `.X86.Instruction` instr: instruction to type-check
 		:param aops: list of abstract operand types to check against
 		:type aops: :class:`.AOTElt` list
-		:rtype: ( `bool` , `bool`, `.SegElt` ) tuple
+		:rtype: ( `bool` , `bool`, `.SegElt` ) tuple, or ``None``
 		"""
-		retval = None
-		try: retval = self.TypeCheckInstruction_exn(instr,aops)
-		except X86TypeCheckError, e: pass
-		return retval
+		# If the number of operands differs, the encoding cannot be valid.
+		n = len(aops)
+		if n != instr.NumOps():
+			return None
+
+		# If there are no operands, there can be no overrides.
+		if n == 0:
+			return (False,False,None)
+
+		# Reject operands of the wrong classes.
+		ops = (instr.op1,instr.op2,instr.op3)
+		aopvals = [ aop.IntValue() for aop in aops ]
+		for i in xrange(n):
+			if not isinstance(ops[i],AOTtoOperandClasses[aopvals[i]]):
+				return None
+
+		# Visit the operands, and make sure that the TypeCheckInfo objects are
+		# mutually coherent.
+		last_ti = None
+		for i in xrange(n):
+			ti = self.check(aops[i],ops[i])
+			if ti is None: return None
+			if last_ti is None:
+				last_ti = ti
+			else:
+				last_ti,error = reduce_typeinfo(last_ti,ti)
+				if last_ti is None: return None
+
+		# Return a triple describing required overrides.
+		return (last_ti.sizeo == True,last_ti.addro == True,last_ti.sego)
 
 	def MakeMethodName(s,op1,enc):
 		"""We override this method from the :class:`~.Visitor.Visitor` class to
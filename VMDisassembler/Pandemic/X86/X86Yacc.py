@@ -8,13 +8,13 @@ import itertools
 import ply.yacc as yacc
 
 class X86UnknownSizeImmediate(X86.Id):
-	pass
+	__slots__ = ()
 
 class X86UnknownSizeMem16(X86.Mem16):
-	pass
+	__slots__ = ()
 
 class X86UnknownSizeMem32(X86.Mem32):
-	pass
+	__slots__ = ()
 
 memsizes = [XM.Mb,XM.Mw,XM.Md,XM.Mf,XM.Mq,XM.Mt,XM.Mdq]
 
@@ -22,36 +22,37 @@ class X86Pseudo(object):
 	def __init__(self,pf=None,mnem=None,op1=None,op2=None,op3=None):
 		self.pf,self.mnem,self.op1,self.op2,self.op3 = pf,mnem,op1,op2,op3
 
+	def __str__(self):
+		pfx = "" if not self.pf else " ".join(map(str,self.pf))+" "
+		opstr = ", ".join(str(op) for op in (self.op1,self.op2,self.op3) if op is not None)
+		return ("%s%s %s" % (pfx,self.mnem,opstr)).rstrip()
+
 def validate_scale(num):
 	if not ((num & (num-1) == 0) and (num != 0) and (num <= 8)):
 		raise ValueError("Decoding memory expression:  bad scale factor %d" % num)
 	return 3 if num==8 else 2 if num==4 else 1 if num==2 else 0
 
-def validate_meminner(mi,unk=False):
-	me = mi
+def validate_meminner(mi,unk=False,size=XM.Mb,seg=None):
+	"""Build the memory expression of size *size* described by *mi*, in the 
+	segment *seg* (by default, the default segment for its registers)."""
 	if isinstance(mi,X86.Mem16):
 		m = X86ModRM.ModRM16()
 		try:
 			m.EncodeFromParts(mi.BaseReg,mi.IndexReg,mi.Disp)
 			br,ir,disp,_ = m.Interpret()
-			if unk:
-				me = X86UnknownSizeMem16(XM.CS,XM.Mb,br,ir,disp)
-			else:
-				me = X86.Mem16(XM.CS,XM.Mb,br,ir,disp)
+			cls = X86UnknownSizeMem16 if unk else X86.Mem16
+			me = cls(XM.CS,size,br,ir,disp)
 		except IndexError, e:
 			raise ValueError("%s:  invalid ModRM/16 expression" % mi)
 	elif isinstance(mi,X86.Mem32):
 		m = X86ModRM.ModRM32()
 		m.EncodeFromParts(mi.BaseReg,mi.IndexReg,mi.ScaleFac,mi.Disp)
 		br,ir,sf,disp,_ = m.Interpret()
-		if unk:
-			me = X86UnknownSizeMem32(XM.CS,XM.Mb,br,ir,sf,disp)
-		else:
-			me = X86.Mem32(XM.CS,XM.Mb,br,ir,sf,disp)
+		cls = X86UnknownSizeMem32 if unk else X86.Mem32
+		me = cls(XM.CS,size,br,ir,sf,disp)
 	else:
 		raise ValueError("WTF is this memory expression %s" % mi)
-	me.Seg = me.DefaultSeg()
-	return me
+	return me(me.DefaultSeg() if seg is None else seg)
 
 class X86Yacc(object):
 	start = 'instr'
@@ -146,27 +147,19 @@ class X86Yacc(object):
 
 	def p_memexpr_size_meminner(self,p):
 		'memexpr : SIZE PTR LSQBR meminner RSQBR'
-		mi = validate_meminner(p[4])
-		mi.size = p[1]
-		p[0] = mi
+		p[0] = validate_meminner(p[4],size=p[1])
 	
 	def p_memexpr_size_seg_meminner(self,p):
 		'memexpr : SIZE PTR Seg COLON LSQBR meminner RSQBR'
-		mi = validate_meminner(p[6])
-		mi.size = p[1]
-		mi.Seg = p[3]
-		p[0] = mi
+		p[0] = validate_meminner(p[6],size=p[1],seg=p[3])
 
 	def p_memexpr_seg_meminner(self,p):
 		'memexpr : Seg COLON LSQBR meminner RSQBR'
-		mi = validate_meminner(p[4],True)
-		mi.Seg = p[1]
-		p[0] = mi
+		p[0] = validate_meminner(p[4],True,seg=p[1])
 
 	def p_memexpr_meminner(self,p):
 		'memexpr : LSQBR meminner RSQBR'
-		mi = validate_meminner(p[2],True)
-		p[0] = mi
+		p[0] = validate_meminner(p[2],True)
 
 	def p_op_memexpr(self,p):
 		'op : memexpr'
@@ -233,6 +226,10 @@ class X86Yacc(object):
 					l.append(X86.Ib(v))
 				if v <= 0xFFFF or (v <= 0x7F or v >= 0xFFFF8000) or (v <= 0x7F or (v >= 0xFF80 and v <= 0xFFFF)):
 					l.append(X86.Iw(v))
+				# A number may also be the destination of a relative branch.  The
+				# parser can't know the address of the next instruction; see 
+				# X86Assembler for code that fills it in.
+				l.append(X86.JccTarget(v,0))
 				return l
 			elif isinstance(op,X86UnknownSizeMem16):
 				return map(lambda s: X86.Mem16(op.Seg,s,op.BaseReg,op.IndexReg,op.Disp),memsizes)
@@ -244,7 +241,7 @@ class X86Yacc(object):
 		tc = X86TypeChecker.X86TypeChecker()
 		for t in g:
 			i = X86.Instruction(pseudo.pf,pseudo.mnem,*t)
-			for enc in X86EncodeTable.mnem_to_encodings[i.mnem.IntValue()]:
+			for enc in X86EncodeTable.mnem_to_encodings[i.mnem.IntValue()] or []:
 				# See if the encoding matches, i.e. if the operands type-check.
 				val = tc.TypeCheckInstruction_opt(i,enc.ops)
 				if val == None: 
@@ -258,14 +255,15 @@ class X86Yacc(object):
 			raise SyntaxError("at end of file")
 		raise SyntaxError("at token %s" % p)
 
- 	def Init(self,**kwargs):
-		self.lexer = X86Lex.X86Lexer()
+	def Init(self,lexkw=None,**kwargs):
+		self.lexer = X86Lex.X86Lexer(**(lexkw or {}))
 		self.tokens = self.lexer.tokens
 		self.parser = yacc.yacc(module=self, **kwargs)
- 	
- 	def Parse(self,text):
- 		return self.parser.parse(text,lexer=self.lexer.lexer)
- 	
- 	# Build the parser
-	def __init__(self,**kwargs):                      
-		self.Init(**kwargs)
+	
+	def Parse(self,text):
+		return self.parser.parse(text,lexer=self.lexer.lexer)
+	
+	# Build the parser.  The keyword arguments in *lexkw* are passed to 
+	# ply.lex.lex(), and the remainder to ply.yacc.yacc().
+	def __init__(self,lexkw=None,**kwargs):
+		self.Init(lexkw,**kwargs)
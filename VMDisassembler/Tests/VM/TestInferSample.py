@@ -0,0 +1,51 @@
+from Tests.VM.VMSamples import *
+from FinSpyVM import *
+from InferSample import InferSampleContext, ChecksPass
+from VMProgram import VMProgram
+from Simplify import Simplify
+import os
+import random
+import unittest
+
+class TestInferSample(unittest.TestCase):
+	# Write a copy of the sample with a new XOR key and its VM opcodes
+	# permuted, and infer its context with the sample as the reference.
+	def setUp(self):
+		r = random.Random(25)
+		self.xorVals = [ r.randrange(0x100) for i in xrange(4) ]
+		opcodes = sorted(INSN_NAME_DICT)
+		self.renumber = dict(zip(opcodes, r.sample(xrange(0x100), len(opcodes))))
+		self.path = WriteRenumberedSample(self.xorVals, self.renumber)
+		self.ctx,self.checks,self.report = InferSampleContext(self.path, SAMPLE_FILENAME)
+
+	def tearDown(self):
+		os.remove(self.path)
+
+	def test00_XorKey(self):
+		self.assertEqual(list(self.ctx.XorVals), self.xorVals)
+		self.assertTrue(ChecksPass(self.checks))
+
+	# Every opcode in the sample is mapped. Those that are mapped to the
+	# wrong INSN_* constant are reported as ambiguous with the right one.
+	def test01_OpcodeMap(self):
+		original = { new:opc for opc,new in self.renumber.iteritems() }
+		sampleOpcodes = set(self.renumber[opc] for opc in self.SampleOpcodes())
+		self.assertEqual(set(self.ctx.OpcodeMap), sampleOpcodes)
+		for opc,share,insn,dist,ambiguous in self.report:
+			self.assertEqual(self.ctx.OpcodeMap[opc], insn)
+			if insn != original[opc]:
+				self.assertIn(original[opc], ambiguous)
+		self.assertEqual(len(set(self.ctx.OpcodeMap.values())), len(self.ctx.OpcodeMap))
+
+	# The inferred context is enough to simplify the sample.
+	def test02_Simplify(self):
+		insns = Simplify(VMProgram.FromFile(self.path, self.ctx), self.ctx)
+		refCtx = VMSampleContext()
+		refInsns = Simplify(VMProgram.FromFile(SAMPLE_FILENAME, refCtx), refCtx)
+		self.assertEqual(len(insns), len(refInsns))
+		self.assertEqual(self.ctx.FixedUpDwords, refCtx.FixedUpDwords)
+
+	# The VM opcodes that occur in the sample
+	def SampleOpcodes(self):
+		image = LoadVMImage(SAMPLE_FILENAME, DEFAULT_CONTEXT.XorVals)
+		return set(image[4::INSN_DESC_SIZE])
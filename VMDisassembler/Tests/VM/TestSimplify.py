@@ -0,0 +1,26 @@
+from Tests.VM.VMSamples import *
+from FinSpyVM import *
+from VMProgram import VMProgram
+from Simplify import Simplify
+import os
+import unittest
+
+# Summarize simplified VM instructions for comparison.
+def Summarize(insns):
+	return [ (insn.__class__.__name__, insn.Opcode, str(insn)) for insn in insns ]
+
+class TestSimplify(unittest.TestCase):
+	# Simplifying a sample whose VM opcodes are numbered differently gives the
+	# same instructions, as long as its context maps them back.
+	def test00_RenumberedOpcodes(self):
+		renumber = { opc:opc+0x40 for opc in INSN_NAME_DICT }
+		path = WriteRenumberedSample(DEFAULT_CONTEXT.XorVals, renumber)
+		try:
+			ctx = VMSampleContext(opcodeMap={ new:opc for opc,new in renumber.iteritems() })
+			insns = Simplify(VMProgram.FromFile(path, ctx), ctx)
+		finally:
+			os.remove(path)
+		refCtx = VMSampleContext()
+		refInsns = Simplify(VMProgram.FromFile(SAMPLE_FILENAME, refCtx), refCtx)
+		self.assertEqual(Summarize(insns), Summarize(refInsns))
+		self.assertEqual(ctx.FixedUpDwords, refCtx.FixedUpDwords)
@@ -0,0 +1,27 @@
+# Helpers for the tests of the FinSpy VM tools in Tmp/, which import one
+# another as top-level modules, so Tmp/ itself has to be on the path.
+import os
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TMP_DIR = os.path.join(ROOT_DIR, "Tmp")
+if TMP_DIR not in sys.path:
+	sys.path.insert(0, TMP_DIR)
+
+from FinSpyVM import *
+
+# The VM program of the sample
+SAMPLE_FILENAME = os.path.join(TMP_DIR, "dec.bin")
+
+# Write a copy of the sample's VM program, encrypted with the XOR key
+# xorVals, and with each of its VM opcodes opc renumbered to renumber[opc],
+# to a temporary file. Returns the name of the file; the caller deletes it.
+def WriteRenumberedSample(xorVals, renumber):
+	image = LoadVMImage(SAMPLE_FILENAME, DEFAULT_CONTEXT.XorVals)
+	for pos in xrange(0, len(image), INSN_DESC_SIZE):
+		image[pos+4] = renumber[image[pos+4]]
+	fd,path = tempfile.mkstemp(suffix=".bin")
+	with os.fdopen(fd, "wb") as f:
+		f.write(DecryptImage(image, xorVals))
+	return path
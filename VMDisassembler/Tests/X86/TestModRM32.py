@@ -1,6 +1,6 @@
 from Pandemic.X86.X86MetaData import R32Elt
 from Pandemic.X86.X86ModRM import ModRM32
-from Pandemic.X86.X86ByteStream import StreamObj
+from Pandemic.X86.X86ByteStream import StreamObj, BufferStreamObj
 from X86Random import rnd_reg32,rnd_bool,rnd_reg32_noesp, rnd_scale
 import random
 import unittest
@@ -73,6 +73,11 @@ class TestModRM32(unittest.TestCase):
 		dm.Decode(StreamObj(bytes))
 		db,dsr,dsf,dd,_ = dm.Interpret()
 
+		# Decoding from a buffer should give the same result.
+		bm = ModRM32()
+		bm.Decode(BufferStreamObj(bytearray(bytes)))
+		self.assertEqual(bm.Interpret(),dm.Interpret(),"Buffer-backed stream decoded %r, list-backed stream decoded %r" % (bm.Interpret(),dm.Interpret()))
+
 
 		# Ensure that we got back something roughly equal.
 		if db is not None:
@@ -0,0 +1,67 @@
+from Pandemic.X86.X86 import *
+from Pandemic.X86.X86MetaData import *
+from Pandemic.X86.X86Assembler import X86Assembler, X86AssemblerError
+import unittest
+
+class TestX86Assembler(unittest.TestCase):
+	asm = X86Assembler()
+
+	def test00_Offsets(self):
+		bytes,linemap = self.asm.Assemble(["push ebp","","  mov ebp, esp ; frame","ret"],0x1000)
+		self.assertEqual(bytes,[0x55,0x89,0xE5,0xC3])
+		self.assertEqual([(l,a,o,n) for l,a,o,i,n in linemap],[(1,0x1000,0,1),(3,0x1001,1,2),(4,0x1003,3,1)])
+		self.assertEqual(linemap[1][3],Instruction([],Mov,Gd(Ebp),Gd(Esp)))
+
+	# Labels may be used before they are defined, and as immediates.
+	def test01_Labels(self):
+		text = "top: dec eax\njnz top\njmp done\nmov eax, done\ndone: ret"
+		bytes,linemap = self.asm.Assemble(text,0x1000)
+		self.assertEqual(bytes,[0x48,0x0F,0x85,0xF9,0xFF,0xFF,0xFF,0xE9,0x05,0x00,0x00,0x00,0xB8,0x11,0x10,0x00,0x00,0xC3])
+		self.assertEqual(linemap[1][3],Instruction([],Jnz,JccTarget(0x1000,0x1007)))
+		self.assertEqual(linemap[4][1],0x1011)
+
+	# An address at the beginning of a line moves the subsequent instructions.
+	def test02_Addresses(self):
+		bytes,linemap = self.asm.Assemble(["jmp 2000h","2000h: call 1000h","nop"],0x1000)
+		self.assertEqual(bytes,[0xE9,0xFB,0x0F,0x00,0x00,0xE8,0xFB,0xEF,0xFF,0xFF,0x90])
+		self.assertEqual([(a,o) for l,a,o,i,n in linemap],[(0x1000,0),(0x2000,5),(0x2005,10)])
+
+	def test03_Errors(self):
+		self.assertRaises(X86AssemblerError,self.asm.Assemble,["nop","jmp nowhere"])
+		self.assertRaises(X86AssemblerError,self.asm.Assemble,["a: nop","a: nop"])
+		self.assertRaises(X86AssemblerError,self.asm.Assemble,["eax: nop"])
+		try:
+			self.asm.Assemble(["nop","mov eax"])
+		except X86AssemblerError, e:
+			self.assertEqual(e.lineno,2)
+
+	# A label defined below an instruction may change that instruction's length.
+	def test04_LabelDependentLength(self):
+		bytes,linemap = self.asm.Assemble(["mov eax, [ebx+foo]","foo: nop","jmp foo"])
+		self.assertEqual(bytes,[0x8B,0x43,0x03,0x90,0xE9,0xFA,0xFF,0xFF,0xFF])
+		self.assertEqual([(a,n) for l,a,o,i,n in linemap],[(0,3),(3,1),(4,5)])
+
+	# Instructions that can't be typed are reported as written.
+	def test05_ErrorText(self):
+		try:
+			self.asm.Assemble(["nop","mov eax, bl"])
+			self.fail("mov eax, bl should not assemble")
+		except X86AssemblerError, e:
+			self.assertEqual(str(e),"line 2: mov eax, bl: mov eax, bl: bad instruction")
+
+	# Loops and jcxz/jecxz are short; a label further down may start out of 
+	# their range, before the first pass reaches it.
+	def test06_ShortBranches(self):
+		bytes,linemap = self.asm.Assemble("top: dec ecx\nloop top\njecxz done\nloopnz top\njcxz top\ndone: ret",0x1000)
+		self.assertEqual(bytes,[0x49,0xE2,0xFD,0xE3,0x05,0xE0,0xF9,0x67,0xE3,0xF6,0xC3])
+		self.assertEqual(linemap[2][3],Instruction([],Jecxz,JccTarget(0x100A,0x1005)))
+		bytes,linemap = self.asm.Assemble(["nop"]*200+["jecxz done","nop","done: ret"])
+		self.assertEqual(bytes[200:],[0xE3,0x01,0x90,0xC3])
+
+	def test07_ShortBranchOutOfRange(self):
+		for listing in (["loop 2000h"],["top: nop"]+["nop"]*130+["loop top"],["jecxz done"]+["nop"]*130+["done: ret"]):
+			try:
+				self.asm.Assemble(listing,0x1000)
+				self.fail("%s should not assemble" % listing[-1])
+			except X86AssemblerError, e:
+				self.assertTrue(str(e).endswith(": branch target out of range"),str(e))
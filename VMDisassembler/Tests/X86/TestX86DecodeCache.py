@@ -0,0 +1,58 @@
+from Pandemic.X86.X86 import *
+from Pandemic.X86.X86MetaData import *
+from Pandemic.X86.X86ByteStream import BufferStreamObj
+from Pandemic.X86.X86Decoder import X86Decoder
+from Pandemic.X86.X86DecodeCache import X86DecodeCache
+import Tests.X86.TestX86Decoder as TestX86Decoder
+import unittest
+
+# Run all of the decoder tests through the cache. Decode everything twice, so
+# that the second time is a cache hit.
+class TestX86DecodeCacheDecoder(TestX86Decoder.TestX86Decoder):
+	decoder_class = staticmethod(lambda stream: X86DecodeCache(X86Decoder(stream)))
+	def do_test(self,instr,bytes):
+		TestX86Decoder.TestX86Decoder.do_test(self,instr,bytes)
+		TestX86Decoder.TestX86Decoder.do_test(self,instr,bytes)
+
+class TestX86DecodeCache(unittest.TestCase):
+	def test00_Counters(self):
+		# push eax / push eax / push ecx / push eax
+		c = X86DecodeCache()
+		result = c.DecodeRange(bytearray([0x50,0x50,0x51,0x50]))
+		self.assertEqual([instr for ea,length,instr in result],[Instruction([],Push,Gd(Eax)),Instruction([],Push,Gd(Eax)),Instruction([],Push,Gd(Ecx)),Instruction([],Push,Gd(Eax))])
+		self.assertEqual((c.hits,c.misses,len(c)),(2,2,2))
+		self.assertIs(result[0][2],result[1][2])
+
+	# Entries are keyed on the instruction's bytes, not on what follows them.
+	def test01_Prefix(self):
+		c = X86DecodeCache()
+		c.DecodeRange(bytearray([0x33,0xC0,0x90]))
+		length,instr = c.DecodeRange(bytearray([0x33,0xC0,0xCC]),0,1)[0][1:]
+		self.assertEqual((instr,length),(Instruction([],Xor,Gd(Eax),Gd(Eax)),2))
+		self.assertEqual((c.hits,c.misses),(1,2))
+
+	# Relative targets depend upon the address.
+	def test02_JccTarget(self):
+		c = X86DecodeCache()
+		r1 = c.DecodeRange(bytearray([0xEB,0x00]),base=0x1000)
+		r2 = c.DecodeRange(bytearray([0xEB,0x00]),base=0x2000)
+		r3 = c.DecodeRange(bytearray([0xEB,0x00]),base=0x1000)
+		self.assertEqual(r1[0][2],Instruction([],Jmp,JccTarget(0x1002,0x1002)))
+		self.assertEqual(r2[0][2],Instruction([],Jmp,JccTarget(0x2002,0x2002)))
+		self.assertIs(r1[0][2],r3[0][2])
+		self.assertEqual((c.hits,c.misses),(1,2))
+
+	def test03_Eviction(self):
+		c = X86DecodeCache(maxsize=2)
+		c.DecodeRange(bytearray([0x50,0x51,0x50,0x52,0x51]))
+		self.assertEqual((c.hits,c.misses,len(c)),(1,4,2))
+
+	def test04_Frozen(self):
+		c = X86DecodeCache(X86Decoder(BufferStreamObj(bytearray([0xFF,0xE0]))))
+		instr,length = c.DecodeInstruction(0)
+		self.assertIsInstance(instr,FrozenInstruction)
+		self.assertRaises(AttributeError,setattr,instr,"mnem",Call)
+		thawed = instr.Thaw()
+		thawed.mnem = Call
+		self.assertEqual(thawed,Instruction([],Call,Gd(Eax)))
+		self.assertEqual(c.DecodeInstruction(0)[0],Instruction([],Jmp,Gd(Eax)))
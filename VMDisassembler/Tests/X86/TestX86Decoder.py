@@ -1,14 +1,20 @@
 from Pandemic.X86.X86 import *
 from Pandemic.X86.X86MetaData import *
-from Pandemic.X86.X86ByteStream import StreamObj
-from Pandemic.X86.X86Decoder import X86Decoder
+from Pandemic.X86.X86ByteStream import StreamObj, BufferStreamObj
+from Pandemic.X86.X86Decoder import X86Decoder, X86CompiledDecoder
+from Pandemic.X86.X86Encoder import X86Encoder
+from X86Random import generate_random_instruction
+import random
 import unittest
 
 class TestX86Decoder(unittest.TestCase):
 	err1 = "X86Decoder.Decode should have returned an X86DecodedInstruction object, not "
 	err2 = "X86DecodedInstruction.instr field should have been an Instruction object, not "
+	decoder_class = X86Decoder
+	def make_stream(self,bytes):
+		return StreamObj(bytes)
 	def do_test(self,instr,bytes):
-		decoder = X86Decoder(StreamObj(bytes))
+		decoder = self.decoder_class(self.make_stream(bytes))
 		i2container = decoder.Decode(0)
 		self.assertIsInstance(i2container,X86DecodedInstruction,self.err1+repr(i2container))
 		i2 = i2container.instr
@@ -89,4 +95,96 @@ class TestX86Decoder(unittest.TestCase):
 	# AddrPrefix and Immediate_MemExpr operand
 	def test16_AddrPrefix_Immediate_MemExpr(self):
 		self.do_test(Instruction([],Mov,Gb(Al),Mem16(DS,Mb,None,None,0x1234)),[0x67,0xA0,0x34,0x12])
-		self.do_test(Instruction([],Mov,Gb(Al),Mem32(DS,Mb,None,None,0,0x12345678)),[0xA0,0x78,0x56,0x34,0x12])
\ No newline at end of file
+		self.do_test(Instruction([],Mov,Gb(Al),Mem32(DS,Mb,None,None,0,0x12345678)),[0xA0,0x78,0x56,0x34,0x12])
+
+# Run all of the same tests against the compiled decoder. Decode everything 
+# twice, so that the second time goes through the compiled entries.
+class TestX86CompiledDecoder(TestX86Decoder):
+	decoder_class = X86CompiledDecoder
+	def do_test(self,instr,bytes):
+		TestX86Decoder.do_test(self,instr,bytes)
+		TestX86Decoder.do_test(self,instr,bytes)
+
+# Run all of the same tests against the buffer-backed stream, over each kind
+# of buffer that it accepts.
+class TestX86DecoderBufferStream(TestX86Decoder):
+	def make_stream(self,bytes):
+		return BufferStreamObj(self.buffer_type(bytearray(bytes)))
+	def do_test(self,instr,bytes):
+		for self.buffer_type in (bytearray,str,memoryview,buffer):
+			TestX86Decoder.do_test(self,instr,bytes)
+
+	# Instructions are limited to 16 bytes, whether or not the prefix bytes
+	# run past that limit.
+	def test17_InstructionTooLong(self):
+		for buffer_type in (bytearray,str):
+			decoder = X86Decoder(BufferStreamObj(buffer_type(bytearray([0x66]*15+[0x05,0,0,0,0]))))
+			self.assertRaises(InvalidInstruction,decoder.Decode,0)
+
+class TestX86DecodeRange(unittest.TestCase):
+	# nop / xor eax, eax / ud2 / jmp $+2
+	bytes = bytearray([0x90,0x33,0xC0,0x0F,0x0B,0xEB,0x00])
+	
+	def test00_Sweep(self):
+		base = 0x401000
+		result = X86Decoder.DecodeRange(self.bytes,base=base)
+		self.assertEqual([(ea,length) for ea,length,instr in result],[(base,1),(base+1,2),(base+3,2),(base+5,2)])
+		self.assertEqual(result[0][2],Instruction([],Nop))
+		self.assertEqual(result[1][2],Instruction([],Xor,Gd(Eax),Gd(Eax)))
+		self.assertEqual(result[2][2],Instruction([],Ud2))
+		self.assertEqual(result[3][2],Instruction([],Jmp,JccTarget(base+7,base+7)))
+
+	# Undecodable bytes come back as None, one byte at a time.
+	def test01_Invalid(self):
+		result = X86Decoder.DecodeRange(bytearray([0x62,0xC0]))
+		self.assertEqual(result,[(0,1,None),(1,1,None)])
+		result = X86Decoder.DecodeRange(bytearray([0xF0,0x90]))
+		self.assertEqual(result,[(0,2,Instruction([],Nop))])
+
+	# An instruction beginning before the end is decoded in full; one that
+	# runs off the end of the buffer is not.
+	def test02_Bounds(self):
+		result = X86Decoder.DecodeRange(self.bytes,1,2)
+		self.assertEqual(result,[(1,2,Instruction([],Xor,Gd(Eax),Gd(Eax)))])
+		result = X86Decoder.DecodeRange(str(self.bytes[:2]))
+		self.assertEqual(result,[(0,1,Instruction([],Nop)),(1,1,None)])
+
+	# The control flow is computed when it is first asked for.
+	def test03_Flow(self):
+		decoder = X86Decoder(BufferStreamObj(bytearray([0x74,0x02,0xC3,0x90])))
+		d = decoder.Decode(0)
+		self.assertIsNone(d._flow)
+		self.assertEqual(d.flow.get_successors(),([4,2],[]))
+		self.assertIs(d.flow,d.flow)
+		self.assertIsInstance(decoder.Decode(2).flow,FlowReturn)
+		self.assertEqual(decoder.Decode(3).flow.get_successors(),([4],[]))
+
+# The compiled decoder must agree with X86Decoder on everything, including 
+# prefixed instructions and bytes that don't decode.
+class TestX86CompiledDecoderRandomly(unittest.TestCase):
+	prefixes = [0xF0,0xF2,0xF3,0x2E,0x36,0x3E,0x26,0x64,0x65,0x66,0x67]
+
+	def decode(self,cls,bytes):
+		try:
+			return cls(BufferStreamObj(bytes)).DecodeInstruction(0)
+		except Exception as e:
+			return type(e)
+	
+	def test00_Instructions(self):
+		random.seed(11)
+		encoder = X86Encoder()
+		for i in xrange(2000):
+			enc = encoder.EncodeInstruction(generate_random_instruction())
+			pfx = [ random.choice(self.prefixes) for j in xrange(random.randint(0,2)) ]
+			bytes = bytearray(pfx)+bytearray(enc)
+			expected = self.decode(X86Decoder,bytes)
+			self.assertEqual(self.decode(X86CompiledDecoder,bytes),expected,bytes)
+			self.assertEqual(self.decode(X86CompiledDecoder,bytes),expected,bytes)
+
+	# Near the top of the address space, so that branch targets wrap around.
+	def test01_RandomBytes(self):
+		random.seed(12)
+		for i in xrange(20):
+			bytes = bytearray(random.getrandbits(8) for j in xrange(512))
+			base = 0x100000000-len(bytes)
+			self.assertEqual(X86CompiledDecoder.DecodeRange(bytes,base=base),X86Decoder.DecodeRange(bytes,base=base))
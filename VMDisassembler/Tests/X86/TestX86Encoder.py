@@ -75,4 +75,56 @@ class TestX86Encoder(unittest.TestCase):
 	# AddrPrefix and Immediate_MemExpr operand
 	def test14_AddrPrefix_Immediate_MemExpr(self):
 		self.do_test(Instruction([],Mov,Gb(Al),Mem16(DS,Mb,None,None,0x1234)),[0x67,0xA0,0x34,0x12])
-		self.do_test(Instruction([],Mov,Gb(Al),Mem32(DS,Mb,None,None,0,0x12345678)),[0xA0,0x78,0x56,0x34,0x12])
\ No newline at end of file
+		self.do_test(Instruction([],Mov,Gb(Al),Mem32(DS,Mb,None,None,0,0x12345678)),[0xA0,0x78,0x56,0x34,0x12])
+# Run all of the same tests with a fresh encoding index, encoding everything
+# twice, so that the second time comes from the cache.
+class TestX86EncoderCached(TestX86Encoder):
+	def setUp(self):
+		X86Encoder.encoding_index.clear()
+		self.enc = X86Encoder()
+
+	def do_test(self,instr,bytes):
+		TestX86Encoder.do_test(self,instr,bytes)
+		TestX86Encoder.do_test(self,instr,bytes)
+
+	def test15_CacheCounters(self):
+		self.do_test(Instruction([],Push,Gd(Esi)),[0x56])
+		self.do_test(Instruction([],Push,Gd(Edi)),[0x57])
+		self.assertEqual((self.enc.hits,self.enc.misses),(2,2))
+
+	# Callers may modify the bytes they get back.
+	def test16_CacheCopies(self):
+		instr = Instruction([],Push,Gd(Esi))
+		self.enc.EncodeInstruction(instr).append(0x90)
+		self.do_test(instr,[0x56])
+
+	# The same operand types, with different registers or segments, choose
+	# different encodings and prefixes; relative jumps are encoded differently at each 
+	# address.
+	def test17_IndexAndAddresses(self):
+		self.do_test(Instruction([],Add,Gd(Eax),Id(0x80)),[0x05,0x80,0x00,0x00,0x00])
+		self.do_test(Instruction([],Add,Gd(Ecx),Id(0x80)),[0x81,0xC1,0x80,0x00,0x00,0x00])
+		self.do_test(Instruction([],Mov,Gd(Eax),Mem32(DS,Md,Ebx,None,0,None)),[0x8B,0x03])
+		self.do_test(Instruction([],Mov,Gd(Eax),Mem32(FS,Md,Ebx,None,0,None)),[0x64,0x8B,0x03])
+		jmp = Instruction([],Jmp,JccTarget(0x1000,0))
+		self.assertEqual(self.enc.EncodeInstruction(jmp,0x1000),[0xE9,0xFB,0xFF,0xFF,0xFF])
+		self.assertEqual(self.enc.EncodeInstruction(jmp,0x0F00),[0xE9,0xFB,0x00,0x00,0x00])
+
+	# Conditional branches and direct calls use their long, relative forms.
+	def test18_RelativeBranches(self):
+		jz = Instruction([],Jz,JccTarget(0x1000,0))
+		self.assertEqual(self.enc.EncodeInstruction(jz,0x1000),[0x0F,0x84,0xFA,0xFF,0xFF,0xFF])
+		self.assertEqual(self.enc.EncodeInstruction(Instruction([],Jg,JccTarget(0x1010,0)),0x1000),[0x0F,0x8F,0x0A,0x00,0x00,0x00])
+		self.assertEqual(self.enc.EncodeInstruction(Instruction([],Call,JccTarget(0x2000,0)),0x1000),[0xE8,0xFB,0x0F,0x00,0x00])
+
+	# Loops and jecxz only have short forms.  Jcxz takes an address size 
+	# prefix, so its destination must be 16-bit.
+	def test19_ShortBranches(self):
+		self.assertEqual(self.enc.EncodeInstruction(Instruction([],Loop,JccTarget(0x1000,0)),0x1000),[0xE2,0xFE])
+		self.assertEqual(self.enc.EncodeInstruction(Instruction([],Loopz,JccTarget(0x1010,0)),0x1000),[0xE1,0x0E])
+		self.assertEqual(self.enc.EncodeInstruction(Instruction([],Loopnz,JccTarget(0x0F82,0)),0x1000),[0xE0,0x80])
+		self.assertEqual(self.enc.EncodeInstruction(Instruction([],Jecxz,JccTarget(0x1081,0)),0x1000),[0xE3,0x7F])
+		self.assertEqual(self.enc.EncodeInstruction(Instruction([],Jcxz,JccTarget(0x1000,0)),0x1000),[0x67,0xE3,0xFD])
+		self.assertRaises(BranchOutOfRange,self.enc.EncodeInstruction,Instruction([],Jecxz,JccTarget(0x1082,0)),0x1000)
+		self.assertRaises(BranchOutOfRange,self.enc.EncodeInstruction,Instruction([],Loop,JccTarget(0x0F81,0)),0x1000)
+		self.assertRaises(BranchOutOfRange,self.enc.EncodeInstruction,Instruction([],Jcxz,JccTarget(0x10000,0)),0xFFFE)
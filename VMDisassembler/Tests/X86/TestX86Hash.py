@@ -0,0 +1,75 @@
+from Pandemic.X86.X86 import *
+from Pandemic.X86.X86MetaData import *
+from Pandemic.Util.HashFunctions import rol, ror
+import os
+import subprocess
+import sys
+import unittest
+
+# Instructions covering every kind of operand, including absent parts of
+# memory expressions.
+SAMPLE_INSTRUCTIONS = """[
+Instruction([],Mov,Gd(Eax),Mem32(DS,Md,Eax,None,0,None)),
+Instruction([],Mov,Gd(Eax),Mem32(DS,Md,None,Ecx,2,0x1234)),
+Instruction([],Lea,Gw(Ax),Mem16(SS,Mw,Bp,Si,0x12)),
+Instruction([REP],Movsd),
+Instruction([LOCK],Xadd,Mem32(FS,Mb,Ebx,None,0,None),Gb(Cl)),
+Instruction([],Imul,Gd(Ecx),Gd(Edx),Id(0x12345678)),
+Instruction([],Out,Ib(0x80),Gb(Al)),
+Instruction([],Ret,Iw(8)),
+Instruction([],Jmp,AP32(8,0x401000)),
+Instruction([],CallF,AP16(0x10,0x1234)),
+Instruction([],Jz,JccTarget(0x401000,0x401006)),
+Instruction([],Mov,ControlReg(CR0),Gd(Eax)),
+Instruction([],Movq,MMXReg(MM1),XMMReg(XMM2)),
+Instruction([],Fadd,FPUReg(ST0),FPUReg(ST3)),
+Instruction([],Mov,SegReg(ES),Gw(Ax)),
+]"""
+
+class TestX86Hash(unittest.TestCase):
+	def test00_Rotate(self):
+		self.assertEqual(rol(32,0x80000001,1),0x00000003)
+		self.assertEqual(ror(32,0x80000001,1),0xC0000000)
+		self.assertEqual(rol(32,0x12345678,0),0x12345678)
+		self.assertEqual(ror(32,0x12345678,36),0x81234567)
+
+	# Equal instructions, built separately, hash equally.
+	def test01_Equal(self):
+		for i1,i2 in zip(eval(SAMPLE_INSTRUCTIONS),eval(SAMPLE_INSTRUCTIONS)):
+			self.assertEqual(i1,i2)
+			self.assertEqual(hash(i1),hash(i2))
+		# Prefixes compare as a set.
+		i1 = Instruction([REP,LOCK,REP],Movsd)
+		i2 = Instruction([LOCK,REP],Movsd)
+		self.assertEqual(i1,i2)
+		self.assertEqual(hash(i1),hash(i2))
+
+	# Operand order matters.
+	def test02_Order(self):
+		self.assertNotEqual(hash(Instruction([],Mov,Gd(Eax),Gd(Ecx))),hash(Instruction([],Mov,Gd(Ecx),Gd(Eax))))
+
+	def test03_Frozen(self):
+		table = dict()
+		for instr in eval(SAMPLE_INSTRUCTIONS):
+			frozen = instr.Freeze()
+			self.assertIs(frozen.Freeze(),frozen)
+			self.assertEqual(hash(frozen),hash(instr))
+			table[frozen] = str(instr)
+		self.assertEqual(len(table),len(eval(SAMPLE_INSTRUCTIONS)))
+		for instr in eval(SAMPLE_INSTRUCTIONS):
+			self.assertEqual(table[instr],str(instr))
+
+	# The hashes are the same in a different process.
+	def test04_Stable(self):
+		root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+		script = "from Pandemic.X86.X86 import *\nprint map(hash,%s)" % SAMPLE_INSTRUCTIONS
+		output = subprocess.check_output([sys.executable,"-c",script],cwd=root)
+		self.assertEqual(eval(output),map(hash,eval(SAMPLE_INSTRUCTIONS)))
+
+	# Every operand's hash is computed when it is constructed.
+	def test05_OperandHashStored(self):
+		for instr in eval(SAMPLE_INSTRUCTIONS):
+			for op in (instr.op1,instr.op2,instr.op3):
+				if op is not None:
+					self.assertEqual(hash(op),op.ComputeHash())
+					self.assertRaises(AttributeError,setattr,op,"_hash",0)
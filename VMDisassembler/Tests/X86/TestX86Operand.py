@@ -0,0 +1,37 @@
+from Pandemic.X86.X86 import *
+from Pandemic.X86.X86MetaData import *
+import unittest
+
+class TestX86Operand(unittest.TestCase):
+	def test00_InternedEnum(self):
+		self.assertIs(R32Elt(0),Eax)
+		self.assertIs(Ebx(3),Ebx)
+		self.assertIs(MnemElt(Mov.IntValue()),Mov)
+		self.assertRaises(RuntimeError,setattr,Eax,"_value",1)
+
+	def test01_InternedRegister(self):
+		self.assertIs(Gd(Eax),Gd(Eax))
+		self.assertIs(Gd(0,True),Gd(Eax))
+		self.assertIs(Gd(Ecx)(0),Gd(Eax))
+		self.assertIsNot(Gd(Eax),Gw(Ax))
+		self.assertNotEqual(Gd(Eax),Gw(Ax))
+		self.assertRaises(TypeError,Gd,Ax)
+
+	def test02_Immutable(self):
+		for op in [Gd(Eax),Id(1),Mem32(DS,Md,Eax,None,0,None),Mem16(DS,Mw,Bx,Si,None),AP32(8,0),JccTarget(0,0)]:
+			self.assertFalse(hasattr(op,"__dict__"))
+			self.assertRaises(AttributeError,setattr,op,"value",0)
+		m = Mem32(DS,Md,Eax,None,0,None)
+		self.assertRaises(AttributeError,setattr,m,"Disp",4)
+		self.assertEqual(m(FS),Mem32(FS,Md,Eax,None,0,None))
+		self.assertEqual(m.Seg,DS)
+
+	def test03_Masked(self):
+		self.assertEqual(Ib(0x1FF).value,0xFF)
+		self.assertEqual(Iw(-1).value,0xFFFF)
+		self.assertEqual(Id(0x123456789).value,0x23456789)
+		self.assertEqual(Mem16(DS,Mw,Bx,None,0x12345).Disp,0x2345)
+		self.assertEqual(Mem32(DS,Md,Eax,Ecx,7,0).ScaleFac,3)
+		self.assertIsNone(Mem32(DS,Md,Eax,None,0,0).Disp)
+		self.assertEqual((AP16(0x12345,0x12345).Seg,AP16(0x12345,0x12345).Off),(0x2345,0x2345))
+		self.assertEqual(JccTarget(0x100401005,0x401005),JccTarget(0x401005,0x401005))
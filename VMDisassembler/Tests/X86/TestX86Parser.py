@@ -0,0 +1,32 @@
+from Pandemic.X86.X86 import *
+from Pandemic.X86.X86MetaData import *
+from Pandemic.X86 import X86Lex, X86Yacc, X86LexTab, X86ParseTab
+from Pandemic.X86.X86Parser import parser
+import ply.lex as lex
+import ply.yacc as yacc
+import unittest
+
+class TestX86Parser(unittest.TestCase):
+	def do_test(self,text,instr):
+		self.assertEqual(parser.Parse(text),instr)
+
+	def test00_Parse(self):
+		self.do_test("xor eax, eax",Instruction([],Xor,Gd(Eax),Gd(Eax)))
+		self.do_test("mov eax, dword ptr [ebx+ecx*4+12h]",Instruction([],Mov,Gd(Eax),Mem32(DS,Md,Ebx,Ecx,2,0x12)))
+		self.do_test("add byte ptr fs:[esi], 1",Instruction([],Add,Mem32(FS,Mb,Esi,None,0,None),Ib(1)))
+		self.do_test("lea ax, [bp+si+10h]",Instruction([],Lea,Gw(Ax),Mem16(SS,Mw,Bp,Si,0x10)))
+		self.do_test("push dword ptr [esp+4]",Instruction([],Push,Mem32(SS,Md,Esp,None,0,4)))
+
+	# The generated tables must be regenerated whenever the grammar or the
+	# tokens change; see bin/X86Programs/X86BuildParserTables.py.
+	def test01_ParseTabCurrent(self):
+		p = X86Yacc.X86Yacc.__new__(X86Yacc.X86Yacc)
+		p.tokens = X86Lex.X86Lexer.tokens
+		pinfo = yacc.ParserReflect(dict((k,getattr(p,k)) for k in dir(p)))
+		pinfo.get_all()
+		self.assertEqual(pinfo.signature(),X86ParseTab._lr_signature)
+
+	def test02_LexTabCurrent(self):
+		l = X86Lex.X86Lexer()
+		self.assertEqual(l.lexer.lexstateretext,dict((k,[r for r,f in v]) for k,v in X86LexTab._lexstatere.items()))
+		self.assertEqual(l.lexer.lexstateignore,X86LexTab._lexstateignore)
@@ -1,7 +1,8 @@
 from Pandemic.X86.X86 import *
 from Pandemic.X86.X86MetaData import *
 from Pandemic.X86.X86InternalOperand import *
-from Pandemic.X86.X86TypeChecker import X86TypeChecker, MATCHES, SizePFX, AddrPFX, SegPFX, TypeCheckInfo
+from Pandemic.X86.X86TypeChecker import X86TypeChecker, X86TypeCheckError, MATCHES, SizePFX, AddrPFX, SegPFX, TypeCheckInfo, AOTtoOperandClasses
+import Pandemic.X86.X86EncodeTable as X86EncodeTable
 import unittest
 
 num_iterations = 10000
@@ -121,4 +122,33 @@ class TestX86TypeChecker(unittest.TestCase):
 		(Iw(5),None),(Gb(Al),None),(Gb(Dl),None),(FPUReg(ST0),None),
 		(MMXReg(MM1),None),(XMMReg(XMM2),None),(SegReg(FS),None),
 		(ControlReg(CR0),None),(DebugReg(DR0),None),(Ib(0),None),(Id(0),None),
-		(AP16(0,0),None),(AP32(0,0),None),(JccTarget(0,0),None)])
\ No newline at end of file
+		(AP16(0,0),None),(AP32(0,0),None),(JccTarget(0,0),None)])
+
+	# Operands rejected by the class pre-filter must not match.
+	def test09_OperandClasses(self):
+		operands = [Gb(Al),Gw(Dx),Gd(Eax),Gd(Ecx),FPUReg(ST0),MMXReg(MM1),XMMReg(XMM2),
+		SegReg(ES),SegReg(FS),ControlReg(CR0),DebugReg(DR0),Ib(1),Ib(0x80),Iw(5),Id(0xFFFFFFFF),
+		Mem16(DS,Mb,Si,None,None),Mem16(ES,Mw,Di,None,None),Mem32(DS,Md,Esi,None,0,None),
+		Mem32(ES,Md,Edi,None,0,None),Mem32(FS,Mb,None,None,0,0x10),Mem32(SS,Mq,Ebx,Ecx,2,4),
+		AP16(0,0),AP32(0,0),JccTarget(0,0)]
+		for i in xrange(X86_INTERNAL_OPERAND_LAST+1):
+			aop = AOTElt(i)
+			for op in operands:
+				try: res = self.tc.check(aop,op)
+				except TypeError: continue
+				if res is not None:
+					self.assertIsInstance(op,AOTtoOperandClasses[i],"%s matched %s, but was pre-filtered" % (op,aop))
+
+	# The non-raising variant agrees with the raising one.
+	def test10_TypeCheckInstruction_opt(self):
+		instrs = [Instruction([],Push,Gd(Esi)),Instruction([],Mov,Gd(Eax),Gd(Ecx)),
+		Instruction([],Mov,Mem32(DS,Md,Ebx,None,0,0x1234),Id(0x5678)),
+		Instruction([],Mov,Gw(Ax),Mem16(FS,Mw,Bx,None,None)),Instruction([],Add,Gd(Eax),Id(0x80)),
+		Instruction([],Movsb,Mem32(ES,Mb,Edi,None,0,None),Mem32(FS,Mb,Esi,None,0,None)),
+		Instruction([],Shl,Gd(Ecx),Ib(1)),Instruction([],Jmp,JccTarget(0,0)),Instruction([],Nop)]
+		for instr in instrs:
+			for enc in X86EncodeTable.mnem_to_encodings[instr.mnem.IntValue()]:
+				try: exn = self.tc.TypeCheckInstruction_exn(instr,enc.ops)
+				except X86TypeCheckError: exn = None
+				self.assertEqual(self.tc.TypeCheckInstruction_opt(instr,enc.ops),exn,"%s %s" % (instr,enc.ops))
+
@@ -1,6 +1,7 @@
 # Import FinSpy VM object definitions and simplification code
 from FinSpyVM import *
-from Simplify import Simplify
+from VMCache import LoadSimplified
+from X86Emitter import X86Emitter, FixupList
 
 # This dictionary maps a Jcc type to its 2nd opcode byte
 # (first byte for all of them is 0x0F).
@@ -14,8 +15,8 @@ JCC_TO_OPCODE_DICT = dict([
 # Given: insns, a list of FinSpy VM instructions
 # Generate and return an array of x86 machine code bytes for the VM program
 def RebuildX86(insns):
-	# Array of x86 machine code, built instruction-by-instruction
-	mcArr  = []
+	# x86 machine code, built instruction-by-instruction
+	mcArr  = X86Emitter()
 	
 	# Bookkeeping: which VM position/key corresponds to which
 	# position within the x86 machine code array mcArr above
@@ -23,13 +24,13 @@ def RebuildX86(insns):
 	keysDict = dict()
 	
 	# List of fixups for branch instructions
-	locFixups = []
+	locFixups = FixupList()
 	
 	# Iterate through the FinSpy VM instructions
 	for i in insns:
 		
 		# currLen is the current position within mcArr
-		currLen = len(mcArr)
+		currLen = mcArr.Pos()
 		
 		# Bookkeeping: memorize the x86 position for the 
 		# VM instruction's VM position and VM key 
@@ -39,9 +40,9 @@ def RebuildX86(insns):
 		# Is it "Raw X86" or "X86JUMPOUT"? Just emit the
 		# raw x86 machine code if so
 		if isinstance(i,RawX86StraightLine):
-			mcArr.extend(i.Remainder[0:i.DataLen])
+			mcArr.EmitBytes(i.Remainder[0:i.DataLen])
 		elif isinstance(i,RawX86Jumpout):
-			mcArr.extend(i.Instruction[0:i.DataLen])
+			mcArr.EmitBytes(i.Instruction[0:i.DataLen])
 
 		# Is it a branch instruction?
 		elif isinstance(i, ConditionalBranch):
@@ -53,7 +54,7 @@ def RebuildX86(insns):
 			if jccName == "JMP":
 
 				# Emit 0xE9 (x86 JMP disp32)
-				mcArr.append(0xE9)
+				mcArr.EmitByte(0xE9)
 
 				# Opcode is 1 byte
 				dispPos = 1
@@ -61,16 +62,16 @@ def RebuildX86(insns):
 			# Otherwise, it's a conditional jump
 			else:
 				# Conditional jumps begin with 0x0F
-				mcArr.append(0x0F)
+				mcArr.EmitByte(0x0F)
 				
 				# Second byte is specific to the condition code
-				mcArr.append(JCC_TO_OPCODE_DICT[jccName])
+				mcArr.EmitByte(JCC_TO_OPCODE_DICT[jccName])
 
 				# Opcode is 2 bytes
 				dispPos = 2
 
 			# Emit the displacement DWORD (0 for now)
-			mcArr.extend([0x00, 0x00, 0x00, 0x00])
+			mcArr.EmitDword(0)
 
 			# Emit a fixup: the JMP displacement targets
 			# the VM location specified by i.VMTarget
@@ -82,8 +83,8 @@ def RebuildX86(insns):
 			# We aren't handling this just yet.
 			# Emit E8 00 00 00 00 (CALL $+5)
 			# Revisit later
-			mcArr.append(0xE8)
-			mcArr.extend([0x00, 0x00, 0x00, 0x00])
+			mcArr.EmitByte(0xE8)
+			mcArr.EmitDword(0)
 
 		# These should be the only 4 cases left at this point.
 		# If not, something went wrong; bail.
@@ -103,12 +104,12 @@ def RebuildX86(insns):
 		# Find the machine code address for te destination
 		mcDst = locsDict[dst]
 		# Set the displacement DWORD within x86 branch instruction
-		StoreDword(mcArr, mcSrc+srcFixup, mcDst-(mcSrc+srcFixup+4))
+		mcArr.StoreRel32(mcSrc+srcFixup, mcDst)
 
-	return bytearray(mcArr)
+	return mcArr.Code
 
 # Disassemble and simplify VM bytecode program
-newInsns = Simplify(list(bytes_from_file("Tmp/dec.bin")))
+newInsns = LoadSimplified("Tmp/dec.bin")
 
 # Devirtualize
 mcArr = RebuildX86(newInsns)
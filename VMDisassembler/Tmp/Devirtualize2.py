@@ -1,10 +1,15 @@
 # Import FinSpy VM object definitions and simplification code
 from FinSpyVM import *
-from Simplify import Simplify
+from VMCache import LoadSimplified
+from X86Emitter import X86Emitter, FixupList
 
 # Get the virtualized function data generated from function extraction scripts
 from VirtualizedFunctionData import *
 
+import bisect
+import struct
+import sys
+
 # This dictionary maps a Jcc type to its 2nd opcode byte
 # (first byte for all of them is 0x0F).
 JCC_TO_OPCODE_DICT = dict([
@@ -14,37 +19,165 @@ JCC_TO_OPCODE_DICT = dict([
 ("JL", 0x8C),("JGE",0x8D),("JLE",0x8E),("JG", 0x8F),
 ])
 
-# This dictionary maps a VM key to its prologue bytes, if any
-KEY_TO_PROLOGUE_BYTES_DICT = { x[0]:x[2] for x in KEY_TO_X86_VMENTRY_AND_PROLOGUE_BYTES_TUPLES }
-
-# This dictionary maps a virtualized function start address to its VM key
-X86_VMENTRY_TO_KEY_DICT    = { x[1]:x[0] for x in KEY_TO_X86_VMENTRY_AND_PROLOGUE_BYTES_TUPLES }
-
-# Given: insns, a list of FinSpy VM instructions
-# Generate and return an array of x86 machine code bytes for the VM program
-def RebuildX86(insns, newImageBase):
-	# Array of x86 machine code, built instruction-by-instruction
-	mcArr  = []
+# The context for this sample, including the virtualized function data.
+# Like DEFAULT_CONTEXT, its fixup log is ALL_FIXED_UP_DWORDS.
+SAMPLE_CONTEXT = VMSampleContext(
+	notVirtualized=NOT_VIRTUALIZED,
+	vmEntries=KEY_TO_X86_VMENTRY_AND_PROLOGUE_BYTES_TUPLES,
+	fixedUpDwords=ALL_FIXED_UP_DWORDS)
+
+# Lengths of the devirtualized branch encodings
+JMP_REL32_LEN = 5 # E9 rel32
+JCC_REL32_LEN = 6 # 0F 8x rel32
+JMP_REL8_LEN  = 2 # EB rel8
+JCC_REL8_LEN  = 2 # 7x rel8
+
+# Given: insns, a list of FinSpy VM instructions, and ctx, the sample's
+# VMSampleContext
+# Decide which branches can use the short (rel8) encodings. Returns the set
+# of VM positions of those branches.
+#
+# We start out assuming that every branch within the VM program is short, 
+# lay out the code, and lengthen every branch whose displacement doesn't fit
+# in a signed byte. Lengthening a branch can only push other branches' 
+# targets further away, so we repeat until no more branches need to be
+# lengthened.
+def RelaxBranches(insns, ctx):
+	# For each VM instruction: its VM position, and the length of its
+	# devirtualized machine code (including any prologue) with all branches
+	# long.
+	posArr = []
+	lenArr = []
 	
-	# Bookkeeping: which VM position/key corresponds to which
-	# position within the x86 machine code array mcArr above
-	locsDict = dict()
-	keysDict = dict()
+	# For each branch that could be short: its index in the arrays above, 
+	# the length of any prologue before it, the number of bytes saved by 
+	# making it short, and the VM position of its destination.
+	branches = []
 	
-	# List of fixups for branch instructions
-	locFixups = []
+	for i in insns:
+		prologueLen = len(ctx.KeyToPrologueBytes.get(i.Key, []))
+		if isinstance(i,RawX86StraightLine) or isinstance(i,RawX86Jumpout):
+			insnLen = i.DataLen
+		elif isinstance(i,ConditionalBranch):
+			if INSN_NAME_DICT[i.Opcode] == "JMP":
+				insnLen,saved = JMP_REL32_LEN,JMP_REL32_LEN-JMP_REL8_LEN
+			else:
+				insnLen,saved = JCC_REL32_LEN,JCC_REL32_LEN-JCC_REL8_LEN
+			if i.VMTarget is not None:
+				branches.append((len(posArr),prologueLen,saved,i.VMTarget))
+		elif isinstance(i,RawX86Callout):
+			insnLen = 5
+		else:
+			print "Can't devirtualize", i
+			assert(False)
+		posArr.append(i.Pos)
+		lenArr.append(prologueLen+insnLen)
 	
-	# List of fixups for virtualized function calls
-	keyFixups = []
+	# Map VM positions to indices in the arrays above
+	posToIdx = { pos:idx for idx,pos in enumerate(posArr) }
+
+	# Initially, assume all branches are short
+	shortBranches = set(b[0] for b in branches)
 	
-	# List of fixups for non-virtualized function calls
-	binaryRelativeFixups = []
+	while True:
+		# Lay out the code with the current choice of branch sizes.
+		savedArr = [0]*len(lenArr)
+		for idx,prologueLen,saved,dst in branches:
+			if idx in shortBranches:
+				savedArr[idx] = saved
+		locs = [0]*(len(lenArr)+1)
+		for idx in xrange(len(lenArr)):
+			locs[idx+1] = locs[idx] + lenArr[idx] - savedArr[idx]
+		
+		# Lengthen any short branches whose displacements don't fit.
+		lengthened = False
+		for idx,prologueLen,saved,dst in branches:
+			if idx in shortBranches:
+				disp = locs[posToIdx[dst]] - (locs[idx] + prologueLen + 2)
+				if disp < -0x80 or disp > 0x7F:
+					shortBranches.remove(idx)
+					lengthened = True
+		
+		# Stop once the layout has converged.
+		if not lengthened:
+			break
+
+	return set(posArr[idx] for idx in shortBranches)
+
+# The devirtualized machine code for a run of consecutive VM instructions,
+# before it has been placed at its final location. A whole VM program can
+# be devirtualized as a single segment, or as several (e.g., one per run of
+# a function's basic blocks, devirtualized independently of one another) 
+# that are then linked together; see EmitSegment and LinkSegments.
+class DevirtualizedSegment(object):
+	def __init__(self):
+		# x86 machine code, built instruction-by-instruction
+		self.Emitter = X86Emitter()
+
+		# Bookkeeping: which VM position/key corresponds to which
+		# position within the x86 machine code above
+		self.Locs = dict()
+		self.Keys = dict()
+		
+		# List of fixups for branch instructions whose destinations lie
+		# outside of the segment
+		self.LocFixups = FixupList()
+		
+		# List of fixups for short branch instructions, likewise
+		self.ShortLocFixups = FixupList()
+		
+		# List of fixups for virtualized function calls
+		self.KeyFixups = FixupList()
+		
+		# List of fixups for non-virtualized function calls
+		self.BinaryRelativeFixups = FixupList()
+
+	# Return the segment as plain values for marshal.
+	def Serialize(self):
+		fixups = [ (f.Src.tostring(), f.Off.tostring(), f.Dst.tostring()) for f in self.FixupLists() ]
+		return (str(self.Emitter.Code), self.Locs, self.Keys, fixups)
+
+	# Inverse of Serialize.
+	@staticmethod
+	def Deserialize(serialized):
+		code,locs,keys,fixups = serialized
+		seg = DevirtualizedSegment()
+		seg.Emitter.Code = bytearray(code)
+		seg.Locs = locs
+		seg.Keys = keys
+		for f,(src,off,dst) in zip(seg.FixupLists(), fixups):
+			f.Src.fromstring(src)
+			f.Off.fromstring(off)
+			f.Dst.fromstring(dst)
+		return seg
+
+	def FixupLists(self):
+		return (self.LocFixups, self.ShortLocFixups, self.KeyFixups, self.BinaryRelativeFixups)
+
+# Given: insns, a list of FinSpy VM instructions
+# Generate the x86 machine code for them, and return it as a 
+# DevirtualizedSegment. Branches whose VM positions are in shortBranches
+# use the short encodings. Branches to other instructions in insns are
+# fixed up here; everything else is left for LinkSegments.
+# ctx is the sample's VMSampleContext (default: SAMPLE_CONTEXT).
+def EmitSegment(insns, shortBranches=frozenset(), ctx=None):
+	if ctx is None:
+		ctx = SAMPLE_CONTEXT
+
+	seg = DevirtualizedSegment()
+	mcArr = seg.Emitter
+	locsDict = seg.Locs
+	keysDict = seg.Keys
+	keyFixups = seg.KeyFixups
+	binaryRelativeFixups = seg.BinaryRelativeFixups
+	locFixups = FixupList()
+	shortLocFixups = FixupList()
 
 	# Iterate through the FinSpy VM instructions
 	for i in insns:
 		
 		# currLen is the current position within mcArr
-		currLen = len(mcArr)
+		currLen = mcArr.Pos()
 		
 		# Bookkeeping: memorize the x86 position for the 
 		# VM instruction's VM position and VM key 
@@ -59,11 +192,11 @@ def RebuildX86(insns, newImageBase):
 		
 		# New: is this VM instruction the beginning of a 
 		# virtualized function?
-		if i.Key in KEY_TO_PROLOGUE_BYTES_DICT:
+		if i.Key in ctx.KeyToPrologueBytes:
 		
 			# Get the prologue bytes that should be inserted
 			# before this VM instruction.
-			prologueBytes = KEY_TO_PROLOGUE_BYTES_DICT[i.Key]
+			prologueBytes = ctx.KeyToPrologueBytes[i.Key]
 			
 			# Increase the length of the instruction.
 			prologueLen += len(prologueBytes)
@@ -71,14 +204,14 @@ def RebuildX86(insns, newImageBase):
 			# Copy the raw x86 machine code for the prologue
 			# into the mcArr array before devirtualizing the
 			# instruction.
-			mcArr.extend(prologueBytes)
+			mcArr.EmitBytes(prologueBytes)
 
 		# Is it "Raw X86" or "X86JUMPOUT"? Just emit the
 		# raw x86 machine code if so
 		if isinstance(i,RawX86StraightLine):
-			mcArr.extend(i.Remainder[0:i.DataLen])
+			mcArr.EmitBytes(i.Remainder[0:i.DataLen])
 		elif isinstance(i,RawX86Jumpout):
-			mcArr.extend(i.Instruction[0:i.DataLen])
+			mcArr.EmitBytes(i.Instruction[0:i.DataLen])
 
 		# Is it a branch instruction?
 		elif isinstance(i, ConditionalBranch):
@@ -86,11 +219,28 @@ def RebuildX86(insns, newImageBase):
 			# Get the name of the branch
 			jccName = INSN_NAME_DICT[i.Opcode]
 
+			# Was the branch relaxed to a short branch?
+			if i.Pos in shortBranches:
+				
+				# Emit 0xEB (x86 JMP disp8), or 0x7x (x86 Jcc disp8,
+				# the condition code is the same as in 0F 8x)
+				if jccName == "JMP":
+					mcArr.EmitByte(0xEB)
+				else:
+					mcArr.EmitByte(JCC_TO_OPCODE_DICT[jccName]-0x10)
+				
+				# Emit the displacement byte (0 for now)
+				mcArr.EmitByte(0x00)
+				
+				# Emit a fixup for the displacement byte
+				shortLocFixups.append((i.Pos,prologueLen+1,i.VMTarget))
+				continue
+
 			# Is this an unconditional jump?
 			if jccName == "JMP":
 
 				# Emit 0xE9 (x86 JMP disp32)
-				mcArr.append(0xE9)
+				mcArr.EmitByte(0xE9)
 
 				# Opcode is 1 byte
 				dispPos = 1
@@ -98,29 +248,29 @@ def RebuildX86(insns, newImageBase):
 			# Otherwise, it's a conditional jump
 			else:
 				# Conditional jumps begin with 0x0F
-				mcArr.append(0x0F)
+				mcArr.EmitByte(0x0F)
 				
 				# Second byte is specific to the condition code
-				mcArr.append(JCC_TO_OPCODE_DICT[jccName])
+				mcArr.EmitByte(JCC_TO_OPCODE_DICT[jccName])
 
 				# Opcode is 2 bytes
 				dispPos = 2
 
 			# Emit the displacement DWORD (0 for now)
-			mcArr.extend([0x00, 0x00, 0x00, 0x00])
+			mcArr.EmitDword(0)
 
 			# Emit a fixup: the JMP displacement targets
 			# the VM location specified by i.VMTarget
-			locFixups.append((i.Pos,dispPos,i.VMTarget))
+			locFixups.append((i.Pos,prologueLen+dispPos,i.VMTarget))
 
 		# Is this an "X86CALLOUT" ("Direct Call")?
 		elif isinstance(i,RawX86Callout):
 			
 			# New: emit 0xE8 (x86 CALL disp32)
-			mcArr.append(0xE8)
+			mcArr.EmitByte(0xE8)
 			
 			# Was the target a non-virtualized function?
-			if i.X86Target in NOT_VIRTUALIZED:
+			if i.X86Target in ctx.NotVirtualized:
 				
 				# Emit a fixup from to the raw target
 				binaryRelativeFixups.append((i.Pos,prologueLen+1,i.X86Target))
@@ -135,7 +285,7 @@ def RebuildX86(insns, newImageBase):
 			# Write the dummy destination DWORD in the x86 CALL
 			# instruction that we just generated. This will be 
 			# fixed-up later.
-			mcArr.extend([0x00, 0x00, 0x00, 0x00])
+			mcArr.EmitDword(0)
 		
 		# These should be the only 4 cases left at this point.
 		# If not, something went wrong; bail.
@@ -143,19 +293,85 @@ def RebuildX86(insns, newImageBase):
 			print "Can't devirtualize", i
 			assert(False)
 
-	# Process branch fixups. They contain:
-	# * srcBegin: beginning of devirtualized branch instruction
-	# * srcFixup: distance into devirtualized branch instruction
-	#             where displacement DWORD is located
-	# * dst:      the position within the VM program where the
-	#             branch destination is located
+	# Process the fixups for branches within the segment, and keep the
+	# others.
+	ResolveBranchFixups(mcArr, locsDict, locFixups, shortLocFixups, seg.LocFixups, seg.ShortLocFixups)
+	return seg
+
+# Process branch fixups. They contain:
+# * srcBegin: beginning of devirtualized branch instruction
+# * srcFixup: distance into devirtualized branch instruction
+#             where displacement DWORD is located
+# * dst:      the position within the VM program where the
+#             branch destination is located
+# Fixups whose destinations aren't in locsDict are appended to 
+# unresolvedFixups and unresolvedShortFixups, respectively, unless those
+# are None.
+def ResolveBranchFixups(mcArr, locsDict, locFixups, shortLocFixups, unresolvedFixups, unresolvedShortFixups):
 	for srcBegin, srcFixup, dst in locFixups:
+		if unresolvedFixups is not None and dst not in locsDict:
+			unresolvedFixups.append((srcBegin, srcFixup, dst))
+			continue
 		# Find the machine code address for the source
 		mcSrc = locsDict[srcBegin]
 		# Find the machine code address for te destination
 		mcDst = locsDict[dst]
 		# Set the displacement DWORD within x86 branch instruction
-		StoreDword(mcArr, mcSrc+srcFixup, mcDst-(mcSrc+srcFixup+4))
+		mcArr.StoreRel32(mcSrc+srcFixup, mcDst)
+
+	# Process short branch fixups. Same contents as above.
+	for srcBegin, srcFixup, dst in shortLocFixups:
+		if unresolvedShortFixups is not None and dst not in locsDict:
+			unresolvedShortFixups.append((srcBegin, srcFixup, dst))
+			continue
+		mcSrc = locsDict[srcBegin]
+		mcDst = locsDict[dst]
+		# Set the displacement byte within x86 branch instruction
+		mcArr.StoreRel8(mcSrc+srcFixup, mcDst)
+
+# Given: segs, a list of DevirtualizedSegments, in the order in which to 
+# lay them out
+# Concatenate their machine code, process the fixups that they left 
+# unresolved, and return the raw byte array for the whole program.
+# ctx is the sample's VMSampleContext (default: SAMPLE_CONTEXT).
+def LinkSegments(segs, newImageBase, ctx=None):
+	if ctx is None:
+		ctx = SAMPLE_CONTEXT
+
+	# A single segment is already in place; otherwise, lay them out one 
+	# after another, and translate their bookkeeping and fixups into terms
+	# of the whole program.
+	if len(segs) == 1:
+		seg = segs[0]
+		mcArr = seg.Emitter
+		locsDict = seg.Locs
+		keysDict = seg.Keys
+		locFixups = seg.LocFixups
+		shortLocFixups = seg.ShortLocFixups
+		keyFixups = seg.KeyFixups
+		binaryRelativeFixups = seg.BinaryRelativeFixups
+	else:
+		mcArr = X86Emitter()
+		locsDict = dict()
+		keysDict = dict()
+		locFixups = FixupList()
+		shortLocFixups = FixupList()
+		keyFixups = FixupList()
+		binaryRelativeFixups = FixupList()
+		for seg in segs:
+			base = mcArr.Pos()
+			mcArr.EmitBytes(seg.Emitter.Code)
+			for pos,loc in seg.Locs.iteritems():
+				locsDict[pos] = base+loc
+			for key,loc in seg.Keys.iteritems():
+				keysDict[key] = base+loc
+			for fixups,segFixups in zip((locFixups,shortLocFixups,keyFixups,binaryRelativeFixups), seg.FixupLists()):
+				for fixup in segFixups:
+					fixups.append(fixup)
+
+	# Process the branch fixups between segments. All of the destinations
+	# should be somewhere in the program by now.
+	ResolveBranchFixups(mcArr, locsDict, locFixups, shortLocFixups, None, None)
 
 	# Process virtualized function call fixups, which contain:
 	# * srcBegin: beginning of devirtualized CALL instruction
@@ -170,13 +386,13 @@ def RebuildX86(insns, newImageBase):
 		# Lookup the x86 address of the target in the information
 		# we extracted for virtualized functions. Extract the key 
 		# given the function's starting address.
-		klDst = X86_VMENTRY_TO_KEY_DICT[dst]
+		klDst = ctx.VMEntryToKey[dst]
 	
 		# Find the machine code address for the destination
 		mcDst = keysDict[klDst]
 
 		# Set the displacement DWORD within x86 CALL instruction
-		StoreDword(mcArr, mcSrc+srcFixup, mcDst-(mcSrc+srcFixup+4))
+		mcArr.StoreRel32(mcSrc+srcFixup, mcDst)
 
 	# Process non-virtualized call fixups. Same contents as above.
 	for srcBegin, srcFixup, dst in binaryRelativeFixups:
@@ -191,7 +407,7 @@ def RebuildX86(insns, newImageBase):
 		fixup = dst-(newImageBase+mcSrc+srcFixup+4)
 	
 		# Set the displacement DWORD within x86 CALL instruction
-		StoreDword(mcArr, mcSrc+srcFixup, fixup)
+		mcArr.StoreDword(mcSrc+srcFixup, fixup)
 
 	# Now we replace the function pointers to virtualized functions
 	# with the addresses of the devirtualized function bodies.
@@ -205,121 +421,101 @@ def RebuildX86(insns, newImageBase):
 	# devirtualized. Their positions in mcArr give us a region to 
 	# search for the dword value.
 	#
+	# Rather than stepping through the VM positions one instruction at
+	# a time, binary search a sorted list of the VM positions that were
+	# devirtualized. And rather than comparing the region byte-by-byte, 
+	# let bytearray.find search for the dword.
+	mcCode = mcArr.Code
+	survivingPos = sorted(locsDict.keys())
+	
 	# dword: the virtual address of a virtualized function
 	# posList: the list of VM instruction positions 
 	# referencing the value of dword.
-	for dword, posList in []:#ALL_FIXED_UP_DWORDS.items():
+	for dword, posList in sorted(ctx.FixedUpDwords.items()):
 	
-		# dwArr is the dword we're looking for, as bytes.
-		dwArr = [0]*4
-		StoreDword(dwArr, 0, dword)
+		# If there's no devirtualized body for the function, there's
+		# nothing to point the reference to.
+		if dword not in ctx.VMEntryToKey:
+			continue
 		
-		# For each position referencing dword:
-		for pos in posList:
+		# dwStr is the dword we're looking for, as bytes.
+		dwStr = struct.pack("<L", dword)
 		
-			# Set the low and high offset within the
-			# devirtualized blob to None
-			lowPos,highPos = None,None
+		# The devirtualized function body's address
+		newDword = keysDict[ctx.VMEntryToKey[dword]] + newImageBase
 		
-			# posSearchLow is the backwards iterator
-			posSearchLow = pos
-		
-			# Continue while we haven't located a prior
-			# instruction with a devirtualization offset
-			while not lowPos:
+		# For each position referencing dword:
+		for pos in posList:
 			
-				#print "Low: searching pos %#lx" % posSearchLow
-				# Does posSearchLow correspond to a 
-				# devirtualized instruction? I.e., not
-				# something eliminated by a pattern
-				# substitution.
-				if posSearchLow in locsDict:
-
-					# Yes: get the position and quit
-					lowPos = locsDict[posSearchLow]
-
-				else:
-					# No: move to the previous instruction
-					posSearchLow -= INSN_DESC_SIZE
-
-			# Now search for the next higher VM position
-			# with a devirtualization offset
-			posSearchHigh = pos+INSN_DESC_SIZE
-
-
-			# Continue while we haven't located a later
-			# instruction with a devirtualization offset
-			while not highPos:
-
-				#print "High: searching pos %#lx" % posSearchHigh
-
-				# Does posSearchLow correspond to a 
-				# devirtualized instruction? I.e., not
-				# something eliminated by a pattern
-				# substitution.
-				if posSearchHigh in locsDict:
+			# Find the index of the first devirtualized VM position 
+			# after pos. The one before it (if any) is the last 
+			# devirtualized VM position at or before pos.
+			idx = bisect.bisect_right(survivingPos, pos)
 			
-					# Yes: get the position and quit
-					highPos = locsDict[posSearchHigh]
-				else:
-					# No: move to the next instruction
-					posSearchHigh += INSN_DESC_SIZE
-
-
-			#print "Nearest: mcArr[%lx..%lx] = %s, decArr[%lx..%lx]" % (lowPos, highPos, mcArr[lowPos:highPos], posSearchLow, posSearchHigh)
-
-			# After the code above, we now have:
 			# lowPos: the beginning of the next-lower devirtualized instruction
+			lowPos  = locsDict[survivingPos[idx-1]] if idx > 0 else 0
+			
 			# highPos: the beginning of the next-higher devirtualized instruction
-			# We now byte-search the array between those positions looking for
-			# the value of dword.
+			highPos = locsDict[survivingPos[idx]] if idx < len(survivingPos) else len(mcCode)
 			
-			# Haven't yet found it.
-			bFound = False
+			# Search for dword at any offset in [lowPos,highPos), allowing
+			# the match to run past highPos.
+			i = mcCode.find(dwStr, lowPos, highPos+len(dwStr)-1)
 			
-			# Search through mcArr at the positions specified above
-			for i in xrange(lowPos,highPos):
-				
-				# Say we have found it
-				bFoundInner = True
-				
-				# Byte-for-byte comparison
-				for j in xrange(len(dwArr)):
-					if mcArr[i+j] != dwArr[j]:
-						bFoundInner = False
-						break
-					else:
-						#print "Position %lx matched position %d (%lx)" % (i+j, j, dwArr[j])
-						pass
-
-				# Did we find dword within the specified region?
-				if bFoundInner:
-					#print "Found dword %08lx at position %d" % (dword, i)
-
-					# Retrieve the key corresponding to the VM entrypoint @ dword
-					# Retrieve the position of the key within mcArr from that
-					# Replace the VM Entrypoint dword in the instruction with the mcArr position
-					StoreDword(mcArr, i, keysDict[X86_VMENTRY_TO_KEY_DICT[dword]])
-					ApplyFixupSpecified(mcArr, i, newImageBase)
-
-					# Mark that we have replaced the DWORD
-					bFound = True
-					break
-			
-			# After searching and replacing.
-			if not bFound:
+			# Did we find dword within the specified region?
+			if i >= 0:
+				# Replace the VM Entrypoint dword in the instruction with the
+				# address of the devirtualized function body
+				mcArr.StoreDword(i, newDword)
+			else:
 				#print "Did not find dword %08lx in [%d,%d]" % (dword, lowPos, highPos)
 				pass
 	
 	# Return the raw byte array.
-	return bytearray(mcArr)
+	return mcCode
 
-# Disassemble and simplify VM bytecode program
-newInsns = Simplify([ x for x in bytes_from_file("Tmp/dec.bin") ])
-
-# Devirtualize, new base address is 0x500000
-mcArr = RebuildX86(newInsns, 0x500000)
-
-# Write devirtualized code to file
-with open("./Tmp/mc-take2.bin", "wb") as f:
-	f.write(mcArr)
+# Given: insns, a list of FinSpy VM instructions
+# Generate and return an array of x86 machine code bytes for the VM program
+# If relaxBranches is True, use short branch encodings wherever they fit.
+# ctx is the sample's VMSampleContext (default: SAMPLE_CONTEXT).
+def RebuildX86(insns, newImageBase, relaxBranches=False, ctx=None):
+	if ctx is None:
+		ctx = SAMPLE_CONTEXT
+
+	# VM positions of branches to encode as short branches
+	shortBranches = RelaxBranches(insns, ctx) if relaxBranches else set()
+
+	return LinkSegments([EmitSegment(insns, shortBranches, ctx)], newImageBase, ctx)
+
+if __name__ == "__main__":
+	# Optionally, -r to use short branch encodings wherever they fit (see 
+	# RelaxBranches), followed by either the number of worker processes with
+	# which to devirtualize the program one function at a time (see 
+	# ParallelDevirt), or -i to devirtualize only what changed since the last
+	# run with -i (see IncrementalDevirt).
+	args = sys.argv[1:]
+	relaxBranches = len(args) > 0 and args[0] == "-r"
+	if relaxBranches:
+		args = args[1:]
+	incremental = len(args) > 0 and args[0] == "-i"
+	processes = int(args[0]) if len(args) > 0 and not incremental else None
+	
+	if incremental:
+		from IncrementalDevirt import DevirtualizeIncremental
+		mcArr = DevirtualizeIncremental("Tmp/dec.bin", 0x500000, relaxBranches=relaxBranches, verbose=True, ctx=SAMPLE_CONTEXT)
+	elif processes is None:
+		# Disassemble and simplify VM bytecode program
+		newInsns = LoadSimplified("Tmp/dec.bin", ctx=SAMPLE_CONTEXT)
+		
+		# Devirtualize, new base address is 0x500000
+		mcArr = RebuildX86(newInsns, 0x500000, relaxBranches=relaxBranches, ctx=SAMPLE_CONTEXT)
+	else:
+		# Load the VM bytecode program; the workers simplify it
+		from ParallelDevirt import DevirtualizeParallel
+		from VMProgram import VMProgram
+		prog = VMProgram.FromFile("Tmp/dec.bin", SAMPLE_CONTEXT)
+		mcArr = DevirtualizeParallel(prog, 0x500000, relaxBranches=relaxBranches, processes=processes, ctx=SAMPLE_CONTEXT)
+	
+	# Write devirtualized code to file
+	with open("./Tmp/mc-take2.bin", "wb") as f:
+		f.write(mcArr)
@@ -1,9 +1,13 @@
 # Import x86 library stuff
 from Pandemic.X86.X86Encoder import X86Encoder
-from Pandemic.X86.X86Decoder import X86Decoder
-from Pandemic.X86.X86ByteStream import StreamObj
+from Pandemic.X86.X86Decoder import X86Decoder, X86CompiledDecoder
+from Pandemic.X86.X86DecodeCache import X86DecodeCache
+from Pandemic.X86.X86ByteStream import StreamObj, BufferStreamObj
 import Pandemic.X86.X86MetaData as XM
 import Pandemic.X86.X86 as X86
+import binascii
+import mmap
+import os
 
 #
 # File constants
@@ -49,7 +53,8 @@ def StoreDword(arr, pos, dword):
 
 # This comes in in Phase #4; this dictionary collects all RVAs
 # from VM instructions that specify imagebase fixups, so long
-# as those RVAs lie in the .text section
+# as those RVAs lie in the .text section. It is the fixup log
+# for DEFAULT_CONTEXT; other VMSampleContexts keep their own.
 from collections import defaultdict
 ALL_FIXED_UP_DWORDS = defaultdict(list)
 
@@ -69,17 +74,19 @@ def ApplyFixupSpecified(arr, FixupPos, SpecifiedFixup):
 # arr: array
 # FixupPos: position in array where DWORD begins
 # InsnPos: VM instruction offset
-def ApplyFixup(arr, FixupPos, InsnPos):
-	# Python scoping statement
-	global ALL_FIXED_UP_DWORDS
+# ctx: VMSampleContext supplying the imagebase and .text bounds, and 
+#      collecting the log (default: DEFAULT_CONTEXT)
+def ApplyFixup(arr, FixupPos, InsnPos, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
 	
 	# Extract DWORD, fix it up, write it back
-	FixedDword = ApplyFixupSpecified(arr, FixupPos, IMAGEBASE_FIXUP)
+	FixedDword = ApplyFixupSpecified(arr, FixupPos, ctx.ImageBase)
 	
 	# If the RVA (now a VA) is in the .text section,
 	# log it
-	if FixedDword >= TEXT_FUNCTION_BEGIN and FixedDword <= TEXT_FUNCTION_END:
-		ALL_FIXED_UP_DWORDS[FixedDword].append(InsnPos)
+	if FixedDword >= ctx.TextBegin and FixedDword <= ctx.TextEnd:
+		ctx.FixedUpDwords[FixedDword].append(InsnPos)
 
 
 # Enumerated register numbers, identical to x86 machine code internal ordering
@@ -197,15 +204,126 @@ INSN_NAME_PAIRS = [
 # Dictionary giving names to the VM instruction constants
 INSN_NAME_DICT = dict(INSN_NAME_PAIRS)
 
+# Small-integer tags classifying VM instructions by what they do to the 
+# scratch register, for use by the simplifier. Instructions that behave
+# identically for the simplifier's purposes share a tag (e.g., "MOV SCRATCH,
+# 0" and "MOV SCRATCH, IMM32" are both KIND_MOV_SCRATCH_IMM32), with the
+# differences normalized away into the Operand field.
+KIND_OTHER                = 0
+KIND_MOV_SCRATCH_IMM32    = 1
+KIND_MOV_SCRATCH_REG      = 2
+KIND_ADD_SCRATCH_REG      = 3
+KIND_ADD_SCRATCH_IMM32    = 4
+KIND_PUSH_SCRATCH         = 5
+KIND_MOV_REG_SCRATCH      = 6
+KIND_SHL_SCRATCH_IMM32    = 7
+KIND_MOV_PSCRATCH_REG     = 8
+KIND_MOV_PSCRATCH_IMM32   = 9
+KIND_MOV_SCRATCH_PSCRATCH = 10
+KIND_MOV_PIMM32_SCRATCH   = 11
+KIND_COUNT                = 12
+
+# Everything specific to one FinSpy sample: the configuration needed to 
+# decrypt and decode its VM program, the information about its virtualized
+# functions needed to devirtualize it, and the accumulators filled in while
+# doing so. Passing a context through the pipeline, rather than relying on
+# the module globals, allows several samples to be processed at once in one
+# process.
+# * xorVals:        the XOR key for the VM instructions
+# * imageBase:      the sample's base address
+# * textBegin/End:  bounds of the sample's .text section
+# * opcodeMap:      maps the sample's VM opcodes onto the INSN_* constants
+#                   (default: the identity, i.e., this sample's ordering)
+# * notVirtualized: addresses of X86CALLOUT targets that weren't virtualized
+# * vmEntries:      (key, VM entrypoint, prologue bytes) for each 
+#                   virtualized function
+# * fixedUpDwords:  the fixup log (default: a new one)
+class VMSampleContext(object):
+	def __init__(self, 
+		xorVals=xorVals, 
+		imageBase=IMAGEBASE_FIXUP, 
+		textBegin=TEXT_FUNCTION_BEGIN, 
+		textEnd=TEXT_FUNCTION_END, 
+		opcodeMap=None,
+		notVirtualized=(),
+		vmEntries=(),
+		fixedUpDwords=None):
+		self.XorVals   = xorVals
+		self.ImageBase = imageBase
+		self.TextBegin = textBegin
+		self.TextEnd   = textEnd
+		if opcodeMap is None:
+			opcodeMap = { opc:opc for opc in INSN_NAME_DICT }
+		self.OpcodeMap = opcodeMap
+		self.NotVirtualized = set(notVirtualized)
+		self.VMEntries = list(vmEntries)
+		
+		# This dictionary maps a VM key to its prologue bytes, if any
+		self.KeyToPrologueBytes = { x[0]:x[2] for x in self.VMEntries }
+
+		# This dictionary maps a virtualized function start address to its VM key
+		self.VMEntryToKey = { x[1]:x[0] for x in self.VMEntries }
+		
+		# This dictionary collects all RVAs from VM instructions that specify
+		# imagebase fixups, so long as those RVAs lie in the .text section
+		if fixedUpDwords is None:
+			fixedUpDwords = defaultdict(list)
+		self.FixedUpDwords = fixedUpDwords
+
+		# Cache of decoded x86 instructions. The raw x86 payloads repeat the
+		# same handful of instructions over and over. Misses go to the
+		# compiled decoder, which does the same job in about half the time.
+		self.DecodeCache = X86DecodeCache(X86CompiledDecoder(None))
+
+		# Likewise, the simplifier encodes the same few instructions over and
+		# over; this encoder remembers them.
+		self.Encoder = X86Encoder()
+
+	# Return a context with the same configuration, and empty accumulators 
+	# (and caches).
+	def Fresh(self):
+		return VMSampleContext(
+			self.XorVals,
+			self.ImageBase,
+			self.TextBegin,
+			self.TextEnd,
+			self.OpcodeMap,
+			self.NotVirtualized,
+			self.VMEntries)
+
+	# Translate one of the sample's VM opcodes into an INSN_* constant. An
+	# opcode that the sample's opcode map doesn't cover is an error.
+	def CanonicalOpcode(self, opcode):
+		canonical = self.OpcodeMap.get(opcode)
+		if canonical is None:
+			raise ValueError("VM opcode %#x is not in the sample's opcode map" % opcode)
+		return canonical
+
+	# Return the class of the VM instruction with one of the sample's VM
+	# opcodes.
+	def InsnClass(self, opcode):
+		return INSN_CONSTRUCTOR_DICT[self.CanonicalOpcode(opcode)]
+
+# The context used when none is specified. It describes this sample, and
+# its fixup log is ALL_FIXED_UP_DWORDS.
+DEFAULT_CONTEXT = VMSampleContext(fixedUpDwords=ALL_FIXED_UP_DWORDS)
+
 # Given an x86 instruction as objects in my x86 library, encode it into
 # machine code and return the array of bytes
-def EncodeInstruction(insn):
-	return X86Encoder().EncodeInstruction(insn)
+def EncodeInstruction(insn, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
+	return ctx.Encoder.EncodeInstruction(insn)
 
 # Base class for all FinSpy VM instruction types.
 class GenericInsn(object):
+	# The KIND_* tag for the instruction type, and its register number or
+	# constant operand, if it has one. Derived classes override these.
+	Kind    = KIND_OTHER
+	Operand = None
+
 	# A method for initializing specific subclasses
-	def SpecificInit(self):
+	def SpecificInit(self, ctx=None):
 		pass
 	
 	# This method performs the basic decoding that is common to all
@@ -214,22 +332,45 @@ class GenericInsn(object):
 	# turned out to be a useful design decision, as it centralizes
 	# this functionality to one location, allowing us to easily 
 	# monitor fixups (which turns out to be important).
-	def Init(self, bytes, pos):
+	#
+	# ctx is the VMSampleContext for the sample (default: DEFAULT_CONTEXT).
+	# The opcode is translated into the corresponding INSN_* constant.
+	def Init(self, bytes, pos, ctx=None):
+		if ctx is None:
+			ctx = DEFAULT_CONTEXT
 		self.Pos      = pos
 		self.Key      = ExtractDword(bytes, 0)
-		self.Opcode   = bytes[4]
+		self.Opcode   = ctx.CanonicalOpcode(bytes[4])
 		self.DataLen  = bytes[5]
 		self.Op1Fixup = bytes[6]
 		self.Op2Fixup = bytes[7]
 		self.Remainder = bytes[8:]
 		if self.Op1Fixup:
-			ApplyFixup(self.Remainder, self.Op1Fixup & 0x7F, self.Pos)
+			ApplyFixup(self.Remainder, self.Op1Fixup & 0x7F, self.Pos, ctx)
 		if self.Op2Fixup:
-			ApplyFixup(self.Remainder, self.Op2Fixup & 0x7F, self.Pos)
+			ApplyFixup(self.Remainder, self.Op2Fixup & 0x7F, self.Pos, ctx)
 
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
 	
+	# Construct an instruction of this class from fields that have already
+	# been extracted from the raw bytes, and whose fixups have already been
+	# applied (e.g., by a VMProgram container). Performs the decoding 
+	# specific to the class, but does not apply or log fixups a second time.
+	# The opcode should already be an INSN_* constant.
+	@classmethod
+	def FromFields(cls, pos, key, opcode, dataLen, op1Fixup, op2Fixup, remainder, ctx=None):
+		insn = cls.__new__(cls)
+		insn.Pos       = pos
+		insn.Key       = key
+		insn.Opcode    = opcode
+		insn.DataLen   = dataLen
+		insn.Op1Fixup  = op1Fixup
+		insn.Op2Fixup  = op2Fixup
+		insn.Remainder = remainder
+		insn.SpecificInit(ctx)
+		return insn
+
 	# Derived clasess should override this
 	def __str__(self):
 		return ""
@@ -238,7 +379,9 @@ class GenericInsn(object):
 class ConditionalBranch(GenericInsn):
 	
 	# Perform decoding common to all branch instructions.
-	def SpecificInit(self):
+	def SpecificInit(self, ctx=None):
+		if ctx is None:
+			ctx = DEFAULT_CONTEXT
 		
 		# VMTarget, if non-zero, is treated as a displacement
 		# from the current VM instruction's position
@@ -246,13 +389,13 @@ class ConditionalBranch(GenericInsn):
 		self.X86Target = None
 		if self.VMTarget == 0:
 			self.VMTarget = None
-			self.X86Target = ExtractDword(self.Remainder,5) + IMAGEBASE_FIXUP
+			self.X86Target = ExtractDword(self.Remainder,5) + ctx.ImageBase
 		else:
 			self.VMTarget = (self.Pos + self.VMTarget) & 0xFFFFFFFF
 	
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 	
 	# Print the destination. Also print the fallthrough address if not JMP
 	def __str__(self):
@@ -269,15 +412,10 @@ class ConditionalBranch(GenericInsn):
 # This function converts the machine code from Raw X86 instructions into 
 # strings for convenience in printing. In reality, none of the Raw X86
 # instructions contained more than one instruction, but oh well.
-def DecodeMulti(bytes, length):
-	d = X86Decoder(StreamObj(bytes))
-	start = 0
-	insns = []
-	while start < length:
-		i2container = d.Decode(start)
-		insns.append("%s" % i2container.instr)
-		start += i2container.length
-	return " // ".join(insns)
+def DecodeMulti(bytes, length, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
+	return " // ".join("%s" % insn for ea,insnLen,insn in ctx.DecodeCache.IterDecodeRange(bytes, 0, length))
 
 # This function disassembles the raw machine code for indirect jump instructions,
 # changes the instructions therein to indirect call instructions, re-assembles
@@ -285,13 +423,16 @@ def DecodeMulti(bytes, length):
 #
 # Input: bytes, an array of machine code for an indirect jump.
 # Output: a tuple (string: disassembly, bytes: machine code for indirect call)
-def ChangeJumpToCall(bytes):
+def ChangeJumpToCall(bytes, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
 
 	# Decode the x86 machine code
-	i2container = X86Decoder(StreamObj(bytes)).Decode(0)
+	ctx.DecodeCache.SetStream(BufferStreamObj(bytes))
+	insn,insnLen = ctx.DecodeCache.DecodeInstruction(0)
 
-	# Fetch the instruction from the decoded bundle
-	insn = i2container.instr
+	# The decoded instruction is shared with the cache; get our own copy
+	insn = insn.Thaw()
 
 	# Ensure it's an indirect jump!
 	assert(insn.mnem == XM.Jmp)
@@ -300,22 +441,22 @@ def ChangeJumpToCall(bytes):
 	insn.mnem = XM.Call
 
 	# Return new textual disassembly and machine code
-	return (str(insn),EncodeInstruction(insn))
+	return (str(insn),EncodeInstruction(insn, ctx))
 
 # This class describes "Call Indirect", a/k/a X86JUMPOUT instructions.
 class RawX86Jumpout(GenericInsn):
-	def SpecificInit(self):
+	def SpecificInit(self, ctx=None):
 		# Instruction data begins at self.Remainder[4:]
 		# Fixup should have been applied during decoding, though technically not mandatory
 		self.Instruction = self.Remainder[4:]
-		x86,insn = ChangeJumpToCall(self.Instruction)
+		x86,insn = ChangeJumpToCall(self.Instruction, ctx)
 		self.X86 = x86
 		self.Instruction = insn
 		self.DataLen = len(insn)
 		
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 
 	# Print the disassembly rather than the machine code
 	def __str__(self):
@@ -323,25 +464,27 @@ class RawX86Jumpout(GenericInsn):
 		
 # This class describes "Call Direct" a/k/a "X86CALLOUT" VM instructions.
 class RawX86Callout(GenericInsn):
-	def SpecificInit(self):
+	def SpecificInit(self, ctx=None):
+		if ctx is None:
+			ctx = DEFAULT_CONTEXT
 		# RVA begins at self.Remainder[4:]
-		self.X86Target = ExtractDword(self.Remainder, 4) + IMAGEBASE_FIXUP
+		self.X86Target = ExtractDword(self.Remainder, 4) + ctx.ImageBase
 		
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 		
 	def __str__(self):
 		return "%#08lx: X86CALLOUT %#08lx" % (self.Pos, self.X86Target)
 
 # This class describes "Raw X86" VM instructions.
 class RawX86StraightLine(GenericInsn):
-	def SpecificInit(self):
-		self.X86 = DecodeMulti(self.Remainder, self.DataLen)
+	def SpecificInit(self, ctx=None):
+		self.X86 = DecodeMulti(self.Remainder, self.DataLen, ctx)
 	
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 
 	# Print the disassembly instead of the machine code.
 	def __str__(self):
@@ -352,12 +495,13 @@ class RawX86StraightLine(GenericInsn):
 # common decoding here, then derive classes for specific instructions
 # in this family.
 class StackDisp32(GenericInsn):
-	def SpecificInit(self):
+	def SpecificInit(self, ctx=None):
 		self.Disp32 = ExtractDword(self.Remainder, 0)
+		self.Operand = self.Disp32
 	
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 	
 	# Common method for interpreting a register number as
 	# a string. Used by __str__ in derived classes.
@@ -372,18 +516,22 @@ class StackDisp32(GenericInsn):
 
 # Class describing "MOV SCRATCH, REG32" VM instructions, 32-bit displacement.
 class MovScratchDisp32(StackDisp32):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_MOV_SCRATCH_REG
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 	
 	def __str__(self):
 		return "%#08lx: MOV SCRATCH, %s" % (self.Pos, self._StackStr())
 	
 # Class describing "ADD SCRATCH, REG32" VM instructions.
 class AddScratchDisp32(StackDisp32):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_ADD_SCRATCH_REG
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 
 	def __str__(self):
 		return "%#08lx: ADD SCRATCH, %s" % (self.Pos, self._StackStr())
@@ -393,12 +541,13 @@ class AddScratchDisp32(StackDisp32):
 # common decoding here, then derive classes for specific instructions
 # in this family.
 class StackDisp8(GenericInsn):
-	def SpecificInit(self):
+	def SpecificInit(self, ctx=None):
 		self.Disp8 = self.Remainder[0]
+		self.Operand = self.Disp8
 	
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 
 	# Common method for interpreting a register number as
 	# a string. Used by __str__ in derived classes.
@@ -412,27 +561,33 @@ class StackDisp8(GenericInsn):
 
 # Class describing "MOV SCRATCH, REG32" VM instructions, 8-bit displacement.
 class MovScratchDisp8(StackDisp8):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_MOV_SCRATCH_REG
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 
 	def __str__(self):
 		return "%#08lx: MOV SCRATCH, %s" % (self.Pos, self._StackStr())
 
 # Class describing "MOV REG32, SCRATCH" VM instructions, 8-bit displacement.
 class MovDisp8Scratch(StackDisp8):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_MOV_REG_SCRATCH
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 
 	def __str__(self):
 		return "%#08lx: MOV %s, SCRATCH" % (self.Pos, self._StackStr())
 
 # Class describing "MOV [SCRATCH], REG32" VM instructions, 8-bit displacement.
 class MovPScratchDisp8(StackDisp8):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_MOV_PSCRATCH_REG
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 	def __str__(self):
 		return "%#08lx: MOV DWORD PTR [SCRATCH], %s" % (self.Pos, self._StackStr())
 	def ADT(self):
@@ -442,136 +597,216 @@ class MovPScratchDisp8(StackDisp8):
 # contains a DWORD constant value. We perform common decoding here, 
 # then derive classes for specific instructions in this family.
 class Imm32(GenericInsn):
-	def SpecificInit(self):
+	def SpecificInit(self, ctx=None):
 		self.Imm32 = ExtractDword(self.Remainder, 0)
+		self.Operand = self.Imm32
 	
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 
 # Class describing "SHL SCRATCH, IMM32" VM instructions.
 class ShlScratchImm32(Imm32):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_SHL_SCRATCH_IMM32
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 	def __str__(self):
 		return "%#08lx: SHL SCRATCH, %#08lx" % (self.Pos, self.Imm32)
 
 # Class describing "MOV [SCRATCH], IMM32" VM instructions.
 class MovPScratchImm32(Imm32):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_MOV_PSCRATCH_IMM32
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 	def __str__(self):
 		return "%#08lx: MOV DWORD PTR [SCRATCH], %#08lx" % (self.Pos, self.Imm32)
 
 # Class describing "MOV SCRATCH, IMM32" VM instructions.
 class MovScratchImm32(Imm32):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_MOV_SCRATCH_IMM32
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 	def __str__(self):
 		return "%#08lx: MOV SCRATCH, %#08lx" % (self.Pos, self.Imm32)
 
 # Class describing "MOV [IMM32], SCRATCH" VM instructions.
 class MovPImm32Scratch(Imm32):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_MOV_PIMM32_SCRATCH
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 	def __str__(self):
 		return "%#08lx: MOV DWORD PTR [%#08lx], SCRATCH" % (self.Pos, self.Imm32)
 
 # Class describing "ADD SCRATCH, IMM32" VM instructions.
 class AddScratchImm32(Imm32):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
-		self.SpecificInit()
+	Kind = KIND_ADD_SCRATCH_IMM32
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
+		self.SpecificInit(ctx)
 	def __str__(self):
 		return "%#08lx: ADD SCRATCH, %#08lx" % (self.Pos, self.Imm32)
 
 # Class describing "MOV SCRATCH, [SCRATCH]" VM instructions.
 class MovScratchPScratch(GenericInsn):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
+	Kind = KIND_MOV_SCRATCH_PSCRATCH
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
 	def __str__(self):
 		return "%#08lx: MOV SCRATCH, DWORD PTR [SCRATCH]" % self.Pos
 
 # Class describing "PUSH SCRATCH" VM instructions.
 class PushScratch(GenericInsn):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
+	Kind = KIND_PUSH_SCRATCH
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
 	def __str__(self):
 		return "%#08lx: PUSH SCRATCH" % self.Pos
 
 # Class describing "MOV SCRATCH, 0" VM instructions.
 class MovScratch0(GenericInsn):
-	def __init__(self, bytes, pos):
-		self.Init(bytes, pos)
+	Kind    = KIND_MOV_SCRATCH_IMM32
+	Operand = 0
+
+	def __init__(self, bytes, pos, ctx=None):
+		self.Init(bytes, pos, ctx)
 	def __str__(self):
 		return "%#08lx: MOV SCRATCH, 0" % self.Pos
 
-# Dictionary mapping VM opcode constants to constructors for the correct 
-# object type
+# Dictionary mapping VM opcode constants to the classes for the correct 
+# object type. The classes double as constructors.
 INSN_CONSTRUCTOR_PAIRS = [
-(INSN_JL                           , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JNC                          , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JC                           , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JNP                          , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JLE                          , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JBE                          , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JS                           , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JNO                          , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JNZ                          , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JNS                          , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JG                           , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JP                           , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JO                           , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JZ                           , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JA                           , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JGE                          , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-(INSN_JMP                          , lambda bytes, pos: ConditionalBranch(bytes, pos)),
-
-(INSN_X86_JUMPOUT                  , lambda bytes, pos: RawX86Jumpout(bytes, pos)),
-(INSN_RAWX862                      , lambda bytes, pos: RawX86StraightLine(bytes, pos)),
-(INSN_RAWX863                      , lambda bytes, pos: RawX86StraightLine(bytes, pos)),
-(INSN_X86_CALLOUT_RVA              , lambda bytes, pos: RawX86Callout(bytes, pos)),
-
-(INSN_LOAD_SCRATCH_FROM_REG32      , lambda bytes, pos: MovScratchDisp32(bytes, pos)),
-(INSN_ADD_REG_TO_SCRATCH           , lambda bytes, pos: AddScratchDisp32(bytes, pos)),
-
-(INSN_LOAD_SCRATCH_FROM_REG        , lambda bytes, pos: MovScratchDisp8(bytes, pos)),
-(INSN_STORE_SCRATCH_TO_REG         , lambda bytes, pos: MovDisp8Scratch(bytes, pos)),
-(INSN_WRITE_REG_TO_SCRATCH_PTR     , lambda bytes, pos: MovPScratchDisp8(bytes, pos)),
-
-(INSN_SHL_SCRATCH                  , lambda bytes, pos: ShlScratchImm32(bytes, pos)),
-(INSN_WRITE_IMM_TO_SCRATCH_PTR     , lambda bytes, pos: MovPScratchImm32(bytes, pos)),
-(INSN_LOAD_SCRATCH_FROM_IMM        , lambda bytes, pos: MovScratchImm32(bytes, pos)),
-(INSN_WRITE_SCRATCH_TO_IMM_PTR     , lambda bytes, pos: MovPImm32Scratch(bytes, pos)),
-(INSN_ADD_IMM_TO_SCRATCH           , lambda bytes, pos: AddScratchImm32(bytes, pos)),
-
-(INSN_LOAD_SCRATCH_FROM_SCRATCH_PTR, lambda bytes, pos: MovScratchPScratch(bytes, pos)),
-(INSN_PUSH_SCRATCH                 , lambda bytes, pos: PushScratch(bytes, pos)),
-(INSN_SET_SCRATCH_TO_ZERO          , lambda bytes, pos: MovScratch0(bytes, pos)),
+(INSN_JL                           , ConditionalBranch),
+(INSN_JNC                          , ConditionalBranch),
+(INSN_JC                           , ConditionalBranch),
+(INSN_JNP                          , ConditionalBranch),
+(INSN_JLE                          , ConditionalBranch),
+(INSN_JBE                          , ConditionalBranch),
+(INSN_JS                           , ConditionalBranch),
+(INSN_JNO                          , ConditionalBranch),
+(INSN_JNZ                          , ConditionalBranch),
+(INSN_JNS                          , ConditionalBranch),
+(INSN_JG                           , ConditionalBranch),
+(INSN_JP                           , ConditionalBranch),
+(INSN_JO                           , ConditionalBranch),
+(INSN_JZ                           , ConditionalBranch),
+(INSN_JA                           , ConditionalBranch),
+(INSN_JGE                          , ConditionalBranch),
+(INSN_JMP                          , ConditionalBranch),
+
+(INSN_X86_JUMPOUT                  , RawX86Jumpout),
+(INSN_RAWX862                      , RawX86StraightLine),
+(INSN_RAWX863                      , RawX86StraightLine),
+(INSN_X86_CALLOUT_RVA              , RawX86Callout),
+
+(INSN_LOAD_SCRATCH_FROM_REG32      , MovScratchDisp32),
+(INSN_ADD_REG_TO_SCRATCH           , AddScratchDisp32),
+
+(INSN_LOAD_SCRATCH_FROM_REG        , MovScratchDisp8),
+(INSN_STORE_SCRATCH_TO_REG         , MovDisp8Scratch),
+(INSN_WRITE_REG_TO_SCRATCH_PTR     , MovPScratchDisp8),
+
+(INSN_SHL_SCRATCH                  , ShlScratchImm32),
+(INSN_WRITE_IMM_TO_SCRATCH_PTR     , MovPScratchImm32),
+(INSN_LOAD_SCRATCH_FROM_IMM        , MovScratchImm32),
+(INSN_WRITE_SCRATCH_TO_IMM_PTR     , MovPImm32Scratch),
+(INSN_ADD_IMM_TO_SCRATCH           , AddScratchImm32),
+
+(INSN_LOAD_SCRATCH_FROM_SCRATCH_PTR, MovScratchPScratch),
+(INSN_PUSH_SCRATCH                 , PushScratch),
+(INSN_SET_SCRATCH_TO_ZERO          , MovScratch0),
 
 ]
 
 # Dictionary mapping VM opcode constants to constructors
 INSN_CONSTRUCTOR_DICT = dict(INSN_CONSTRUCTOR_PAIRS)
 
-# Badly named main disassembler function. Given a filename, read one VM
-# instruction's raw bytes at a time, decrypt via XOR, construct the right
-# Python object, and yield it. This is a generator which loops over the
-# whole file.
-def bytes_from_file(filename):
-	pos = 0
+# Build the XOR mask for a single VM instruction record. The preamble
+# (the key) is not encrypted, so its mask bytes are zero; the remainder
+# of the record is XORed with the key bytes, tiled every four bytes.
+def MakeRecordMask(xorVals):
+	mask = bytearray(INSN_DESC_SIZE)
+	for i in xrange(PREAMBLE_SKIP,INSN_DESC_SIZE):
+		mask[i] = xorVals[i % 4]
+	return mask
+
+# Decrypt an entire VM program image in one pass. Rather than XORing
+# one byte at a time, we convert the image and a mask (the per-record
+# mask repeated once per record) into two big integers, XOR those, and
+# convert the result back into bytes. All of the per-byte work happens
+# inside the interpreter's C code. Any trailing partial record is
+# ignored. Returns a bytearray holding the decrypted records.
+def DecryptImage(data, xorVals=xorVals):
+	numRecords = len(data) // INSN_DESC_SIZE
+	if numRecords == 0:
+		return bytearray()
+	imageLen = numRecords * INSN_DESC_SIZE
+	hexData = binascii.hexlify(buffer(data, 0, imageLen))
+	hexMask = binascii.hexlify(str(MakeRecordMask(xorVals)) * numRecords)
+	decrypted = int(hexData, 16) ^ int(hexMask, 16)
+	return bytearray(binascii.unhexlify("%0*x" % (len(hexData), decrypted)))
+
+# Memory-map a VM program file and decrypt the whole thing at once.
+# Returns a bytearray holding the decrypted records.
+def LoadVMImage(filename, xorVals=xorVals):
+	with open(filename, "rb") as f:
+		# mmap refuses to map empty files
+		if os.fstat(f.fileno()).st_size == 0:
+			return bytearray()
+		m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			return DecryptImage(m, xorVals)
+		finally:
+			m.close()
+
+# Construct the Python objects for every VM instruction in a decrypted
+# image, in order. The instruction constructors modify the record when
+# they apply fixups, so each one gets its own bytearray slice (the image
+# itself is left untouched). If the image is a piece of a larger program,
+# basePos gives the position of the piece within the program.
+def insns_from_image(image, basePos=0, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
+	for pos in xrange(0, len(image) - INSN_DESC_SIZE + 1, INSN_DESC_SIZE):
+		chunk = image[pos:pos+INSN_DESC_SIZE]
+		yield ctx.InsnClass(chunk[4])(chunk, basePos+pos, ctx)
+
+# Number of VM instruction records that bytes_from_file reads and decrypts
+# at a time.
+STREAM_BLOCK_RECORDS = 0x1000
+
+# Read and decrypt a VM program file a block of blockRecords records at a
+# time, and yield (block, pos) for each, where block is a bytearray of the
+# decrypted records and pos is its position within the file. Any trailing
+# partial record is ignored, as by DecryptImage.
+def VMImageBlocks(filename, xorVals=xorVals, blockRecords=STREAM_BLOCK_RECORDS):
 	with open(filename, "rb") as f:
+		pos = 0
 		while True:
-			chunk = f.read(INSN_DESC_SIZE)
-			if chunk:
-				chunk = map(ord, chunk)
-				for i in xrange(PREAMBLE_SKIP,INSN_DESC_SIZE):
-					chunk[i] ^= xorVals[i % 4]
-				yield INSN_CONSTRUCTOR_DICT[chunk[4]](chunk, pos)
-				pos += INSN_DESC_SIZE
-			else:
-				break
+			data = f.read(blockRecords * INSN_DESC_SIZE)
+			block = DecryptImage(data, xorVals)
+			if len(block) == 0:
+				return
+			yield (block, pos)
+			pos += len(block)
+
+# Badly named main disassembler function. Given a filename, read and 
+# decrypt the file one block at a time, construct the right Python object
+# for each VM instruction, and yield it. This is a generator which loops 
+# over the whole file, holding no more than one block of it in memory.
+def bytes_from_file(filename, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
+	for block,pos in VMImageBlocks(filename, ctx.XorVals):
+		for insn in insns_from_image(block, pos, ctx):
+			yield insn
@@ -0,0 +1,174 @@
+# Devirtualize a FinSpy VM program incrementally: remember, from one run to
+# the next, what each piece of each function (see ParallelDevirt) turned
+# into, and only redo the work for the pieces whose inputs changed.
+#
+# Each piece goes through two cached steps:
+# * Simplification, keyed by a hash of the piece's raw VM instructions, of
+#   the decoding configuration (VMCache.DecodeConfigHash), and of the code
+#   of SimplifyStream other than its 2-instruction rules (VMCache.CodeHash).
+#   Each result also records the code hashes of the rules that were called
+#   while simplifying the piece, and is only reused if none of them changed.
+# * Emission (EmitSegment), keyed by a hash of the simplified instructions,
+#   of the parts of the VMSampleContext that EmitSegment reads for them
+#   (prologue bytes of the piece's function entries, and which callout
+#   targets are not virtualized), of the piece's short branches, and of the
+#   code of EmitSegment and X86Emitter.
+# Keying emission by the simplified code means that a change to one rule of
+# the simplifier only re-simplifies the pieces that called it, and only 
+# re-emits the pieces whose simplified code changed; a change to one 
+# function's prologue only re-emits that function's entry.
+# The segments are then linked as usual, which is cheap; the partition of
+# the program into pieces is cached as well.
+#
+# The cache is a single marshal file per input file, which holds exactly
+# the entries that the last run used.
+from FinSpyVM import *
+from Simplify import Simplify, SimplifyStream, SIMPLIFY_PAIR_RULES
+from VMCache import CodeHash, DecodeConfigHash, InputHash, SerializeInsns, DeserializeInsns, LoadEntry, StoreEntry, CACHE_DIR_NAME
+from VMProgram import VMProgram
+from VMCFG import VMCFG
+from ParallelDevirt import FunctionPieces
+from Devirtualize2 import DevirtualizedSegment, EmitSegment, LinkSegments, RelaxBranches, SAMPLE_CONTEXT
+import hashlib
+import marshal
+import os
+
+# Version of the incremental cache file format
+INCREMENTAL_FORMAT_VERSION = 2
+
+# Get the name of the incremental cache for the input file. Unlike the
+# entries of VMCache, it isn't named by the hashes of its inputs, since it
+# remains useful when those change.
+def IncrementalCachePath(filename, cacheDir=None):
+	if cacheDir is None:
+		cacheDir = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR_NAME)
+	return os.path.join(cacheDir, "%s.devirt" % os.path.basename(filename))
+
+def Hash(*parts):
+	h = hashlib.sha1()
+	for part in parts:
+		h.update(part)
+	return h.hexdigest()
+
+# What EmitSegment needs to know about a simplified piece, other than its
+# instructions: the keys of its instructions, the targets of its callouts,
+# and the positions of its branches.
+def PieceInfo(insns):
+	keys = [ i.Key for i in insns ]
+	callouts = [ i.X86Target for i in insns if isinstance(i,RawX86Callout) ]
+	branches = [ i.Pos for i in insns if isinstance(i,ConditionalBranch) ]
+	return (keys, callouts, branches)
+
+# Hash the parts of ctx that EmitSegment reads for a piece with info.
+def EmitContextHash(info, ctx):
+	keys,callouts,branches = info
+	prologues = [ (key,tuple(ctx.KeyToPrologueBytes[key])) for key in keys if key in ctx.KeyToPrologueBytes ]
+	notVirtualized = [ target in ctx.NotVirtualized for target in callouts ]
+	return Hash(repr((prologues, notVirtualized)))
+
+# Devirtualize the VM program in filename, as RebuildX86 would after
+# LoadSimplified, reusing what can be reused from the last run, and return
+# the array of x86 machine code bytes. The imagebase fixups are added to the
+# fixup log of ctx (default: SAMPLE_CONTEXT), as when loading the program.
+# * relaxBranches: use short branch encodings wherever they fit. Which
+#   branches fit depends upon the whole program, so whenever any piece
+#   changes, this takes a pass over all of the simplified code.
+# * verbose: print how many pieces were simplified and emitted afresh
+def DevirtualizeIncremental(filename, newImageBase, relaxBranches=False, cacheDir=None, verbose=False, ctx=None):
+	if ctx is None:
+		ctx = SAMPLE_CONTEXT
+	path = IncrementalCachePath(filename, cacheDir)
+	entry = LoadEntry(path)
+	if entry is None or entry[0] != INCREMENTAL_FORMAT_VERSION:
+		entry = (INCREMENTAL_FORMAT_VERSION, None, None, {}, {}, None)
+	version,oldPartitionKey,oldPieces,oldSimplified,oldSegments,oldRelaxed = entry
+
+	# Hash the code that each step runs.
+	configHash = DecodeConfigHash(ctx)
+	simplifyHash = CodeHash(SimplifyStream, exclude=SIMPLIFY_PAIR_RULES)
+	ruleHashes = { f.__name__:CodeHash(f) for f in SIMPLIFY_PAIR_RULES }
+	emitHash = CodeHash(EmitSegment, modules=["X86Emitter"])
+
+	# Load the program, and partition it into pieces. The partition only
+	# depends upon the input, the decoding configuration, which keys begin
+	# functions, and the code that builds the CFG and splits it up.
+	prog = VMProgram.FromFile(filename, ctx)
+	partitionKey = Hash(InputHash(filename), configHash, repr(sorted(ctx.KeyToPrologueBytes)), CodeHash(VMCFG), CodeHash(FunctionPieces))
+	if partitionKey == oldPartitionKey:
+		pieces = oldPieces
+	else:
+		pieces = [ (begin,end) for f,begin,end in FunctionPieces(VMCFG(prog, ctx)) ]
+
+	# Simplify the pieces that we haven't seen before, or that called a rule
+	# whose code has changed since. Each entry of simplified holds the hash 
+	# of the simplified code, the code itself (serialized), its PieceInfo,
+	# and the names and code hashes of the rules that it called.
+	simplified = dict()
+	rawKeys = []
+	numSimplified = 0
+	insnsCache = dict()
+	for begin,end in pieces:
+		columns = prog.Columns(begin, end)
+		rawKey = Hash(configHash, simplifyHash, *[ c.tostring() if hasattr(c,'tostring') else str(c) for c in columns ])
+		rawKeys.append(rawKey)
+		if rawKey in simplified:
+			continue
+		old = oldSimplified.get(rawKey)
+		if old is not None and all(ruleHashes.get(name) == h for name,h in old[3]):
+			simplified[rawKey] = old
+			continue
+		usedRules = set()
+		insns = Simplify(list(VMProgram.FromColumns(columns, ctx)), ctx, usedRules)
+		serialized = SerializeInsns(insns)
+		rules = sorted((f.__name__,ruleHashes[f.__name__]) for f in usedRules)
+		simplified[rawKey] = (Hash(marshal.dumps(serialized)), serialized, PieceInfo(insns), rules)
+		insnsCache[rawKey] = insns
+		numSimplified += 1
+
+	def PieceInsns(rawKey):
+		if rawKey not in insnsCache:
+			insnsCache[rawKey] = DeserializeInsns(simplified[rawKey][1])
+		return insnsCache[rawKey]
+
+	emitKeys = [ Hash(simplified[rawKey][0], EmitContextHash(simplified[rawKey][2], ctx), emitHash) for rawKey in rawKeys ]
+
+	# Choose the short branches, unless nothing that the choice depends upon
+	# has changed.
+	shortBranches = frozenset()
+	relaxed = None
+	if relaxBranches:
+		relaxKey = Hash(CodeHash(RelaxBranches, modules=["X86Emitter"]), *emitKeys)
+		if oldRelaxed is not None and oldRelaxed[0] == relaxKey:
+			relaxed = oldRelaxed
+		else:
+			allInsns = []
+			for rawKey in rawKeys:
+				allInsns.extend(PieceInsns(rawKey))
+			relaxed = (relaxKey, sorted(RelaxBranches(allInsns, ctx)))
+		shortBranches = frozenset(relaxed[1])
+
+	# Emit the pieces that we haven't seen before, and link everything.
+	segments = dict()
+	segs = []
+	numEmitted = 0
+	for rawKey,emitKey in zip(rawKeys, emitKeys):
+		branches = simplified[rawKey][2][2]
+		segKey = Hash(emitKey, repr([ pos for pos in branches if pos in shortBranches ]))
+		if segKey in segments:
+			serialized = segments[segKey]
+		elif segKey in oldSegments:
+			serialized = segments[segKey] = oldSegments[segKey]
+		else:
+			serialized = segments[segKey] = EmitSegment(PieceInsns(rawKey), shortBranches, ctx).Serialize()
+			numEmitted += 1
+		segs.append(DevirtualizedSegment.Deserialize(serialized))
+	mcCode = LinkSegments(segs, newImageBase, ctx)
+
+	if verbose:
+		print "Simplified %d and emitted %d of %d pieces" % (numSimplified, numEmitted, len(pieces))
+
+	# Remember what this run used, if anything changed.
+	newEntry = (INCREMENTAL_FORMAT_VERSION, partitionKey, pieces, simplified, segments, relaxed)
+	if numSimplified or numEmitted or partitionKey != oldPartitionKey or relaxed != oldRelaxed or len(simplified) != len(oldSimplified) or len(segments) != len(oldSegments):
+		StoreEntry(path, newEntry)
+	return mcCode
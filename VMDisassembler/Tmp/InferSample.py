@@ -0,0 +1,290 @@
+# Infer the configuration that a new FinSpy sample's VM program needs,
+# rather than rediscovering it by hand: the XOR key for its VM instruction
+# records, and the numbering of its VM opcodes (a VMSampleContext's xorVals
+# and opcodeMap).
+#
+# Both rely upon the fixed structure of the 0x18-byte records: a plaintext
+# key, then the opcode, DataLen, and two fixup bytes, then 16 bytes of
+# operands, which are mostly zero. Rather than looking at one record at a
+# time, we look at whole columns of the file at once (the same byte or
+# DWORD of every record, which is an extended slice), decrypt candidates 
+# with DecryptImage, and count with str.count and str.translate, so that
+# most of the per-byte work happens in the interpreter's C code.
+#
+# * XOR key: the operand bytes are mostly zero, so the most common
+#   encrypted value among the bytes XORed with each key byte is probably
+#   that key byte. The most likely few candidates for each key byte are
+#   checked for consistency with the record structure over the whole file:
+#   DataLen must be a plausible x86 instruction length, fixup bytes must
+#   point within the operands, and some records (the branches) must hold
+#   displacements to the beginnings of other records.
+# * Opcode map: each opcode's records are summarized by a few statistics of
+#   their operands (e.g., how many hold x86 machine code, a VM branch
+#   target, an RVA within .text, or a register number), and matched to the
+#   INSN_* constant whose records have the most similar statistics in a
+#   reference program whose opcode map is known (by default, this sample).
+#   Opcodes whose records look alike (the various Jcc, for instance) can't
+#   be told apart this way; the proposal says which ones are ambiguous, and
+#   those need to be confirmed by looking at their handlers.
+from FinSpyVM import *
+from array import array
+import itertools
+import math
+import sys
+
+# Longest possible x86 instruction
+MAX_X86_INSN_LEN = 15
+
+# Fixup bytes hold the offset, within the 16 bytes of operands, of a DWORD
+# to fix up, possibly with the high bit set.
+MAX_FIXUP_OFFSET = INSN_DESC_SIZE - 8 - 4
+
+# How well a key must do on the structure checks to be accepted outright
+MIN_CHECK_FRACTION = 0.99
+
+# Truncate data to a whole number of records, as a string.
+def WholeRecords(data):
+	return str(buffer(data, 0, (len(data) // INSN_DESC_SIZE) * INSN_DESC_SIZE))
+
+# The byte at offset off of every record, as a string.
+def Column(data, off):
+	return data[off::INSN_DESC_SIZE]
+
+# The little-endian DWORD at offset off of every record, as an array. The
+# DWORDs at the same offset of consecutive records are INSN_DESC_SIZE/4
+# DWORDs apart in the data beginning at off.
+def DwordColumn(data, off):
+	buf = data[off:off + len(data) - INSN_DESC_SIZE + 4]
+	return array('I', buf)[::INSN_DESC_SIZE/4]
+
+# The number of occurrences of each byte value within s
+def Histogram(s):
+	return [ s.count(chr(b)) for b in xrange(256) ]
+
+# The number of bytes within s that are in the set chars (a string)
+def CountIn(s, chars):
+	return len(s) - len(s.translate(None, chars))
+
+# Does each record of a decrypted image hold a VM branch displacement,
+# i.e., a DWORD at Remainder[1] that leads from the record to the
+# beginning of another record? Returns a list of bools.
+def BranchTargetFlags(image):
+	imageLen = len(image)
+	return [ disp != 0 and (pos + disp) & 0xFFFFFFFF < imageLen and disp % INSN_DESC_SIZE == 0
+		for pos,disp in itertools.izip(xrange(0, imageLen, INSN_DESC_SIZE), DwordColumn(image, 9)) ]
+
+# Check a decrypted image against the record structure. Returns a dict
+# of the fraction of records that pass each check:
+# * DataLen: DataLen is at most the length of an x86 instruction
+# * Fixups:  both fixup bytes point within the operands
+# * BranchTargets: the record holds a VM branch displacement. Only a few
+#   records are branches, but with the wrong key, hardly any would be.
+def CheckImage(image):
+	image = WholeRecords(image)
+	numRecords = len(image) // INSN_DESC_SIZE
+	if numRecords == 0:
+		return { "DataLen":0.0, "Fixups":0.0, "BranchTargets":0.0 }
+	validFixups = "".join(chr(b) for b in xrange(256) if (b & 0x7F) <= MAX_FIXUP_OFFSET)
+	numFixups = CountIn(Column(image, 6), validFixups) + CountIn(Column(image, 7), validFixups)
+	return {
+		"DataLen":       float(CountIn(Column(image, 5), "".join(chr(b) for b in xrange(MAX_X86_INSN_LEN+1)))) / numRecords,
+		"Fixups":        float(numFixups) / (2*numRecords),
+		"BranchTargets": float(sum(BranchTargetFlags(image))) / numRecords,
+	}
+
+# Does a key pass the checks in CheckImage?
+def ChecksPass(checks):
+	return checks["DataLen"] >= MIN_CHECK_FRACTION and checks["Fixups"] >= MIN_CHECK_FRACTION and checks["BranchTargets"] > 0
+
+# Recover the XOR key for the encrypted VM program data. Tries the
+# numCandidates most likely values of each key byte, most likely keys first.
+# Returns a tuple of the key (as xorVals), and the results of CheckImage for
+# it. If no key passes the checks, returns the one that did best.
+def RecoverXorKey(data, numCandidates=3):
+	data = WholeRecords(data)
+
+	# Candidates for each key byte, by frequency within its columns. The
+	# opcode column is left out, as opcodes aren't mostly zero.
+	candidates = []
+	for j in xrange(4):
+		encrypted = "".join(Column(data, off) for off in xrange(PREAMBLE_SKIP+1, INSN_DESC_SIZE) if off % 4 == j)
+		hist = Histogram(encrypted)
+		candidates.append(sorted(xrange(256), key=lambda b: -hist[b])[:numCandidates])
+
+	# Try the combinations of candidates, the most likely ones first.
+	ranks = sorted(itertools.product(xrange(numCandidates), repeat=4), key=lambda r: (sum(r), r))
+	best = None
+	for r in ranks:
+		key = [ candidates[j][r[j]] for j in xrange(4) ]
+		checks = CheckImage(DecryptImage(data, key))
+		if ChecksPass(checks):
+			return key,checks
+		score = (checks["DataLen"] + checks["Fixups"], checks["BranchTargets"])
+		if best is None or score > best[0]:
+			best = (score, key, checks)
+	return best[1],best[2]
+
+# Names of the statistics in OpcodeStatistics, and the weight of each in
+# the distance between two opcodes.
+STATISTIC_WEIGHTS = [
+	("Frequency", 0.5), # log of the share of records, scaled to [0,1]
+	("X86",       1.0), # DataLen is non-zero
+	("Fixup",     1.0), # Op1Fixup is non-zero
+	("Branch",    1.0), # holds a VM branch displacement
+	("Callout",   1.0), # Remainder[4:8] is an RVA within .text
+	("Jumpout",   1.0), # Remainder[4] is 0xFF, as in an indirect JMP
+	("Register",  1.0), # Remainder[0:4] is a register number (0-7)
+	("Imm32",     1.0), # Remainder[0:4] is something larger
+	("Empty",     1.0), # the operands are all zero
+]
+
+# Summarize the records with each opcode in a decrypted image. Returns a
+# dict mapping each opcode that occurs to a tuple of the opcode's share of
+# the records, and a list of statistics as in STATISTIC_WEIGHTS. ctx gives
+# the bounds of .text and the imagebase (default: DEFAULT_CONTEXT).
+def OpcodeStatistics(image, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
+	image = WholeRecords(image)
+	numRecords = len(image) // INSN_DESC_SIZE
+	columns = [
+		Column(image, 4),
+		Column(image, 5),
+		Column(image, 6),
+		BranchTargetFlags(image),
+		DwordColumn(image, 12),
+		Column(image, 12),
+		DwordColumn(image, 8),
+		DwordColumn(image, 16),
+		DwordColumn(image, 20),
+	]
+	textBegin,textEnd = ctx.TextBegin-ctx.ImageBase,ctx.TextEnd-ctx.ImageBase
+	sums = dict()
+	for op,dataLen,fixup,branch,dw4,b4,dw0,dw8,dw12 in itertools.izip(*columns):
+		s = sums.get(op)
+		if s is None:
+			s = sums[op] = [0]*len(STATISTIC_WEIGHTS)
+		s[0] += 1
+		s[1] += dataLen != "\0"
+		s[2] += fixup != "\0"
+		s[3] += branch
+		s[4] += textBegin <= dw4 < textEnd
+		s[5] += b4 == "\xFF"
+		s[6] += dw0 <= 7
+		s[7] += dw0 > 7
+		s[8] += (dw0 | dw4 | dw8 | dw12) == 0
+
+	res = dict()
+	for op,s in sums.iteritems():
+		n = float(s[0])
+		share = n / numRecords
+		frequency = 1.0 + math.log(share, 2) / math.log(max(numRecords, 2), 2)
+		res[ord(op)] = (share, [frequency] + [ x / n for x in s[1:] ])
+	return res
+
+# Weighted distance between two lists of statistics
+def StatisticDistance(a, b):
+	return sum(w * abs(x - y) for (name,w),x,y in zip(STATISTIC_WEIGHTS, a, b))
+
+# The statistics of an opcode with n records are only good to within about
+# SUPPORT_NOISE/sqrt(n), the largest standard error of a proportion of n.
+SUPPORT_NOISE = 0.5
+
+# Opcodes with fewer records than this could just as well be any INSN_*
+# constant, of the same instruction class as the one chosen, that the 
+# reference image doesn't contain.
+MIN_SUPPORT_RECORDS = 16
+
+# Propose an opcode map for a decrypted image, by matching each of its
+# opcodes to the INSN_* constant with the most similar statistics in the
+# decrypted reference image refImage, whose opcode map is refCtx.OpcodeMap.
+# ctx and refCtx also give the bounds of .text for the two samples.
+# The opcodes are matched one-to-one, closest pairs first. Returns a tuple
+# of the opcode map, and a list of (opcode, share of records, INSN_*
+# constant, distance, ambiguous) tuples, where ambiguous lists the other
+# INSN_* constants nearly as close to the opcode as the one chosen: within
+# margin, widened by SUPPORT_NOISE for the fewer records of the opcode and
+# of the chosen constant in the reference, and including the constants that
+# can't be ruled out for lack of records (see MIN_SUPPORT_RECORDS).
+def InferOpcodeMap(image, refImage, refCtx=None, ctx=None, margin=0.05):
+	if refCtx is None:
+		refCtx = DEFAULT_CONTEXT
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
+	stats = OpcodeStatistics(image, ctx)
+	refStats = dict()
+	for opc,st in OpcodeStatistics(refImage, refCtx).iteritems():
+		if opc in refCtx.OpcodeMap:
+			refStats[refCtx.OpcodeMap[opc]] = st
+
+	numRecords = len(image) // INSN_DESC_SIZE
+	numRefRecords = len(refImage) // INSN_DESC_SIZE
+	unseen = [ insn for insn in INSN_CONSTRUCTOR_DICT if insn not in refStats ]
+
+	distances = dict()
+	for opc,(share,st) in stats.iteritems():
+		for insn,(refShare,refSt) in refStats.iteritems():
+			distances[(opc,insn)] = StatisticDistance(st, refSt)
+
+	opcodeMap = dict()
+	used = set()
+	for (opc,insn),dist in sorted(distances.iteritems(), key=lambda x: (x[1], x[0])):
+		if opc in opcodeMap or insn in used:
+			continue
+		opcodeMap[opc] = insn
+		used.add(insn)
+
+	report = []
+	for opc in sorted(stats):
+		insn = opcodeMap.get(opc)
+		if insn is None:
+			report.append((opc, stats[opc][0], None, None, []))
+			continue
+		dist = distances[(opc,insn)]
+		support = min(stats[opc][0] * numRecords, refStats[insn][0] * numRefRecords)
+		tolerance = margin + SUPPORT_NOISE / math.sqrt(max(support, 1.0))
+		ambiguous = [ other for other in refStats if other != insn and distances[(opc,other)] <= dist + tolerance ]
+		if stats[opc][0] * numRecords < MIN_SUPPORT_RECORDS:
+			ambiguous.extend(other for other in unseen if INSN_CONSTRUCTOR_DICT[other] is INSN_CONSTRUCTOR_DICT[insn])
+		report.append((opc, stats[opc][0], insn, dist, sorted(ambiguous)))
+	return opcodeMap,report
+
+# Infer the XOR key and opcode map for the VM program in filename, with
+# refFilename (decrypted with refCtx, default DEFAULT_CONTEXT) as the
+# reference program. The sample's imagebase and .text bounds can't be
+# inferred from the VM program, so they're passed along as in
+# VMSampleContext. Returns a tuple of a VMSampleContext for the sample, the
+# results of CheckImage for the key, and the report from InferOpcodeMap.
+# The context's opcode map only covers the opcodes that occur in the
+# sample, which is all that decoding and simplifying it need.
+def InferSampleContext(filename, refFilename, refCtx=None, imageBase=IMAGEBASE_FIXUP, textBegin=TEXT_FUNCTION_BEGIN, textEnd=TEXT_FUNCTION_END):
+	if refCtx is None:
+		refCtx = DEFAULT_CONTEXT
+	with open(filename, "rb") as f:
+		data = f.read()
+	key,checks = RecoverXorKey(data)
+	ctx = VMSampleContext(key, imageBase, textBegin, textEnd)
+	opcodeMap,report = InferOpcodeMap(DecryptImage(data, key), LoadVMImage(refFilename, refCtx.XorVals), refCtx, ctx)
+	ctx.OpcodeMap = opcodeMap
+	return ctx,checks,report
+
+if __name__ == "__main__":
+	if len(sys.argv) not in (2, 3):
+		print "Usage: %s <VM program file> [reference VM program file]" % sys.argv[0]
+		sys.exit()
+	refFilename = sys.argv[2] if len(sys.argv) > 2 else "Tmp/dec.bin"
+	ctx,checks,report = InferSampleContext(sys.argv[1], refFilename)
+
+	print "xorVals = [%s]" % ", ".join("%#04x" % k for k in ctx.XorVals)
+	for name in sorted(checks):
+		print "  %-14s %6.2f%%" % (name, 100.0 * checks[name])
+	print "opcodeMap = {"
+	for opc,share,insn,dist,ambiguous in report:
+		if insn is None:
+			print "\t# %#04x: %5.2f%% no match" % (opc, 100.0 * share)
+			continue
+		line = "\t%#04x: %#04x, # %-29s %5.2f%%, distance %.3f" % (opc, insn, INSN_NAME_DICT[insn], 100.0 * share, dist)
+		if ambiguous:
+			line += "; or " + ", ".join(INSN_NAME_DICT[a] for a in ambiguous)
+		print line
+	print "}"
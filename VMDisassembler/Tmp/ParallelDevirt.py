@@ -0,0 +1,116 @@
+# Devirtualize a FinSpy VM program one function at a time, across a pool of
+# worker processes. The VM control-flow graph (see VMCFG) assigns every
+# basic block to a function. Each function's blocks form one or more runs
+# of consecutive VM instructions ("pieces"), which a worker simplifies and
+# devirtualizes into DevirtualizedSegments independently of the rest of the
+# program. The segments are then linked in program order, which resolves
+# the branches, calls, and function pointers that cross between them. The
+# layout is therefore the same as devirtualizing the whole program at once,
+# however the work was divided up.
+from FinSpyVM import *
+from Simplify import Simplify
+from VMCache import SerializeInsns, DeserializeInsns
+from VMProgram import VMProgram
+from VMCFG import VMCFG
+from Devirtualize2 import EmitSegment, LinkSegments, RelaxBranches, SAMPLE_CONTEXT
+import multiprocessing
+
+# Split the program that cfg describes into pieces: maximal runs of blocks
+# belonging to the same function. Returns a list of (function, first
+# instruction index, last instruction index + 1) triples in program order.
+# Code before the first function's entry belongs to function -1.
+def FunctionPieces(cfg):
+	pieces = []
+	for b in xrange(cfg.NumBlocks()):
+		f = cfg.BlockFunc[b]
+		if pieces and pieces[-1][0] == f:
+			pieces[-1][2] = cfg.BlockStart[b+1]
+		else:
+			pieces.append([f, cfg.BlockStart[b], cfg.BlockStart[b+1]])
+	return [ tuple(p) for p in pieces ]
+
+# Get the VM instructions of a piece, as handed to a worker by 
+# DevirtualizeParallel: either the Columns of a VMProgram, or a list of
+# instructions serialized with SerializeInsns.
+def PieceInsns(piece, fromColumns, ctx):
+	if fromColumns:
+		return list(VMProgram.FromColumns(piece, ctx))
+	return DeserializeInsns(piece)
+
+# Worker: process the pieces of one function. args holds:
+# * pieces: the VM instructions of each piece (see PieceInsns)
+# * fromColumns: whether the pieces are VMProgram columns
+# * simplify: whether to simplify the pieces first
+# * shortBranches: the VM positions of the branches to encode as short
+#   branches, or None to return the simplified pieces (serialized) rather
+#   than devirtualizing them
+# * ctx: the VMSampleContext for the sample
+# Returns a list with one result per piece.
+def DevirtualizeFunction(args):
+	pieces,fromColumns,simplify,shortBranches,ctx = args
+	res = []
+	for piece in pieces:
+		insns = PieceInsns(piece, fromColumns, ctx)
+		if simplify:
+			insns = Simplify(insns, ctx)
+		if shortBranches is None:
+			res.append(SerializeInsns(insns))
+		else:
+			res.append(EmitSegment(insns, shortBranches, ctx))
+	return res
+
+# Given: insns, a VMProgram or a list of FinSpy VM instructions, as 
+# disassembled (or already simplified, if simplify is False)
+# Devirtualize the program as RebuildX86 would, with one job per function,
+# and return the array of x86 machine code bytes.
+# * relaxBranches: use short branch encodings wherever they fit. This takes
+#   a second round of jobs, as the choice depends upon the simplified code
+#   of the whole program.
+# * processes: number of workers (default: one per CPU)
+# * ctx: the VMSampleContext for the sample (default: SAMPLE_CONTEXT)
+def DevirtualizeParallel(insns, newImageBase, relaxBranches=False, simplify=True, processes=None, ctx=None):
+	if ctx is None:
+		ctx = SAMPLE_CONTEXT
+
+	# Partition the program, and group the pieces by function. Functions are
+	# handed out in order of their entries, so the jobs don't depend upon
+	# anything but the program.
+	cfg = VMCFG(insns, ctx)
+	pieces = FunctionPieces(cfg)
+	fromColumns = isinstance(insns, VMProgram)
+	if fromColumns:
+		pieceInsns = [ insns.Columns(begin, end) for f,begin,end in pieces ]
+	else:
+		pieceInsns = [ SerializeInsns(insns[begin:end]) for f,begin,end in pieces ]
+	funcPieces = dict()
+	for idx,(f,begin,end) in enumerate(pieces):
+		funcPieces.setdefault(f, []).append(idx)
+	funcOrder = sorted(funcPieces)
+
+	# Workers get a copy of the configuration, but not the accumulators
+	workerCtx = ctx.Fresh()
+
+	pool = multiprocessing.Pool(processes)
+	try:
+		# Run one job per function, and put the results back in program order.
+		def RunJobs(fromColumns, simplify, shortBranches):
+			jobs = [ ([ pieceInsns[idx] for idx in funcPieces[f] ], fromColumns, simplify, shortBranches, workerCtx) for f in funcOrder ]
+			results = [None]*len(pieces)
+			for f,res in zip(funcOrder, pool.imap(DevirtualizeFunction, jobs)):
+				for idx,r in zip(funcPieces[f], res):
+					results[idx] = r
+			return results
+
+		if relaxBranches:
+			pieceInsns = RunJobs(fromColumns, simplify, None)
+			simplified = []
+			for serialized in pieceInsns:
+				simplified.extend(DeserializeInsns(serialized))
+			segs = RunJobs(False, False, RelaxBranches(simplified, ctx))
+		else:
+			segs = RunJobs(fromColumns, simplify, frozenset())
+	finally:
+		pool.close()
+		pool.join()
+
+	return LinkSegments(segs, newImageBase, ctx)
@@ -0,0 +1,68 @@
+# Disassemble a FinSpy VM program across a pool of worker processes. The
+# program is a flat array of fixed-size records, each of which is decrypted
+# and decoded independently of the others, so we split the array into
+# chunks, have each worker decrypt and decode whole chunks into VMProgram
+# columns, and concatenate the columns back together in position order.
+from FinSpyVM import *
+from VMProgram import VMProgram
+import mmap
+import multiprocessing
+import os
+
+# Default number of VM instructions per chunk handed to a worker
+DEFAULT_CHUNK_RECORDS = 0x800
+
+# The VMSampleContext in each worker process, set once by InitWorker rather
+# than pickled along with each chunk.
+WORKER_CONTEXT = None
+
+def InitWorker(ctx):
+	global WORKER_CONTEXT
+	WORKER_CONTEXT = ctx
+
+# Worker: decrypt and decode numRecords VM instructions beginning with
+# record number firstRecord in filename. Returns the VMProgram columns of
+# the instructions (see VMProgram.Columns), and the fixups that applying
+# them logged, as a list of (dword, posList) pairs.
+def DisassembleChunk(args):
+	filename,firstRecord,numRecords = args
+
+	with open(filename, "rb") as f:
+		m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			image = DecryptImage(buffer(m, firstRecord*INSN_DESC_SIZE, numRecords*INSN_DESC_SIZE), WORKER_CONTEXT.XorVals)
+		finally:
+			m.close()
+
+	# Log this chunk's fixups into a context of its own
+	ctx = WORKER_CONTEXT.Fresh()
+	prog = VMProgram.FromImage(image, ctx, firstRecord*INSN_DESC_SIZE)
+	return (prog.Columns(), sorted(ctx.FixedUpDwords.items()))
+
+# Disassemble the VM program in filename using a pool of worker processes,
+# and return it as a VMProgram. The fixups logged by the workers are merged
+# into the fixup log of ctx in position order, i.e., exactly as if the
+# program had been disassembled sequentially.
+# * processes: number of workers (default: one per CPU)
+# * chunkRecords: number of VM instructions per chunk
+# * ctx: the VMSampleContext for the sample (default: DEFAULT_CONTEXT)
+def DisassembleParallel(filename, processes=None, chunkRecords=DEFAULT_CHUNK_RECORDS, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
+
+	# Workers get a copy of the configuration, but not the accumulators
+	numRecords = os.path.getsize(filename) // INSN_DESC_SIZE
+	chunks = [ (filename, first, min(chunkRecords, numRecords-first)) for first in xrange(0, numRecords, chunkRecords) ]
+
+	prog = VMProgram(ctx)
+	pool = multiprocessing.Pool(processes, InitWorker, (ctx.Fresh(),))
+	try:
+		# imap hands back the results in the order of the chunks
+		for columns,fixups in pool.imap(DisassembleChunk, chunks):
+			prog.ExtendColumns(columns)
+			for dword,posList in fixups:
+				ctx.FixedUpDwords[dword].extend(posList)
+	finally:
+		pool.close()
+		pool.join()
+	return prog
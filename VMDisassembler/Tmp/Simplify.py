@@ -1,72 +1,70 @@
 # Import all of the FinSpy VM object types
 from FinSpyVM import *
+from collections import deque
+
+# The predicates below examine the KIND_* tag and Operand field that each
+# VM instruction carries, rather than testing its class.
 
 # Is the VM instruction "MOV SCRATCH, 0"?
 def IsMovScratch0(insn):
-	if isinstance(insn,MovScratch0):
-		return True
-	if isinstance(insn,MovScratchImm32):
-		if insn.Imm32 == 0:
-			return True
-	return False
+	return insn.Kind == KIND_MOV_SCRATCH_IMM32 and insn.Operand == 0
 
 # Is the VM instruction "MOV SCRATCH, IMM32"?
 # Return the IMM32 if so.
 def IsMovScratchImm32(insn):
-	if isinstance(insn,MovScratch0):
-		return 0
-	if isinstance(insn,MovScratchImm32):
-		return insn.Imm32
+	if insn.Kind == KIND_MOV_SCRATCH_IMM32:
+		return insn.Operand
 	return None
 
 # Is the VM instruction "MOV SCRATCH, REG32"?
 # Return the REG32 number if so.
 def IsMovScratchReg(insn):
-	if isinstance(insn,MovScratchDisp32):
-		return insn.Disp32
-	if isinstance(insn,MovScratchDisp8):
-		return insn.Disp8
+	if insn.Kind == KIND_MOV_SCRATCH_REG:
+		return insn.Operand
 	return None
 
 # Is the VM instruction "ADD SCRATCH, REG32"?
 # Return the REG32 number if so.
 def IsAddScratchReg(insn):
-	if isinstance(insn,AddScratchDisp32):
-		return insn.Disp32
+	if insn.Kind == KIND_ADD_SCRATCH_REG:
+		return insn.Operand
 	return None
 
 # Is the VM instruction "ADD SCRATCH, IMM32"?
 # Return the IMM32 if so.
 def IsAddScratchImm32(insn):
-	if isinstance(insn,AddScratchImm32):
-		return insn.Imm32
+	if insn.Kind == KIND_ADD_SCRATCH_IMM32:
+		return insn.Operand
 	return None
 
 # Is the instruction "PUSH SCRATCH"?
 def IsPushScratch(insn):
-	return isinstance(insn,PushScratch)
+	return insn.Kind == KIND_PUSH_SCRATCH
 
 # Is the instruction "MOV REG32, SCRATCH"?
 def IsMovRegScratch(insn):
-	if isinstance(insn,MovDisp8Scratch):
-		return insn.Disp8
+	if insn.Kind == KIND_MOV_REG_SCRATCH:
+		return insn.Operand
 	return None
 
 # Create a FinSpy VM "Raw X86" instruction with the specified
 # VM instruction key and VM instruction position, given the
 # Python representation of an x86 instruction in x86Insn.
-def MakeRawX86(Pos, Key, x86Insn):
-	# Create a FinSpy VM "Raw X86" instruction with dummy
-	# content at the correct position (specified by Pos)
-	newInsn = RawX86StraightLine([0]*INSN_DESC_SIZE, Pos)
+# ctx is the sample's VMSampleContext (default: DEFAULT_CONTEXT), whose
+# encoder and decode cache are used.
+def MakeRawX86(Pos, Key, x86Insn, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
 
-	# Set the key to be the key from the first of the two
+	# Create a FinSpy VM "Raw X86" instruction with dummy
+	# content at the correct position (specified by Pos), 
+	# whose key is the key from the first of the two 
 	# instructions of the two-instruction matched sequence
-	newInsn.Key = Key
+	newInsn = RawX86StraightLine.FromFields(Pos, Key, INSN_RAWX862, 0, 0, 0, [0]*(INSN_DESC_SIZE-8), ctx)
 
 	# Encode the x86 instruction into machine code, store
 	# the bytes in the FinSpy VM instruction
-	newInsn.Remainder = EncodeInstruction(x86Insn)
+	newInsn.Remainder = EncodeInstruction(x86Insn, ctx)
 	
 	# Cache the length of the x86 instruction's machine code
 	newInsn.DataLen = len(newInsn.Remainder)
@@ -77,8 +75,10 @@ def MakeRawX86(Pos, Key, x86Insn):
 	# Return the FinSpy VM instruction just constructed
 	return newInsn
 	
-# Generic function for matching and replacing 2-instruction patterns
-def GenericSimplify2(insnArr, fMatchReplace):
+# Generic function for matching and replacing 2-instruction patterns. 
+# fMatchReplace is called with the two instructions and ctx, the sample's
+# VMSampleContext.
+def GenericSimplify2(insnArr, fMatchReplace, ctx=None):
 	# This function builds a new list of VM instructions by simplifying the 
 	# existing list.
 	newInsnArr = []
@@ -97,7 +97,7 @@ def GenericSimplify2(insnArr, fMatchReplace):
 			# Get the instruction at the next position
 			i2 = insnArr[idx+1]
 			
-			insnReplace = fMatchReplace(i1,i2)
+			insnReplace = fMatchReplace(i1,i2,ctx)
 			if insnReplace:
 			
 				# Add the new VM instruction to the output list.
@@ -119,7 +119,7 @@ def GenericSimplify2(insnArr, fMatchReplace):
 # * "MOV SCRATCH, 0" / "MOV SCRATCH, REG32", OR
 # * "MOV SCRATCH, 0" / "ADD SCRATCH, REG32"
 # Replace them with "MOV SCRATCH, REG32".
-def FirstSimplifyInner(i1, i2):
+def FirstSimplifyInner(i1, i2, ctx=None):
 	# If the first VM instruction is "MOV SCRATCH, 0"...
 	if IsMovScratch0(i1):
 				
@@ -139,13 +139,13 @@ def FirstSimplifyInner(i1, i2):
 			# Yes: make a new VM instruction, namely "MOV SCRATCH, REG32" to 
 			# replace the two instruction sequence we just matched. Use the same
 			# file offset position from the first instruction in the sequence.
-			newInsn = MovScratchDisp8([0]*INSN_DESC_SIZE, i1.Pos)
+			# The instruction is built from its fields, so its opcode is the
+			# INSN_* constant rather than one of the sample's VM opcodes.
+			newInsn = MovScratchDisp8.FromFields(i1.Pos, i1.Key, INSN_LOAD_SCRATCH_FROM_REG, 0, 0, 0, [0]*(INSN_DESC_SIZE-8), ctx)
 					
 			# Save the register number into the new instruction.
 			newInsn.Disp8 = mr
-			
-			# Use the same VM instruction key as for the first instruction.
-			newInsn.Key = i1.Key
+			newInsn.Operand = mr
 			
 			# Return the new instruction
 			return newInsn
@@ -153,13 +153,13 @@ def FirstSimplifyInner(i1, i2):
 	# Pattern didn't match, return None
 	return None
 	
-def FirstSimplify(insnArr):
-	return GenericSimplify2(insnArr, FirstSimplifyInner)
+def FirstSimplify(insnArr, ctx=None):
+	return GenericSimplify2(insnArr, FirstSimplifyInner, ctx)
 
 # Find all occurrences of:
 # * "MOV SCRATCH, REG32" / "PUSH SCRATCH, REG32"
 # Replace them with "RawX86(push reg32)".
-def SecondSimplifyInner(i1,i2):
+def SecondSimplifyInner(i1, i2, ctx=None):
 	# Is the first instruction "MOV SCRATCH, REG32"?
 	mr = IsMovScratchReg(i1)
 	if mr is not None:
@@ -169,17 +169,17 @@ def SecondSimplifyInner(i1,i2):
 			x86Insn = X86.Instruction([], XM.Push, X86.Gd(mr,True))
 			
 			# Return a VM "Raw x86" instruction
-			return MakeRawX86(i1.Pos, i1.Key, x86Insn)
+			return MakeRawX86(i1.Pos, i1.Key, x86Insn, ctx)
 	# Pattern didn't match, return None.
 	return None
 	
-def SecondSimplify(insnArr):
-	return GenericSimplify2(insnArr, SecondSimplifyInner)
+def SecondSimplify(insnArr, ctx=None):
+	return GenericSimplify2(insnArr, SecondSimplifyInner, ctx)
 
 # Find all occurrences of:
 # * "MOV SCRATCH, REG32_2" / "MOV REG32_1, SCRATCH"
 # Replace them with "RawX86(mov reg32_1, reg32_2)".
-def ThirdSimplifyInner(i1,i2):
+def ThirdSimplifyInner(i1, i2, ctx=None):
 	# Is the first instruction "MOV SCRATCH, REG32_2"?
 	mr = IsMovScratchReg(i1)
 	if mr is not None:
@@ -191,15 +191,15 @@ def ThirdSimplifyInner(i1,i2):
 			x86Insn = X86.Instruction([], XM.Mov, X86.Gd(mw,True), X86.Gd(mr,True))
 			
 			# Return a "Raw X86" VM instruction
-			return MakeRawX86(i1.Pos, i1.Key,x86Insn)
+			return MakeRawX86(i1.Pos, i1.Key, x86Insn, ctx)
 	
 	# Pattern didn't match, return None
 	return None
 
-def ThirdSimplify(insnArr):
-	return GenericSimplify2(insnArr, ThirdSimplifyInner)
+def ThirdSimplify(insnArr, ctx=None):
+	return GenericSimplify2(insnArr, ThirdSimplifyInner, ctx)
 	
-def FourthSimplifyInner(i1,i2):
+def FourthSimplifyInner(i1, i2, ctx=None):
 	# Is the first instruction "MOV SCRATCH, 0"?
 	if IsMovScratch0(i1):
 		# Is the second instruction:
@@ -210,21 +210,21 @@ def FourthSimplifyInner(i1,i2):
 			imm = IsAddScratchImm32(i2)
 		if imm is not None:
 			# If so, replace it with "MOV SCRATCH, IMM32"
-			newInsn = MovScratchImm32([0]*INSN_DESC_SIZE, i1.Pos)
+			newInsn = MovScratchImm32.FromFields(i1.Pos, i1.Key, INSN_LOAD_SCRATCH_FROM_IMM, 0, 0, 0, [0]*(INSN_DESC_SIZE-8), ctx)
 			newInsn.Imm32 = imm
-			newInsn.Key = i1.Key
+			newInsn.Operand = imm
 			return newInsn
 	
 	# Pattern didn't match, return None
 	return None
 
 	
-def FourthSimplify(insnArr):
-	return GenericSimplify2(insnArr, FourthSimplifyInner)
+def FourthSimplify(insnArr, ctx=None):
+	return GenericSimplify2(insnArr, FourthSimplifyInner, ctx)
 		
 # Find all occurrences of "MOV SCRATCH, IMM32" / "PUSH SCRATCH"
 # Replace them with Raw x86 "PUSH IMM32".
-def FifthSimplifyInner(i1,i2):
+def FifthSimplifyInner(i1, i2, ctx=None):
 	# Is the first instruction "MOV SCRATCH, IMM32"?
 	imm = IsMovScratchImm32(i1)
 	if imm is not None:
@@ -234,13 +234,13 @@ def FifthSimplifyInner(i1,i2):
 			x86Insn = X86.Instruction([], XM.Push, X86.Id(imm))
 			
 			# Return a "Raw X86" instruction"
-			return MakeRawX86(i1.Pos, i1.Key, x86Insn)
+			return MakeRawX86(i1.Pos, i1.Key, x86Insn, ctx)
 
 	# Pattern didn't match, return None
 	return None
 		
-def FifthSimplify(insnArr):
-	return GenericSimplify2(insnArr, FifthSimplifyInner)
+def FifthSimplify(insnArr, ctx=None):
+	return GenericSimplify2(insnArr, FifthSimplifyInner, ctx)
 
 # Get default segment register for a given base register
 def DefaultSeg(r):
@@ -299,9 +299,9 @@ def DecodeAddressSequence(insnArr, idx):
 		idx += 1
 
 		# Is the next VM instruction "SHL REG, [1/2/3]"?
-		if isinstance(insnArr[idx],ShlScratchImm32):
+		if insnArr[idx].Kind == KIND_SHL_SCRATCH_IMM32:
 			# Yes, copy the scale factor
-			scaleFac = insnArr[idx].Imm32
+			scaleFac = insnArr[idx].Operand
 			assert(scaleFac == 1 or scaleFac == 2 or scaleFac == 3)
 			# Increment the current index
 			idx += 1
@@ -356,18 +356,20 @@ def DecodeAccessSequence(insnArr, idx, memExpr):
 	# Save position of index within insnArr
 	oldIdx = idx
 
+	kind = insnArr[idx].Kind
+
 	# Case #1: "MOV [SCRATCH], REG32"
-	if isinstance(insnArr[idx], MovPScratchDisp8):
+	if kind == KIND_MOV_PSCRATCH_REG:
 		# mov [addrInfo], reg32 <- reg32 comes from insnArr[idx]
-		return (1,X86.Instruction([], XM.Mov, memExpr, X86.Gd(insnArr[idx].Disp8, True)))
+		return (1,X86.Instruction([], XM.Mov, memExpr, X86.Gd(insnArr[idx].Operand, True)))
 	
 	# Case #2: "MOV [SCRATCH], IMM32"
-	elif isinstance(insnArr[idx], MovPScratchImm32):
+	elif kind == KIND_MOV_PSCRATCH_IMM32:
 		# mov [addrInfo], imm32
-		return (1,X86.Instruction([], XM.Mov, memExpr, X86.Id(insnArr[idx].Imm32)))
+		return (1,X86.Instruction([], XM.Mov, memExpr, X86.Id(insnArr[idx].Operand)))
 	
 	# Remaining two cases all begin with "MOV SCRATCH, [SCRATCH]"
-	elif isinstance(insnArr[idx], MovScratchPScratch):
+	elif kind == KIND_MOV_SCRATCH_PSCRATCH:
 		idx += 1
 		
 		# Case #3: "PUSH SCRATCH"
@@ -396,7 +398,7 @@ def DecodeAccessSequence(insnArr, idx, memExpr):
 # Find all memory address patterns followed by memory access patterns.
 # Replace them with Raw X86 instructions for the corresponding 
 # pre-virtualized x86 instructions.
-def SixthSimplify(insnArr):
+def SixthSimplify(insnArr, ctx=None):
 	insnArrLen = len(insnArr)
 	newInsnArr = []
 	idx = 0
@@ -411,19 +413,175 @@ def SixthSimplify(insnArr):
 				#	print i
 				#print memExpr
 				#print insn
-				newInsnArr.append(MakeRawX86(insnArr[idx].Pos, insnArr[idx].Key, insn))
+				newInsnArr.append(MakeRawX86(insnArr[idx].Pos, insnArr[idx].Key, insn, ctx))
 				idx += lenAddr + lenAcc
 				continue
 		newInsnArr.append(insnArr[idx])
 		idx += 1
 	return newInsnArr
 
-# Apply all simplifications just discussed.
-def Simplify(insns):
-	newInsns = FirstSimplify(insns)
-	newInsns = SecondSimplify(newInsns)
-	newInsns = ThirdSimplify(newInsns)
-	newInsns = FourthSimplify(newInsns)
-	newInsns = FifthSimplify(newInsns)
-	newInsns = SixthSimplify(newInsns)
-	return newInsns
\ No newline at end of file
+# Apply all simplifications just discussed, one whole pass after another.
+def SimplifyMultiPass(insns, ctx=None):
+	newInsns = FirstSimplify(insns, ctx)
+	newInsns = SecondSimplify(newInsns, ctx)
+	newInsns = ThirdSimplify(newInsns, ctx)
+	newInsns = FourthSimplify(newInsns, ctx)
+	newInsns = FifthSimplify(newInsns, ctx)
+	newInsns = SixthSimplify(newInsns, ctx)
+	return newInsns
+
+# Build a dispatch table for a 2-instruction rewrite, mapping each pair of
+# (first kind, second kind) that could possibly match to fMatchReplace.
+def MakePairTable(fMatchReplace, kinds1, kinds2):
+	return { (k1,k2):fMatchReplace for k1 in kinds1 for k2 in kinds2 }
+
+# The 2-instruction rewrites, in the order that the passes above apply them,
+# as dispatch tables. Any pair of kinds not in a table can't match its rule,
+# so can be rejected with a single lookup.
+SIMPLIFY_PAIR_TABLES = [
+	MakePairTable(FirstSimplifyInner,
+		[KIND_MOV_SCRATCH_IMM32],
+		[KIND_MOV_SCRATCH_REG,KIND_ADD_SCRATCH_REG]),
+	MakePairTable(SecondSimplifyInner,
+		[KIND_MOV_SCRATCH_REG],
+		[KIND_PUSH_SCRATCH]),
+	MakePairTable(ThirdSimplifyInner,
+		[KIND_MOV_SCRATCH_REG],
+		[KIND_MOV_REG_SCRATCH]),
+	MakePairTable(FourthSimplifyInner,
+		[KIND_MOV_SCRATCH_IMM32],
+		[KIND_MOV_SCRATCH_IMM32,KIND_ADD_SCRATCH_IMM32]),
+	MakePairTable(FifthSimplifyInner,
+		[KIND_MOV_SCRATCH_IMM32],
+		[KIND_PUSH_SCRATCH]),
+]
+
+# The 2-instruction rewrite functions, which SimplifyStream can report the 
+# use of.
+SIMPLIFY_PAIR_RULES = [ FirstSimplifyInner, SecondSimplifyInner, ThirdSimplifyInner, FourthSimplifyInner, FifthSimplifyInner ]
+
+# The kinds that can begin a memory address sequence for SixthSimplify.
+SIXTH_SIMPLIFY_FIRST_KINDS = frozenset([KIND_MOV_SCRATCH_REG,KIND_MOV_SCRATCH_IMM32])
+
+# The most VM instructions that SixthSimplify ever looks at, starting from 
+# a given index: an address sequence is at most four instructions (MOV, SHL,
+# ADD REG32, ADD IMM32), and an access sequence is at most two.
+SIXTH_SIMPLIFY_WINDOW = 6
+
+# Try to match the memory address and access sequences at the beginning of
+# window. Returns a tuple of the number of VM instructions consumed, and the
+# "Raw X86" instruction replacing them, or None if nothing matched.
+def SixthSimplifyAt(window, ctx=None):
+	if window[0].Kind not in SIXTH_SIMPLIFY_FIRST_KINDS:
+		return None
+	dec = DecodeAddressSequence(window, 0)
+	if dec is not None:
+		lenAddr,memExpr = dec
+		acc = DecodeAccessSequence(window, lenAddr, memExpr)
+		if acc is not None:
+			lenAcc,insn = acc
+			return (lenAddr + lenAcc, MakeRawX86(window[0].Pos, window[0].Key, insn, ctx))
+	return None
+
+# Apply all simplifications just discussed, in a single walk over insns,
+# yielding the simplified instructions as they become known.
+#
+# GenericSimplify2 is a greedy, left-to-right rewrite, so each of the 
+# 2-instruction passes can be run as a stage holding at most one pending
+# instruction: when the next instruction arrives, either the pair matches
+# and the replacement moves on to the next stage, or the pending instruction
+# moves on and the new one takes its place. Chaining the stages feeds each
+# pass exactly the list that the previous pass would have produced. The 
+# sixth pass sits at the end of the chain, and only needs to see a small 
+# window of instructions ahead of the current one. The result is identical
+# to SimplifyMultiPass, without building the intermediate lists.
+#
+# Since no stage holds onto more than a few instructions, insns can be any
+# iterable (e.g., the generator returned by bytes_from_file), and the 
+# memory used doesn't depend upon the length of the program.
+#
+# ctx is the sample's VMSampleContext (default: DEFAULT_CONTEXT), with which
+# the replacement instructions are built and encoded. If usedRules is a set,
+# each of SIMPLIFY_PAIR_RULES that is called is added to it; the output
+# can't depend upon the code of any of the others.
+def SimplifyStream(insns, ctx=None, usedRules=None):
+	numStages = len(SIMPLIFY_PAIR_TABLES)
+	pending = [None]*numStages
+	
+	# The sixth pass's lookahead, and the simplified instructions that are
+	# ready to be yielded. Neither ever holds more than SIXTH_SIMPLIFY_WINDOW
+	# instructions.
+	window = deque()
+	ready = deque()
+
+	# Match and retire the instruction at the beginning of the window.
+	def RetireWindow():
+		sixth = SixthSimplifyAt(window, ctx)
+		if sixth is not None:
+			lenSeq,newInsn = sixth
+			ready.append(newInsn)
+			for n in xrange(lenSeq):
+				window.popleft()
+		else:
+			ready.append(window.popleft())
+
+	# Feed insn into the chain at the specified stage.
+	def Feed(stage, insn):
+		while stage < numStages:
+			i1 = pending[stage]
+			
+			# Nothing to pair with yet: hold onto the instruction.
+			if i1 is None:
+				pending[stage] = insn
+				return
+			
+			fMatchReplace = SIMPLIFY_PAIR_TABLES[stage].get((i1.Kind,insn.Kind))
+			insnReplace = None
+			if fMatchReplace:
+				insnReplace = fMatchReplace(i1, insn, ctx)
+				if usedRules is not None:
+					usedRules.add(fMatchReplace)
+			
+			# Matched: pass the replacement along, and start over.
+			if insnReplace:
+				pending[stage] = None
+				insn = insnReplace
+			
+			# Didn't match: pass the pending instruction along, and hold
+			# onto the new one.
+			else:
+				pending[stage] = insn
+				insn = i1
+			stage += 1
+		
+		# Out of the 2-instruction stages and into the sixth pass.
+		window.append(insn)
+		if len(window) >= SIXTH_SIMPLIFY_WINDOW:
+			RetireWindow()
+	
+	for insn in insns:
+		Feed(0, insn)
+		while ready:
+			yield ready.popleft()
+	
+	# Flush the pending instructions, earliest stage first, since flushing 
+	# a stage can feed the ones after it.
+	for stage in xrange(numStages):
+		insn = pending[stage]
+		if insn is not None:
+			pending[stage] = None
+			Feed(stage+1, insn)
+	while window:
+		RetireWindow()
+	while ready:
+		yield ready.popleft()
+
+# Simplify insns all at once, returning a list of the simplified
+# instructions.
+def Simplify(insns, ctx=None, usedRules=None):
+	return list(SimplifyStream(insns, ctx, usedRules))
+
+# Disassemble and simplify the VM program in filename (see bytes_from_file),
+# yielding the simplified instructions one at a time.
+def SimplifyFile(filename, ctx=None):
+	return SimplifyStream(bytes_from_file(filename, ctx), ctx)
@@ -0,0 +1,271 @@
+# Control-flow graph of a FinSpy VM program. The program is partitioned into
+# basic blocks, i.e., runs of consecutive VM instructions that are only ever
+# entered at the top and left at the bottom, and the blocks into functions,
+# one per VM entry in the sample's VMSampleContext. The edges come from the
+# instructions themselves:
+# * ConditionalBranch: a JMP goes to its VMTarget; a Jcc goes to its
+#   VMTarget, or falls through to the next instruction.
+# * RawX86Callout: calls the function whose VM entry is its X86Target (if
+#   that function was virtualized), then falls through.
+# * RawX86StraightLine: falls through, unless its (last) x86 instruction
+#   is a RET or an indirect JMP, which leave the function.
+# * Everything else (including RawX86Jumpout, which is an indirect call by
+#   the time we see it) falls through.
+#
+# The graph is kept in flat integer arrays rather than in Python objects per
+# block or per edge. Lists of neighbors are stored compressed: the
+# successors of block b are Succ[SuccStart[b]:SuccStart[b+1]], and likewise
+# for predecessors (Pred/PredStart), the functions that block b calls
+# (Callee/CalleeStart), and the blocks of function f (FuncBlocks/
+# FuncBlockStart).
+#
+# Blocks and functions are numbered in layout order. Blocks are identified
+# with the VM positions of their first instructions, which survive
+# simplification (the simplifier only merges straight-line instructions,
+# keeping the position of the first), so a graph built before simplifying
+# can be updated to describe the simplified program cheaply; see Update.
+from FinSpyVM import *
+from VMProgram import VMProgram
+from Pandemic.Util.ASMFlow import FlowReturn, FlowJmpIndirect, FlowJmpUnconditional
+from array import array
+import bisect
+
+# The x86 control flow types that don't continue with the next instruction
+X86_EXIT_FLOWS = (FlowReturn, FlowJmpIndirect, FlowJmpUnconditional)
+
+# The opcode bytes of the x86 instructions with X86_EXIT_FLOWS, by their
+# distance from the end of an instruction that ends with them: element k-1
+# holds the opcodes that begin the last k bytes of some encoding. (RET, RETF
+# and IRET; RET imm16 and RETF imm16; JMP rel8; JMP rel16/rel32; JMP FAR
+# ptr16:16/ptr16:32; and JMP r/m, with up to a SIB byte and a disp32.)
+EXIT_OPCODES_FROM_END = [
+	frozenset([0xC3,0xCB,0xCF]),
+	frozenset([0xEB,0xFF]),
+	frozenset([0xC2,0xCA,0xE9,0xFF]),
+	frozenset([0xFF]),
+	frozenset([0xE9,0xEA,0xFF]),
+	frozenset([0xFF]),
+	frozenset([0xEA,0xFF]),
+]
+
+# Could the last x86 instruction in the first dataLen bytes of code have one
+# of X86_EXIT_FLOWS? If not, there's no need to decode the code to find out.
+def MightExit(code, dataLen):
+	for k,opcodes in enumerate(EXIT_OPCODES_FROM_END, 1):
+		if k <= dataLen and code[dataLen-k] in opcodes:
+			return True
+	return False
+
+# Does the x86 machine code in the first dataLen bytes of code continue with
+# the next VM instruction?
+def X86FallsThrough(code, dataLen, ctx):
+	if not MightExit(code, dataLen):
+		return True
+	last = None
+	for last in ctx.DecodeCache.IterDecodeRange(bytearray(code[0:dataLen])):
+		pass
+	if last is not None and last[2] is not None:
+		ea,insnLen,x86 = last
+		return not isinstance(X86.X86DecodedInstruction(ea, x86, insnLen).flow, X86_EXIT_FLOWS)
+	return True
+
+# Does the VM instruction insn continue with the next VM instruction?
+def FallsThrough(insn, ctx):
+	if isinstance(insn, ConditionalBranch):
+		return INSN_NAME_DICT[insn.Opcode] != "JMP"
+	if isinstance(insn, RawX86StraightLine):
+		return X86FallsThrough(insn.Remainder, insn.DataLen, ctx)
+	return True
+
+# Yield (pos, key, insn, falls) for each VM instruction in insns, where falls
+# is FallsThrough(insn). When insns is a VMProgram, the straight-line x86
+# instructions aren't built at all, since disassembling their x86 is most of
+# the cost of building them, and the graph only needs their machine code; 
+# insn is None for those.
+def CFGRecords(insns, ctx):
+	if not isinstance(insns, VMProgram):
+		for insn in insns:
+			yield (insn.Pos, insn.Key, insn, FallsThrough(insn, ctx))
+		return
+	for idx in xrange(len(insns)):
+		if ctx.InsnClass(insns.Opcode[idx]) is RawX86StraightLine:
+			yield (insns.Pos[idx], insns.Key[idx], None, X86FallsThrough(insns.Remainder(idx), insns.DataLen[idx], ctx))
+		else:
+			insn = insns.View(idx)
+			yield (insn.Pos, insn.Key, insn, FallsThrough(insn, ctx))
+
+# Given a list of lists, return the compressed (start, values) arrays for it.
+def Compress(lists, typecode='i'):
+	start = array('I', [0])
+	values = array(typecode)
+	for l in lists:
+		values.extend(l)
+		start.append(len(values))
+	return start, values
+
+class VMCFG(object):
+	# Build the graph for insns, a list of FinSpy VM instructions, with the
+	# VM entries of the VMSampleContext ctx (default: DEFAULT_CONTEXT).
+	def __init__(self, insns, ctx=None):
+		if ctx is None:
+			ctx = DEFAULT_CONTEXT
+		self.Ctx = ctx
+		self.Build(insns)
+
+	# Construct all of the arrays from scratch. Looks at each instruction in
+	# insns only once, in order, so that insns may also be a VMProgram, 
+	# whose instruction objects are built on demand (see CFGRecords).
+	def Build(self, insns):
+		ctx = self.Ctx
+		numInsns = len(insns)
+
+		# For each instruction: its position, whether a block begins there,
+		# the indices of its successors if it ends a block, and the keys of
+		# the functions it calls. Branch destinations are recorded as VM 
+		# positions until all of the positions are known.
+		posArr = array('I')
+		leader = bytearray(numInsns+1)
+		leader[0] = 1
+		leader[numInsns] = 1
+		succs = dict()
+		branchTargets = []
+		callKeys = dict()
+		entries = []
+		for idx,(pos,key,insn,falls) in enumerate(CFGRecords(insns, ctx)):
+			posArr.append(pos)
+			if key in ctx.KeyToPrologueBytes:
+				leader[idx] = 1
+				entries.append((idx,key))
+			if isinstance(insn, RawX86Callout):
+				callee = ctx.VMEntryToKey.get(insn.X86Target)
+				if callee is not None:
+					callKeys[idx] = callee
+				continue
+			if isinstance(insn, ConditionalBranch) or not falls:
+				succs[idx] = [idx+1] if falls and idx+1 < numInsns else []
+				leader[idx+1] = 1
+				if isinstance(insn, ConditionalBranch) and insn.VMTarget is not None:
+					branchTargets.append((idx,insn.VMTarget))
+		posToIdx = { pos:idx for idx,pos in enumerate(posArr) }
+		for idx,pos in branchTargets:
+			dst = posToIdx[pos]
+			leader[dst] = 1
+			succs[idx].insert(0, dst)
+
+		# The blocks, identified by the positions of their first instructions.
+		self.BlockStart = array('I', (idx for idx in xrange(numInsns+1) if leader[idx]))
+		self.BlockPos = array('I', (posArr[idx] for idx in self.BlockStart[:-1]))
+		numBlocks = len(self.BlockPos)
+		idxToBlock = { idx:b for b,idx in enumerate(self.BlockStart) }
+
+		# Edges. A block whose last instruction doesn't transfer control
+		# elsewhere falls through to the next block.
+		blockSuccs = []
+		calls = []
+		for b in xrange(numBlocks):
+			begin,end = self.BlockStart[b],self.BlockStart[b+1]
+			last = end-1
+			if last in succs:
+				blockSuccs.append([ idxToBlock[idx] for idx in succs[last] ])
+			else:
+				blockSuccs.append([b+1] if b+1 < numBlocks else [])
+			calls.append([ callKeys[idx] for idx in xrange(begin,end) if idx in callKeys ])
+		self.SuccStart, self.Succ = Compress(blockSuccs)
+		preds = [ [] for b in xrange(numBlocks) ]
+		for b,l in enumerate(blockSuccs):
+			for s in l:
+				preds[s].append(b)
+		self.PredStart, self.Pred = Compress(preds)
+
+		# Functions, in layout order of their entries. Entries that aren't in
+		# the program have no function.
+		self.FuncKey = array('I', (key for idx,key in entries))
+		self.FuncEntry = array('i', (idxToBlock[idx] for idx,key in entries))
+		self.KeyToFunc = { key:f for f,key in enumerate(self.FuncKey) }
+		self.CalleeStart, self.Callee = Compress([ [ self.KeyToFunc[key] for key in l if key in self.KeyToFunc ] for l in calls ])
+
+		# Each function owns the blocks reachable from its entry, other than
+		# those owned by functions with earlier entries (and other
+		# functions' entries). Blocks that no entry reaches belong to the
+		# function of the block before them.
+		blockFunc = array('i', [-1]*numBlocks)
+		for f,b in enumerate(self.FuncEntry):
+			blockFunc[b] = f
+		for f,b in enumerate(self.FuncEntry):
+			stack = [b]
+			while stack:
+				b = stack.pop()
+				for s in self.Successors(b):
+					if blockFunc[s] == -1:
+						blockFunc[s] = f
+						stack.append(s)
+		for b in xrange(1, numBlocks):
+			if blockFunc[b] == -1:
+				blockFunc[b] = blockFunc[b-1]
+		self.BlockFunc = blockFunc
+		funcBlocks = [ [] for f in xrange(len(self.FuncKey)) ]
+		for b,f in enumerate(blockFunc):
+			if f != -1:
+				funcBlocks[f].append(b)
+		self.FuncBlockStart, self.FuncBlocks = Compress(funcBlocks)
+
+	# Describe the simplified version, insns, of the program that the graph
+	# was built for. If the first instruction of every block survived
+	# simplification, only the instruction indices of the blocks change,
+	# and that is all this recomputes. Otherwise, it rebuilds the graph.
+	# Returns True if the update was incremental.
+	def Update(self, insns):
+		blockStart = array('I')
+		blockPos = self.BlockPos
+		numBlocks = len(blockPos)
+		b = 0
+		for idx,insn in enumerate(insns):
+			if b < numBlocks and insn.Pos == blockPos[b]:
+				blockStart.append(idx)
+				b += 1
+		if b != numBlocks or (numBlocks > 0 and blockStart[0] != 0):
+			self.Build(insns)
+			return False
+		blockStart.append(len(insns))
+		self.BlockStart = blockStart
+		return True
+
+	def NumBlocks(self):
+		return len(self.BlockPos)
+
+	def NumFunctions(self):
+		return len(self.FuncKey)
+
+	def Successors(self, b):
+		return self.Succ[self.SuccStart[b]:self.SuccStart[b+1]]
+
+	def Predecessors(self, b):
+		return self.Pred[self.PredStart[b]:self.PredStart[b+1]]
+
+	# The functions that block b calls
+	def Callees(self, b):
+		return self.Callee[self.CalleeStart[b]:self.CalleeStart[b+1]]
+
+	# The blocks of function f, in layout order
+	def FunctionBlocks(self, f):
+		return self.FuncBlocks[self.FuncBlockStart[f]:self.FuncBlockStart[f+1]]
+
+	# The function whose VM entry has the specified key, or None
+	def FunctionOfKey(self, key):
+		return self.KeyToFunc.get(key)
+
+	# The block containing the instruction at index idx
+	def BlockOfIndex(self, idx):
+		return bisect.bisect_right(self.BlockStart, idx)-1
+
+	# The instructions of block b within insns, the program that the graph
+	# describes
+	def BlockInsns(self, b, insns):
+		return insns[self.BlockStart[b]:self.BlockStart[b+1]]
+
+	# The instructions of function f within insns, in layout order
+	def FunctionInsns(self, f, insns):
+		res = []
+		for b in self.FunctionBlocks(f):
+			res.extend(self.BlockInsns(b, insns))
+		return res
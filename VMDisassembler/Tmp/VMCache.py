@@ -0,0 +1,250 @@
+# On-disk cache of disassembled and simplified FinSpy VM programs. Entries
+# are named by a hash of the input file's contents, of the configuration
+# used to decode it (XOR key, imagebase, .text bounds, opcode map), and of
+# the source code of the decoder and the simplifier, so any change to one of
+# those simply misses the cache. Entries are stored with marshal, which loads
+# far faster than decrypting, disassembling, and simplifying the program
+# again.
+from FinSpyVM import *
+from Simplify import Simplify
+from VMProgram import VMProgram
+from ParallelDisasm import DisassembleParallel
+import hashlib
+import marshal
+import os
+import sys
+
+# Version of the cache file format itself
+CACHE_FORMAT_VERSION = 1
+
+# Default location for cache entries, relative to the input file
+CACHE_DIR_NAME = ".vmcache"
+
+# The modules whose code determines how a VM program is decoded: the VM
+# instruction classes, and the parts of the x86 library that they use to
+# decode and encode x86 machine code.
+DECODE_MODULES = [
+	"FinSpyVM",
+	"VMProgram",
+	"Pandemic.Util.Visitor",
+	"Pandemic.X86.X86",
+	"Pandemic.X86.X86ByteStream",
+	"Pandemic.X86.X86DecodeCache",
+	"Pandemic.X86.X86DecodeTable",
+	"Pandemic.X86.X86Decoder",
+	"Pandemic.X86.X86EncodeTable",
+	"Pandemic.X86.X86Encoder",
+	"Pandemic.X86.X86Internal",
+	"Pandemic.X86.X86InternalOperand",
+	"Pandemic.X86.X86InternalOperandDescriptions",
+	"Pandemic.X86.X86MetaData",
+	"Pandemic.X86.X86ModRM",
+	"Pandemic.X86.X86TypeChecker",
+]
+
+# The modules whose code determines how a VM program is simplified
+SIMPLIFY_MODULES = [
+	"Simplify",
+]
+
+# Hash the source files of the named modules, importing them if need be.
+def SourceHash(moduleNames):
+	h = hashlib.sha1()
+	for name in moduleNames:
+		__import__(name)
+		path = sys.modules[name].__file__
+		if path.endswith(".pyc") or path.endswith(".pyo"):
+			if os.path.exists(path[:-1]):
+				path = path[:-1]
+		with open(path, "rb") as f:
+			h.update(name)
+			h.update(f.read())
+	return h.hexdigest()
+
+# Types of global values that CodeHash treats as plain data
+CODE_HASH_DATA_TYPES = (int, long, float, bool, str, unicode, tuple, list, dict, set, frozenset, type(None))
+
+# Return a repr of the plain data value v that doesn't depend upon the order
+# of dicts and sets, naming any functions and classes within it.
+def DataRepr(v):
+	if isinstance(v, dict):
+		return "{%s}" % ",".join(sorted("%s:%s" % (DataRepr(k),DataRepr(x)) for k,x in v.iteritems()))
+	if isinstance(v, (set,frozenset)):
+		return "set(%s)" % ",".join(sorted(DataRepr(x) for x in v))
+	if isinstance(v, (tuple,list)):
+		return "(%s)" % ",".join(DataRepr(x) for x in v)
+	if isinstance(v, CODE_HASH_DATA_TYPES):
+		return repr(v)
+	return getattr(v, "__name__", type(v).__name__)
+
+# Hash the code of the function or class obj: its bytecode and constants,
+# and those of each function and class that it refers to by name and that
+# is defined in obj's own module or in one of modules, recursively, along
+# with the plain data values of the globals that any of them refer to.
+# Anything in exclude is left out. Code from other modules isn't followed
+# (see SourceHash for that).
+def CodeHash(obj, modules=(), exclude=()):
+	modules = set(modules) | set([obj.__module__])
+	seen = set(id(x) for x in exclude)
+	h = hashlib.sha1()
+
+	def HashCode(code, globals):
+		h.update(marshal.dumps((code.co_code, code.co_names, code.co_varnames, code.co_argcount, code.co_flags)))
+		for c in code.co_consts:
+			if hasattr(c, "co_code"):
+				HashCode(c, globals)
+			else:
+				h.update(DataRepr(c))
+		for name in code.co_names:
+			if name in globals:
+				HashObject(name, globals[name])
+
+	def HashObject(name, v):
+		if id(v) in seen:
+			return
+		seen.add(id(v))
+		h.update(name)
+		if hasattr(v, "func_code"):
+			if v.__module__ in modules:
+				HashCode(v.func_code, v.func_globals)
+		elif isinstance(v, type):
+			if v.__module__ in modules:
+				for k in sorted(v.__dict__):
+					HashObject(k, v.__dict__[k])
+		elif isinstance(v, (staticmethod,classmethod)):
+			HashObject(name, v.__func__)
+		elif isinstance(v, CODE_HASH_DATA_TYPES):
+			h.update(DataRepr(v))
+
+	HashObject(obj.__name__, obj)
+	return h.hexdigest()
+
+# Hash everything, other than the input itself and the simplifier, that
+# determines the output of decoding a VM program with the VMSampleContext
+# ctx.
+def DecodeConfigHash(ctx):
+	config = (
+		INSN_DESC_SIZE,
+		PREAMBLE_SKIP,
+		tuple(ctx.XorVals),
+		ctx.ImageBase,
+		ctx.TextBegin,
+		ctx.TextEnd,
+		tuple(sorted(ctx.OpcodeMap.items())),
+		tuple(sorted((opc,cls.__name__) for opc,cls in INSN_CONSTRUCTOR_PAIRS)),
+		CACHE_FORMAT_VERSION,
+		SourceHash(DECODE_MODULES),
+	)
+	return hashlib.sha1(repr(config)).hexdigest()
+
+# Hash everything, other than the input itself, that determines the output
+# of decoding and simplifying a VM program with the VMSampleContext ctx.
+def ConfigHash(ctx):
+	return hashlib.sha1(DecodeConfigHash(ctx) + SourceHash(SIMPLIFY_MODULES)).hexdigest()
+
+# Hash the contents of the input file.
+def InputHash(filename):
+	h = hashlib.sha1()
+	with open(filename, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 20), ""):
+			h.update(chunk)
+	return h.hexdigest()
+
+# Get the name of the cache entry for the input file.
+def CachePath(filename, ctx, cacheDir=None):
+	if cacheDir is None:
+		cacheDir = os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIR_NAME)
+	return os.path.join(cacheDir, "%s-%s.simp" % (InputHash(filename), ConfigHash(ctx)))
+
+# Map class names back to classes for deserialization.
+INSN_CLASS_DICT = { cls.__name__:cls for opc,cls in INSN_CONSTRUCTOR_PAIRS }
+
+# Convert instructions into rows of plain values for marshal. Instructions
+# of the same class with the same attributes share a schema, which names 
+# the class and attributes once, so that each row only holds the index of
+# its schema followed by the attribute values. Byte arrays (e.g., Remainder,
+# and the machine code in Instruction) are stored as strings, and come back
+# as bytearrays.
+def SerializeInsns(insns):
+	schemas = []
+	schemaDict = dict()
+	rows = []
+	for insn in insns:
+		names = tuple(sorted(insn.__dict__.iterkeys()))
+		schema = (insn.__class__.__name__, names)
+		schemaIdx = schemaDict.get(schema)
+		if schemaIdx is None:
+			schemaIdx = schemaDict[schema] = len(schemas)
+			schemas.append(schema)
+		row = [schemaIdx]
+		for name in names:
+			value = insn.__dict__[name]
+			if isinstance(value, bytearray) or isinstance(value, list):
+				value = ("B", str(bytearray(value)))
+			row.append(value)
+		rows.append(tuple(row))
+	return (schemas, rows)
+
+# Inverse of SerializeInsns.
+def DeserializeInsns(serialized):
+	schemas,rows = serialized
+	schemas = [ (INSN_CLASS_DICT[className],names) for className,names in schemas ]
+	insns = []
+	for row in rows:
+		cls,names = schemas[row[0]]
+		insn = cls.__new__(cls)
+		for name,value in zip(names, row[1:]):
+			if isinstance(value, tuple):
+				value = bytearray(value[1])
+			insn.__dict__[name] = value
+		insns.append(insn)
+	return insns
+
+# Try to load a cache entry. Returns None if there is no usable entry.
+def LoadEntry(path):
+	try:
+		with open(path, "rb") as f:
+			return marshal.load(f)
+	except (IOError, EOFError, ValueError, TypeError):
+		return None
+
+# Write a cache entry. The entry is written under a temporary name and then
+# renamed into place, so a concurrent reader never sees half of one.
+def StoreEntry(path, entry):
+	cacheDir = os.path.dirname(path)
+	if not os.path.isdir(cacheDir):
+		os.makedirs(cacheDir)
+	tmpPath = "%s.%d.tmp" % (path, os.getpid())
+	with open(tmpPath, "wb") as f:
+		marshal.dump(entry, f)
+	os.rename(tmpPath, path)
+
+# Decrypt, disassemble, and simplify the VM program in filename, or load the
+# result from the cache if it's there. Either way, the imagebase fixups that
+# loading the program would have logged are added to the fixup log of ctx
+# (default: DEFAULT_CONTEXT, whose log is ALL_FIXED_UP_DWORDS). If processes
+# is specified, disassemble with that many worker processes on a cache miss
+# (see ParallelDisasm).
+def LoadSimplified(filename, cacheDir=None, processes=None, ctx=None):
+	if ctx is None:
+		ctx = DEFAULT_CONTEXT
+	path = CachePath(filename, ctx, cacheDir)
+	entry = LoadEntry(path)
+
+	# Cache hit: rebuild the instructions and replay the fixup log
+	if entry is not None:
+		serialized,fixups = entry
+		for dword,posList in fixups:
+			ctx.FixedUpDwords[dword].extend(posList)
+		return DeserializeInsns(serialized)
+
+	# Cache miss: do the work, keeping track of the fixups it logs
+	before = { dword:len(posList) for dword,posList in ctx.FixedUpDwords.items() }
+	if processes is not None:
+		insns = Simplify(DisassembleParallel(filename, processes, ctx=ctx), ctx)
+	else:
+		insns = Simplify(VMProgram.FromFile(filename, ctx), ctx)
+	fixups = [ (dword,posList[before.get(dword,0):]) for dword,posList in sorted(ctx.FixedUpDwords.items()) if len(posList) > before.get(dword,0) ]
+
+	StoreEntry(path, (SerializeInsns(insns), fixups))
+	return insns
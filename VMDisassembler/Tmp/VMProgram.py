@@ -0,0 +1,152 @@
+# Compact, columnar representation of a FinSpy VM program. Rather than
+# constructing one Python object per VM instruction up front, we keep the
+# decoded header fields in parallel typed arrays, and the (fixed-up) 
+# instruction bodies in one shared buffer. Instruction objects are only
+# built when something asks for one.
+from FinSpyVM import *
+from array import array
+from collections import deque
+
+# Number of recently-built instruction views to keep around. The 
+# simplifier looks at each instruction several times in a row as its
+# patterns slide across the program; this avoids rebuilding (and 
+# re-disassembling) the same instruction for each of those looks.
+VIEW_CACHE_SIZE = 8
+
+class VMProgram(object):
+	# ctx is the VMSampleContext for the sample (default: DEFAULT_CONTEXT)
+	def __init__(self, ctx=None):
+		if ctx is None:
+			ctx = DEFAULT_CONTEXT
+		self.Ctx = ctx
+
+		# Parallel arrays, one element per VM instruction
+		self.Pos      = array('I')
+		self.Key      = array('I')
+		self.Opcode   = array('B')
+		self.DataLen  = array('B')
+		self.Op1Fixup = array('B')
+		self.Op2Fixup = array('B')
+		
+		# Shared buffer holding the decrypted records. The body of the
+		# instruction at index idx begins at idx*INSN_DESC_SIZE+8.
+		self.Payload  = bytearray()
+
+		# Recently-built views, and the order in which they were built
+		self._views = dict()
+		self._viewOrder = deque()
+	
+	# Build a program from a decrypted image, as returned by LoadVMImage.
+	# The image becomes the shared payload buffer; fixups are applied to it
+	# in place (and logged, as usual) exactly once, here. basePos is the 
+	# position of the image's first record within the whole program.
+	@staticmethod
+	def FromImage(image, ctx=None, basePos=0):
+		prog = VMProgram(ctx)
+		num = len(image) // INSN_DESC_SIZE
+		image = image[:num*INSN_DESC_SIZE] if len(image) != num*INSN_DESC_SIZE else image
+
+		# Each record is six DWORDs; the key is the first of them. The byte
+		# fields are pulled out with strided slices.
+		dwords = array('I')
+		dwords.fromstring(str(image))
+		prog.Key      = dwords[0::INSN_DESC_SIZE/4]
+		prog.Pos      = array('I', xrange(basePos, basePos+num*INSN_DESC_SIZE, INSN_DESC_SIZE))
+		prog.Opcode   = array('B', image[4::INSN_DESC_SIZE])
+		prog.DataLen  = array('B', image[5::INSN_DESC_SIZE])
+		prog.Op1Fixup = array('B', image[6::INSN_DESC_SIZE])
+		prog.Op2Fixup = array('B', image[7::INSN_DESC_SIZE])
+		prog.Payload  = image
+
+		# Apply the imagebase fixups, in the same order that constructing the
+		# instruction objects one-by-one would have.
+		op1Fixups,op2Fixups = prog.Op1Fixup,prog.Op2Fixup
+		for idx in xrange(num):
+			if op1Fixups[idx] or op2Fixups[idx]:
+				base = idx*INSN_DESC_SIZE + 8
+				if op1Fixups[idx]:
+					ApplyFixup(image, base + (op1Fixups[idx] & 0x7F), prog.Pos[idx], prog.Ctx)
+				if op2Fixups[idx]:
+					ApplyFixup(image, base + (op2Fixups[idx] & 0x7F), prog.Pos[idx], prog.Ctx)
+		return prog
+	
+	# Map, decrypt, and build a program from a file.
+	@staticmethod
+	def FromFile(filename, ctx=None):
+		if ctx is None:
+			ctx = DEFAULT_CONTEXT
+		return VMProgram.FromImage(LoadVMImage(filename, ctx.XorVals), ctx)
+
+	# Return the fields of the instructions with indices in [begin,end), as
+	# a tuple of arrays and a bytearray from which FromColumns can rebuild
+	# them. This is far cheaper to pickle than the instruction objects, for
+	# handing pieces of a program to worker processes.
+	def Columns(self, begin=0, end=None):
+		if end is None:
+			end = len(self)
+		return (self.Pos[begin:end], self.Key[begin:end], self.Opcode[begin:end],
+			self.DataLen[begin:end], self.Op1Fixup[begin:end], self.Op2Fixup[begin:end],
+			self.Payload[begin*INSN_DESC_SIZE:end*INSN_DESC_SIZE])
+
+	# Build a program from the result of Columns. The fixups were applied
+	# when the columns were first loaded, so they are not applied again.
+	@staticmethod
+	def FromColumns(columns, ctx=None):
+		prog = VMProgram(ctx)
+		prog.Pos,prog.Key,prog.Opcode,prog.DataLen,prog.Op1Fixup,prog.Op2Fixup,prog.Payload = columns
+		return prog
+
+	# Append the instructions in the result of Columns to the program.
+	def ExtendColumns(self, columns):
+		pos,key,opcode,dataLen,op1Fixup,op2Fixup,payload = columns
+		self.Pos.extend(pos)
+		self.Key.extend(key)
+		self.Opcode.extend(opcode)
+		self.DataLen.extend(dataLen)
+		self.Op1Fixup.extend(op1Fixup)
+		self.Op2Fixup.extend(op2Fixup)
+		self.Payload.extend(payload)
+
+	def __len__(self):
+		return len(self.Opcode)
+	
+	# Return a copy of the body (everything after the 8-byte header) of the
+	# instruction at index idx.
+	def Remainder(self, idx):
+		base = idx*INSN_DESC_SIZE + 8
+		return self.Payload[base:base+INSN_DESC_SIZE-8]
+
+	# Build the instruction object for the instruction at index idx.
+	def View(self, idx):
+		opcode = self.Ctx.CanonicalOpcode(self.Opcode[idx])
+		return INSN_CONSTRUCTOR_DICT[opcode].FromFields(
+			self.Pos[idx],
+			self.Key[idx],
+			opcode,
+			self.DataLen[idx],
+			self.Op1Fixup[idx],
+			self.Op2Fixup[idx],
+			self.Remainder(idx),
+			self.Ctx)
+	
+	# Indexing returns instruction views, so that code written against lists
+	# of instruction objects (e.g., Simplify and RebuildX86) runs unmodified.
+	def __getitem__(self, idx):
+		if isinstance(idx, slice):
+			return [ self[i] for i in xrange(*idx.indices(len(self))) ]
+		if idx < 0:
+			idx += len(self)
+		if idx < 0 or idx >= len(self):
+			raise IndexError(idx)
+		insn = self._views.get(idx)
+		if insn is None:
+			insn = self.View(idx)
+			self._views[idx] = insn
+			self._viewOrder.append(idx)
+			if len(self._viewOrder) > VIEW_CACHE_SIZE:
+				del self._views[self._viewOrder.popleft()]
+		return insn
+
+	def __iter__(self):
+		for idx in xrange(len(self)):
+			yield self.View(idx)
@@ -44,7 +44,7 @@ WINMAIN_VIRTUALIZED_ADDRESS = 0x00406154
 #newInsns = list(bytes_from_file("Tmp/dec.bin"))
 #print repr(ExtractCalloutTargets(newInsns, WINMAIN_VIRTUALIZED_ADDRESS))
 
-KEY_TO_X86_VMENTRY_AND_KEY_TO_X86_VMENTRY_AND_PROLOGUE_BYTES_TUPLES = [
+KEY_TO_X86_VMENTRY_AND_PROLOGUE_BYTES_TUPLES = [
 # MANUALLY-ADDED ENTRIES:
 (0x5A2A19,0x405022,[0x8B,0x65,0xE8,0xC7,0x45,0xC0,0x01,0x00,0x00,0x00,0x83,0x4D,0xFC,0xFF,0x33,0xF6]),
 (0x5A3FA0,0x4060E6,[]),
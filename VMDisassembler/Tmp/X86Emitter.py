@@ -0,0 +1,69 @@
+# Machine code emitter used when rebuilding x86 from FinSpy VM programs.
+# The code is kept in a growable bytearray (one byte per byte of machine
+# code, rather than one Python object per byte as with a list), and
+# displacements are patched in place with struct.pack_into.
+from array import array
+import itertools
+import struct
+
+# A list of fixups, i.e., triples of:
+# * src: the VM position of the instruction containing the fixup
+# * off: the distance into the devirtualized instruction where the
+#        DWORD to fix up is located
+# * dst: the fixup's target, interpreted by whoever processes the list
+# Stored as three parallel typed arrays, rather than a list of tuples.
+class FixupList(object):
+	def __init__(self):
+		self.Src = array('I')
+		self.Off = array('I')
+		self.Dst = array('I')
+
+	def append(self, fixup):
+		src,off,dst = fixup
+		self.Src.append(src)
+		self.Off.append(off)
+		self.Dst.append(dst)
+
+	def __len__(self):
+		return len(self.Src)
+
+	def __iter__(self):
+		return itertools.izip(self.Src, self.Off, self.Dst)
+
+class X86Emitter(object):
+	def __init__(self):
+		# The machine code emitted thus far
+		self.Code = bytearray()
+
+	# The current position within the machine code
+	def Pos(self):
+		return len(self.Code)
+
+	def __len__(self):
+		return len(self.Code)
+
+	# Emit a single byte
+	def EmitByte(self, b):
+		self.Code.append(b)
+
+	# Emit a sequence of bytes (any sequence of integers, or a bytearray)
+	def EmitBytes(self, bytes):
+		self.Code.extend(bytes)
+
+	# Emit a little-endian DWORD
+	def EmitDword(self, dword):
+		self.Code.extend(struct.pack("<L", dword & 0xFFFFFFFF))
+
+	# Overwrite the little-endian DWORD at pos
+	def StoreDword(self, pos, dword):
+		struct.pack_into("<L", self.Code, pos, dword & 0xFFFFFFFF)
+
+	# Overwrite the DWORD at pos with the displacement from the end of that
+	# DWORD to dst, as in an x86 JMP/Jcc/CALL rel32
+	def StoreRel32(self, pos, dst):
+		self.StoreDword(pos, dst-(pos+4))
+
+	# Overwrite the byte at pos with the displacement from the end of that
+	# byte to dst, as in an x86 JMP/Jcc rel8. The displacement must fit.
+	def StoreRel8(self, pos, dst):
+		struct.pack_into("<b", self.Code, pos, dst-(pos+1))
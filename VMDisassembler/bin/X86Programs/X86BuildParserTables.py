@@ -0,0 +1,11 @@
+#!/usr/bin/python
+import sys
+from Pandemic.X86.X86Parser import BuildTables, tabdir
+
+if len(sys.argv) > 2:
+	print "Usage: %s [output directory]" % sys.argv[0]
+	sys.exit()
+
+outputdir = tabdir if len(sys.argv) == 1 else sys.argv[1]
+BuildTables(outputdir)
+print "Wrote X86ParseTab.py and X86LexTab.py to %s" % outputdir
@@ -2,15 +2,36 @@
 import sys
 from Pandemic.X86.X86Parser import parser
 from Pandemic.X86.X86Encoder import X86Encoder
+from Pandemic.X86.X86Assembler import X86Assembler, X86AssemblerError
 
-if(len(sys.argv) == 1 or len(sys.argv) > 3):
+def usage():
 	print "Usage: %s \"instruction to encode\" [optional address]" % sys.argv[0]
+	print "       %s -b|--batch [file, or - for stdin] [optional address]" % sys.argv[0]
+	sys.exit()
+
+if len(sys.argv) > 1 and sys.argv[1] in ("-b","--batch"):
+	if len(sys.argv) > 4:
+		usage()
+	name = "-" if len(sys.argv) < 3 else sys.argv[2]
+	addr = 0 if len(sys.argv) < 4 else int(sys.argv[3])
+	f = sys.stdin if name == "-" else open(name)
+	try:
+		bytes,linemap = X86Assembler().Assemble(f,addr)
+	except X86AssemblerError, e:
+		print "%s: %s" % (name,e)
+		sys.exit(1)
+	for lineno,a,offset,instr,length in linemap:
+		print "%08lx %6d  %-24s %s" % (a,offset," ".join("%02x" % b for b in bytes[offset:offset+length]),instr)
+	print "%d bytes: %s" % (len(bytes),"".join("%02x" % b for b in bytes))
 	sys.exit()
 
-res = parser.parse(sys.argv[1])
+if(len(sys.argv) == 1 or len(sys.argv) > 3):
+	usage()
+
+res = parser.Parse(sys.argv[1])
 addr = 0 if len(sys.argv)==2 else int(sys.argv[2])
 bytes = X86Encoder().EncodeInstruction(res,addr)
 print res, "(%r) encoded as [" % res,
 for b in bytes:
 	print "%#02lx" % b,
-print "]"
\ No newline at end of file
+print "]"